@@ -0,0 +1,11 @@
+#!/usr/bin/python2.7 -OOBRtt
+import sys
+
+from pysec import load
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print >> sys.stderr, "usage: %s <TEXT_TAB> <COMPILED_TAB>" % sys.argv[0]
+        sys.exit(1)
+    load.compile_tab(sys.argv[1], sys.argv[2])
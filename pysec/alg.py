@@ -17,13 +17,20 @@
 # limitations under the License.
 #
 # -*- coding: ascii -*-
-from itertools import islice
-from zlib import adler32
+from collections import deque
+from itertools import chain, islice, izip, tee
+import mmap
 
+from pysec.core import Object
+from pysec.core.memory import Memory
 from pysec.utils import xrange
 
 
-__all__ = 'knp', 'knp_first', 'knp_find', 'rk', 'rk_first', 'rk_find'
+__all__ = 'knp', 'knp_first', 'knp_find', 'rk', 'rk_first', 'rk_find', \
+          'bmh', 'bmh_first', 'bmh_find', 'two_way', 'two_way_first', \
+          'two_way_find', 'search', 'search_first', 'search_find', \
+          'search_native', 'select', 'Blocks', 'blocks', 'AhoCorasick', \
+          'multi_search'
 
 
 def knp(source, pattern, start=0, stop=None):
@@ -37,7 +44,11 @@ def knp(source, pattern, start=0, stop=None):
     # search pattern
     mlen = 0
     plen = len(pattern)
-    for sub in islice(source, start, stop):
+    if isinstance(source, _RANDOM) or not hasattr(source, '__getitem__'):
+        items = islice(source, start, stop)
+    else:
+        items = chain.from_iterable(blocks(source).chunks(start, stop))
+    for sub in items:
         while mlen == plen or mlen >= 0 and pattern[mlen] != sub:
             sl = shifts[mlen]
             start += sl
@@ -63,23 +74,99 @@ def knp_find(source, pattern, start=0, stop=None):
     return 0
 
 
-def rk(source, pattern, start=0, stop=None, checksum=adler32):
+# modulus and base of the rolling hash of rk
+RK_MOD = 2 ** 61 - 1
+RK_BASE = 257
+
+# size of the blocks read from the sources without random access
+BLOCK_SIZE = 2 ** 16
+
+# sources that are scanned in place by AhoCorasick
+_BUFFERS = str, bytearray, mmap.mmap, Memory
+
+# sources with random access, the others are read through Blocks
+# (pysec.core.memory.Memory returns integers for its items)
+_RANDOM = str, bytearray, mmap.mmap, list, tuple
+
+# patterns shorter than this are searched by two-way in search(), the longer
+# ones by Boyer-Moore-Horspool
+TW_MAX_LEN = 8
+
+
+def _bounds(source, start, stop):
+    """Returns the normalized (start, stop) of source[start:stop]"""
+    start, stop, _ = slice(start, stop).indices(len(source))
+    return start, stop
+
+
+def _search(algorithm, source, pattern, start, stop):
+    """Yields the occurrences of pattern in source[start:stop] found by
+    algorithm(text, pattern, start, stop), text is blocks(source)"""
+    start, stop = _bounds(source, start, stop)
+    if not pattern:
+        raise ValueError("empty pattern")
+    if stop - start < len(pattern):
+        return iter(())
+    return algorithm(blocks(source), pattern, start, stop)
+
+
+def _rk(text, pattern, start, stop):
+    """Rabin-Karp with a polynomial rolling hash"""
+    plen = len(pattern)
+    if isinstance(text, Blocks):
+        chunks = text.chunks(start, stop)
+    elif isinstance(text, _BUFFERS):
+        chunks = buffer(text, start, stop - start),
+    else:
+        chunks = text[start:stop],
+    if isinstance(pattern, str):
+        values = bytearray(pattern)
+        items = chain.from_iterable(bytearray(chunk) for chunk in chunks)
+    else:
+        values = [hash(item) for item in pattern]
+        items = (hash(item) for item in chain.from_iterable(chunks))
+    leaving, entering = tee(items)
+    pat_hash = hsh = 0
+    for value, item in izip(values, entering):
+        pat_hash = (pat_hash * RK_BASE + value) % RK_MOD
+        hsh = (hsh * RK_BASE + item) % RK_MOD
+    # weight of the value leaving the window
+    top = pow(RK_BASE, plen - 1, RK_MOD)
+    pos = start
+    for old, new in izip(leaving, entering):
+        if hsh == pat_hash and text[pos:pos+plen] == pattern:
+            yield pos
+        hsh = ((hsh - old * top) * RK_BASE + new) % RK_MOD
+        pos += 1
+    if hsh == pat_hash and text[pos:pos+plen] == pattern:
+        yield pos
+
+
+def _rk_checksum(checksum):
+    """Rabin-Karp that recomputes checksum over every window"""
+    def _rk_checksum(text, pattern, start, stop):
+        plen = len(pattern)
+        pat_checksum = checksum(pattern)
+        i = start
+        stop -= plen
+        while i <= stop:
+            if checksum(text[i:i + plen]) == pat_checksum and \
+               text[i:i + plen] == pattern:
+                yield i
+            i += 1
+    return _rk_checksum
+
+
+def rk(source, pattern, start=0, stop=None, checksum=None):
     """Return a generator that yields all oocurrencies of pattern in
     source[start:stop] using the Rabin-Karp algorithm.
-    hasher is a callable that returns the object checksum."""
-    if stop is None:
-        stop = len(source)
-    src_len = stop - start
-    pat_len = len(pattern)
-    pat_checksum = checksum(pattern)
-    if pat_len > src_len or start > stop:
-        return iter(())
-    return (i for i in xrange(start, src_len - pat_len + 1)
-            if checksum(source[i:i + pat_len]) == pat_checksum and
-               source[i:i + pat_len] == pattern)
+    If checksum is None a rolling hash is used, otherwise checksum is a
+    callable that returns the object checksum, computed for every window."""
+    return _search(_rk if checksum is None else _rk_checksum(checksum),
+                   source, pattern, start, stop)
 
 
-def rk_first(source, pattern, start=0, stop=None, checksum=adler32):
+def rk_first(source, pattern, start=0, stop=None, checksum=None):
     """Return the index of the first occurrence of pattern in 
     source[start:stop] using the Rabin-Karp algorithm.
     hasher is a callable that returns the object checksum."""
@@ -89,8 +176,7 @@ def rk_first(source, pattern, start=0, stop=None, checksum=adler32):
         return -1
 
 
-def rk_find(source, pattern, start=0, stop=None, checksum=adler32):
-    """Return a true value if find the pattern in source"""
+def rk_find(source, pattern, start=0, stop=None, checksum=None):
     """Return a true value if pattern is present in source[start:stop] using
     the Rabin-Karp algorithm.
     hasher is a callable that returns the object checksum."""
@@ -98,3 +184,412 @@ def rk_find(source, pattern, start=0, stop=None, checksum=adler32):
         return 1
     return 0
 
+
+def _bmh(text, pattern, start, stop):
+    """Boyer-Moore-Horspool"""
+    plen = len(pattern)
+    shifts = {}
+    for i, item in enumerate(pattern[:-1]):
+        shifts[item] = plen - 1 - i
+    get_shift = shifts.get
+    last = pattern[-1]
+    pos = start
+    stop -= plen
+    while pos <= stop:
+        item = text[pos + plen - 1]
+        if item == last and text[pos:pos+plen] == pattern:
+            yield pos
+        pos += get_shift(item, plen)
+
+
+def bmh(source, pattern, start=0, stop=None):
+    """Yields all occurrences of pattern in source[start:stop] using the
+    Boyer-Moore-Horspool algorithm"""
+    return _search(_bmh, source, pattern, start, stop)
+
+
+def bmh_first(source, pattern, start=0, stop=None):
+    """Return the index of the first occurrence of pattern in
+    source[start:stop] using the Boyer-Moore-Horspool algorithm"""
+    for pos in bmh(source, pattern, start, stop):
+        return pos
+    return -1
+
+
+def bmh_find(source, pattern, start=0, stop=None):
+    """Return a true value if pattern is present in source[start:stop] using
+    the Boyer-Moore-Horspool algorithm"""
+    return bmh_first(source, pattern, start, stop) >= 0
+
+
+def _maximal_suffix(pattern, tilde):
+    """Returns (position, period) of the maximal suffix of pattern, for the
+    reversed order of the alphabet if tilde is true"""
+    plen = len(pattern)
+    msuf = -1
+    j = 0
+    k = period = 1
+    while j + k < plen:
+        a = pattern[j + k]
+        b = pattern[msuf + k]
+        if (a > b) if tilde else (a < b):
+            j += k
+            k = 1
+            period = j - msuf
+        elif a == b:
+            if k != period:
+                k += 1
+            else:
+                j += period
+                k = 1
+        else:
+            msuf = j
+            j = msuf + 1
+            k = period = 1
+    return msuf, period
+
+
+def _two_way(text, pattern, start, stop):
+    """Crochemore-Perrin two-way"""
+    plen = len(pattern)
+    ell, per = max(_maximal_suffix(pattern, 0), _maximal_suffix(pattern, 1))
+    last = stop - plen
+    j = start
+    if pattern[:ell+1] == pattern[per:per+ell+1]:
+        # periodic pattern, the matched prefix of the period is remembered
+        memory = -1
+        while j <= last:
+            i = max(ell, memory) + 1
+            while i < plen and pattern[i] == text[i + j]:
+                i += 1
+            if i >= plen:
+                i = ell
+                while i > memory and pattern[i] == text[i + j]:
+                    i -= 1
+                if i <= memory:
+                    yield j
+                j += per
+                memory = plen - per - 1
+            else:
+                j += i - ell
+                memory = -1
+    else:
+        per = max(ell + 1, plen - ell - 1) + 1
+        while j <= last:
+            i = ell + 1
+            while i < plen and pattern[i] == text[i + j]:
+                i += 1
+            if i >= plen:
+                i = ell
+                while i >= 0 and pattern[i] == text[i + j]:
+                    i -= 1
+                if i < 0:
+                    yield j
+                j += per
+            else:
+                j += i - ell
+
+
+def two_way(source, pattern, start=0, stop=None):
+    """Yields all occurrences of pattern in source[start:stop] using the
+    Crochemore-Perrin two-way algorithm, it uses constant extra space"""
+    return _search(_two_way, source, pattern, start, stop)
+
+
+def two_way_first(source, pattern, start=0, stop=None):
+    """Return the index of the first occurrence of pattern in
+    source[start:stop] using the two-way algorithm"""
+    for pos in two_way(source, pattern, start, stop):
+        return pos
+    return -1
+
+
+def two_way_find(source, pattern, start=0, stop=None):
+    """Return a true value if pattern is present in source[start:stop] using
+    the two-way algorithm"""
+    return two_way_first(source, pattern, start, stop) >= 0
+
+
+def _native(text, pattern, start, stop):
+    """Search with the find method of the text"""
+    find = text.find
+    pos = find(pattern, start, stop)
+    while pos >= 0:
+        yield pos
+        pos = find(pattern, pos + 1, stop)
+
+
+def select(source, pattern):
+    """Returns the search algorithm (a function like bmh) fit for pattern and
+    source: bytes are searched by the native find, the other sequences by
+    two-way if pattern is short and by Boyer-Moore-Horspool otherwise"""
+    if isinstance(pattern, str) and not isinstance(source, (list, tuple)):
+        return search_native
+    return two_way if len(pattern) < TW_MAX_LEN else bmh
+
+
+def search_native(source, pattern, start=0, stop=None):
+    """Yields all occurrences of the string pattern in source[start:stop]
+    using the find method of the strings"""
+    return _search(_native, source, pattern, start, stop)
+
+
+def search(source, pattern, start=0, stop=None):
+    """Yields all occurrences of pattern in source[start:stop] using the
+    algorithm returned by select"""
+    return select(source, pattern)(source, pattern, start, stop)
+
+
+def search_first(source, pattern, start=0, stop=None):
+    """Return the index of the first occurrence of pattern in
+    source[start:stop], -1 if it's not found"""
+    for pos in search(source, pattern, start, stop):
+        return pos
+    return -1
+
+
+def search_find(source, pattern, start=0, stop=None):
+    """Return a true value if pattern is present in source[start:stop]"""
+    return search_first(source, pattern, start, stop) >= 0
+
+
+class Blocks(Object):
+    """Random access to a sequence-like object (pysec.io.fd.File,
+    pysec.core.memory.Memory) that is read in blocks of *size* items, the
+    last two blocks read are kept so a search that goes forward needs a read
+    for every block of the source"""
+
+    def __init__(self, source, size=BLOCK_SIZE):
+        size = int(size)
+        if size <= 0:
+            raise ValueError("wrong block size: %r" % size)
+        self.source = source
+        self.size = size
+        self._len = len(source)
+        # (base, data) of the last block and of the previous one
+        self._last = self._prev = (0, source[0:0])
+
+    def __len__(self):
+        return self._len
+
+    def block(self, pos):
+        """Returns (base, data) of the block that contains *pos*"""
+        base, data = self._last
+        if base <= pos < base + len(data):
+            return base, data
+        base, data = self._prev
+        if base <= pos < base + len(data):
+            self._prev, self._last = self._last, self._prev
+            return base, data
+        base = pos - pos % self.size
+        data = self.source[base:min(base + self.size, self._len)]
+        self._prev = self._last
+        self._last = base, data
+        return base, data
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._len)
+            if step != 1:
+                return self.source[index]
+            if start >= stop:
+                return self._last[1][0:0]
+            base, data = self.block(start)
+            if stop <= base + len(data):
+                return data[start-base:stop-base]
+            # a slice across more blocks is read from the source
+            return self.source[start:stop]
+        index = int(index)
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError("index out of range: %d" % index)
+        base, data = self._last
+        if not base <= index < base + len(data):
+            base, data = self.block(index)
+        return data[index - base]
+
+    def chunks(self, start=0, stop=None):
+        """Yields the contents of self[start:stop] in pieces that don't
+        cross the boundaries of the blocks"""
+        start, stop = _bounds(self, start, stop)
+        while start < stop:
+            base, data = self.block(start)
+            end = min(base + len(data), stop)
+            yield data[start-base:end-base]
+            start = end
+
+    def find(self, sub, start=0, stop=None):
+        """Returns the lowest index of *sub* in self[start:stop], -1 if it's
+        not found. The occurrences across two blocks are found."""
+        start, stop = _bounds(self, start, stop)
+        slen = len(sub)
+        if not slen:
+            return start
+        while start + slen <= stop:
+            base, data = self.block(start)
+            end = base + len(data)
+            pos = data.find(sub, start - base, min(end, stop) - base)
+            if pos >= 0:
+                return base + pos
+            if end >= stop:
+                break
+            if slen > 1:
+                # the occurrences that end in the next blocks
+                edge = max(start, end - slen + 1)
+                tail = min(slen - 1, stop - end)
+                ndata = self.block(end)[1]
+                if len(ndata) >= tail:
+                    pos = (data[edge-base:] + ndata[:tail]).find(sub)
+                else:
+                    pos = self.source[edge:end+tail].find(sub)
+                if pos >= 0:
+                    return edge + pos
+            start = end
+        return -1
+
+
+def blocks(source, size=BLOCK_SIZE):
+    """Returns source if it has random access (strings, lists, tuples, mmap,
+    Blocks), otherwise Blocks(source, size)"""
+    if isinstance(source, _RANDOM) or isinstance(source, Blocks):
+        return source
+    return Blocks(source, size)
+
+
+class AhoCorasick(Object):
+    """Aho-Corasick automaton to search a set of strings in a single pass.
+    The pattern's id is its position in *patterns*."""
+
+    def __init__(self, patterns):
+        goto = [{}]
+        outs = [[]]
+        self.patterns = patterns = tuple(str(pat) for pat in patterns)
+        for pid, pattern in enumerate(patterns):
+            if not pattern:
+                raise ValueError("empty pattern: %d" % pid)
+            state = 0
+            for ch in pattern:
+                nstate = goto[state].get(ch, None)
+                if nstate is None:
+                    nstate = goto[state][ch] = len(goto)
+                    goto.append({})
+                    outs.append([])
+                state = nstate
+            outs[state].append(pid)
+        # failure links in breadth-first order, so the failure of a state is
+        # already complete when its children are visited
+        fail = [0] * len(goto)
+        queue = deque(goto[0].itervalues())
+        while queue:
+            state = queue.popleft()
+            for ch, nstate in goto[state].iteritems():
+                queue.append(nstate)
+                fstate = fail[state]
+                while fstate and ch not in goto[fstate]:
+                    fstate = fail[fstate]
+                fstate = goto[fstate].get(ch, 0)
+                fail[nstate] = fstate
+                outs[nstate].extend(outs[fail[nstate]])
+        self._goto = goto
+        self._fail = fail
+        self._outs = [tuple(out) for out in outs]
+        self._table = None
+        # full transition rows are computed only for the visited states
+        self._rows = [None] * len(goto)
+
+    @classmethod
+    def from_table(cls, patterns, outs, table):
+        """Returns an automaton with precomputed transitions: *outs* are the
+        outputs of every state and table(state) returns the 256 transitions
+        of a state, it's called only the first time the state is visited"""
+        self = cls.__new__(cls)
+        self.patterns = tuple(patterns)
+        self._goto = self._fail = None
+        self._outs = list(outs)
+        self._table = table
+        self._rows = [None] * len(self._outs)
+        return self
+
+    def __len__(self):
+        return len(self._outs)
+
+    def row(self, state):
+        """Returns the transitions of *state* for all the 256 bytes"""
+        row = self._rows[state]
+        if row is None:
+            if self._table is not None:
+                row = self._table(state)
+            else:
+                row = [0] * 256 if state == 0 else \
+                    list(self.row(self._fail[state]))
+                for ch, nstate in self._goto[state].iteritems():
+                    row[ord(ch)] = nstate
+            self._rows[state] = row
+        return row
+
+    def scan(self, data, state=0, start=0, stop=None):
+        """Feeds data[start:stop] to the automaton starting from *state*.
+        Returns a tuple (state, matches) where matches is a list of tuples
+        (end, pattern_id) and end is the index in data just after the
+        pattern. The returned state can be used to continue the scan in the
+        next chunk of data, so patterns spanning chunks are found."""
+        stop = len(data) if stop is None else stop
+        rows = self._rows
+        outs = self._outs
+        row = rows[state] or self.row(state)
+        matches = []
+        if start >= stop:
+            return state, matches
+        for end, byte in enumerate(bytearray(buffer(data, start,
+                                                    stop - start)),
+                                   start + 1):
+            state = row[byte]
+            row = rows[state] or self.row(state)
+            if outs[state]:
+                matches.extend((end, pid) for pid in outs[state])
+        return state, matches
+
+    def outputs(self, state):
+        """Returns the ids of the patterns that end in *state*"""
+        return self._outs[state]
+
+    def search_chunks(self, chunks, offset=0):
+        """Yields the tuples (position, pattern_id) of all the occurrences of
+        the patterns in the concatenation of the strings in *chunks*, the
+        first chunk starts at *offset*. The occurrences are sorted by their
+        end and, if they end at the same position, by decreasing length.
+        Patterns spanning more chunks are
+        found, because the state is kept from a chunk to the next one."""
+        patterns = self.patterns
+        state = 0
+        for chunk in chunks:
+            state, matches = self.scan(chunk, state)
+            for end, pid in matches:
+                yield offset + end - len(patterns[pid]), pid
+            offset += len(chunk)
+
+    def search(self, source, start=0, stop=None, size=BLOCK_SIZE):
+        """Yields the tuples (position, pattern_id) of all the occurrences,
+        also overlapping, of the patterns in source[start:stop] in a single
+        pass, sorted as in search_chunks. Strings, mmap and
+        pysec.core.memory.Memory are scanned in place, the other sources
+        (pysec.io.fd.File) are read in blocks of *size* bytes."""
+        start, stop = _bounds(source, start, stop)
+        if size <= 0:
+            raise ValueError("wrong block size: %r" % size)
+        if isinstance(source, _BUFFERS):
+            chunks = (buffer(source, pos, min(size, stop - pos))
+                      for pos in xrange(start, stop, size))
+        else:
+            chunks = (source[pos:min(pos + size, stop)]
+                      for pos in xrange(start, stop, size))
+        return self.search_chunks(chunks, start)
+
+
+def multi_search(source, patterns, start=0, stop=None):
+    """Yields the tuples (position, pattern_id) of all the occurrences of
+    the strings in *patterns* in source[start:stop], the pattern's id is its
+    position in *patterns*. To search the same patterns more times build an
+    AhoCorasick object and use its search method."""
+    return AhoCorasick(patterns).search(source, start, stop)
@@ -1,9 +1,21 @@
 #!/usr/bin/python -OOBRStt
 """"""
-from pysec.core import is_int, is_str, is_dict
+from bisect import bisect_left
+from collections import OrderedDict
+import marshal
+import mmap
+import os
+import struct
 
+from pysec.core import Object, is_int, is_str, is_dict
+from pysec.core.match import Pattern, CLASS_SIZE
+from pysec.core.memory import Memory
+from pysec.alg import AhoCorasick
+from pysec.io import fd
 
-SPECIAL_CHARS = '\\', '*', '?', '!', '[', ']', '{', '}', '-', ',', '#', '@'
+
+SPECIAL_CHARS = '\\', '*', '?', '!', '[', ']', '{', '}', '-', ',', '#', '@', \
+                '.', '$', '_', '%', '+'
 
 ALPHA = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
 DIGITS = '0123456789'
@@ -111,12 +123,22 @@ MASK_ALL_CHAR = object()
 MASK_PRINT = reduce(lambda a, b: a | b, (1 << ord(ch) for ch in PRINTABLE))
 MASK_NOT_PRINT = (2 ** 0x20) - 1
 MASK_ALPHNUM = reduce(lambda a, b: a | b, (1 << ord(ch) for ch in ALPHANUMERIC))
-MASK_NUM = 1111111111 << 49
+MASK_NUM = reduce(lambda a, b: a | b, (1 << ord(ch) for ch in DIGITS))
 MASK_ALPH = reduce(lambda a, b: a | b, (1 << ord(ch) for ch in ALPHA))
 MASK_VIS = reduce(lambda a, b: a | b, (1 << ord(ch) for ch in VISIBLE))
 MASK_NOT_VIS = reduce(lambda a, b: a | b, (1 << ord(ch) for ch in NOT_VISIBLE))
-MASK_ASCII = 2 ** 129 - 1
-MASK_EXT = (2 ** 129 - 1) << 128
+MASK_ASCII = 2 ** 128 - 1
+MASK_EXT = (2 ** 128 - 1) << 128
+MASK_FULL = 2 ** 256 - 1
+
+BLOCK_SIZE = 2 ** 16
+CACHE_SIZE = 256
+
+PSET_MAGIC = 'PYSECPST'
+PSET_VERSION = 1
+# magic, version, stamp of the source, typecode of the transitions, number of
+# states, size of the marshaled tables
+_PSET_HEADER = struct.Struct('>8sI20scxxxII')
 
 
 class WildSyntaxError(ValueError):
@@ -153,7 +175,7 @@ def minimize_pattern(pattern):
                 raise WildSyntaxError()
             ch = pattern[i]
             if ch in SPECIAL_CHARS:
-                new_pattern.append(ord(ch))
+                new_pattern.append(ch)
             elif ch == 'x':
                 i += 2
                 if i >= p_len:
@@ -164,7 +186,7 @@ def minimize_pattern(pattern):
                 else:
                     raise WildSyntaxError()
             elif ch == '\\':
-                new_pattern.append(BACKSLASH_ORD)
+                new_pattern.append(ch)
             elif ch == '[':
                 raise NotImplementedError
             else:
@@ -175,110 +197,396 @@ def minimize_pattern(pattern):
     return new_pattern
 
 
+def _literal_anchor(tokens):
+    """Returns the offset and the string of the longest run of literal
+    characters in *tokens*"""
+    best_off = run_off = 0
+    best = ''
+    run = []
+    for i, tk in enumerate(tokens):
+        if is_str(tk):
+            if not run:
+                run_off = i
+            run.append(tk)
+            if len(run) > len(best):
+                best_off = run_off
+                best = ''.join(run)
+        else:
+            run = []
+    return best_off, best
+
+
+def _blocks(text, offset, stop):
+    """Yields (base, data, start, end) where data[start:end] is the part of
+    text[offset:stop] starting at base + start. Strings are returned as a
+    single block, the other sequences are read in blocks of BLOCK_SIZE"""
+    if isinstance(text, str):
+        yield 0, text, offset, stop
+        return
+    for base in xrange(offset, stop, BLOCK_SIZE):
+        data = text[base:min(base + BLOCK_SIZE, stop)]
+        yield base, data, 0, len(data)
+
+
+def class_table(tokens):
+    """Returns the classes of characters of *tokens* in the format of
+    pysec.core.match.Pattern: CLASS_SIZE bytes for every token, the bit
+    (ch & 7) of the byte (ch >> 3) is set if the character ch is accepted"""
+    table = []
+    for tk in tokens:
+        if tk is MASK_ALL_CHAR:
+            mask = MASK_FULL
+        elif is_int(tk):
+            mask = tk & MASK_FULL
+        elif is_str(tk):
+            mask = 1 << ord(tk)
+        else:
+            raise Exception("unknown token: %r" % tk)
+        table.extend(chr((mask >> (8 * i)) & 0xFF)
+                     for i in xrange(0, CLASS_SIZE))
+    return ''.join(table)
+
+
+# objects searched directly by pysec.core.match without the GIL, the other
+# sequences are read in blocks
+_BUFFERS = (str, bytearray, mmap.mmap, Memory)
+
+
+class BytePattern(Object):
+    """Pattern, in minimize_pattern's syntax, compiled to be searched many
+    times. The pattern is converted in a table of classes of characters and
+    it's searched by pysec.core.match without holding the GIL, so many
+    threads can scan different data concurrently."""
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.tokens = tokens = minimize_pattern(pattern)
+        if not tokens:
+            raise WildSyntaxError("empty pattern")
+        self.length = len(tokens)
+        self._cpat = Pattern(class_table(tokens))
+
+    def __len__(self):
+        return self.length
+
+    def match(self, text, pos=0):
+        """Returns a true value if the pattern matches text at position pos,
+        text must be a string or an object that supports the buffer
+        interface"""
+        return self._cpat.match(text, pos)
+
+    def findall(self, text, offset=0, stop=None):
+        """Returns the positions of all the occurrences, also overlapping, of
+        the pattern in text[offset:stop], text must be a string or an object
+        that supports the buffer interface"""
+        return self._cpat.findall(text, offset, -1 if stop is None else stop)
+
+    def finditer(self, text, offset=0, stop=None):
+        """Yields the positions of all the occurrences, also overlapping, of
+        the pattern in text[offset:stop].
+        text can be a string, a mmap, a pysec.core.memory.Memory or a
+        sequence-like object (pysec.io.fd.File) that will be read in
+        blocks."""
+        offset = int(offset)
+        if offset < 0:
+            raise ValueError("negative offset: %d" % offset)
+        t_len = len(text)
+        stop = t_len if stop is None else min(int(stop), t_len)
+        find = self._cpat.find
+        if isinstance(text, _BUFFERS):
+            pos = find(text, offset, stop)
+            while pos >= 0:
+                yield pos
+                pos = find(text, pos + 1, stop)
+            return
+        overlap = self.length - 1
+        for base in xrange(offset, stop, BLOCK_SIZE):
+            data = text[base:min(base + BLOCK_SIZE + overlap, stop)]
+            pos = find(data)
+            while 0 <= pos < BLOCK_SIZE:
+                yield base + pos
+                pos = find(data, pos + 1)
+
+    def search(self, text, offset=0, stop=None):
+        """Returns the position of the first occurrence of the pattern in
+        text[offset:stop], -1 if it's not found"""
+        for pos in self.finditer(text, offset, stop):
+            return pos
+        return -1
+
+
+_COMPILED = OrderedDict()
+
+
+def compile(pattern):
+    """Returns a BytePattern for *pattern*. The last CACHE_SIZE compiled
+    patterns are kept in a LRU cache"""
+    bpat = _COMPILED.pop(pattern, None)
+    if bpat is None:
+        bpat = BytePattern(pattern)
+        if len(_COMPILED) >= CACHE_SIZE:
+            _COMPILED.popitem(last=False)
+    _COMPILED[pattern] = bpat
+    return bpat
+
+
 def byte_search(text, pattern, offset=0):
-    pattern = minimize_pattern(pattern)
-    p = 0
-    p_len = len(pattern)
-    t = int(offset)
-    t_len = len(text)
-    while t < t_len and p <= t_len and p < p_len:
-        tc = text[t]
-        pc = pattern[p]
-        if isinstance(pc, str):
-            if pc == tc:
-                p += 1
-            else:
-                p = 0
-        elif pc is MASK_ALL_CHAR:
-            p += 1
-        elif isinstance(pc, (int, long)):
-            if pc & (1 << (ord(tc) + 1)):
-                p += 1
-            else:
-                p = 0
+    """Returns the position of the first occurrence of pattern in text
+    starting from offset, -1 if it's not found"""
+    return compile(pattern).search(text, offset)
+
+
+class PatternSet(Object):
+    """Set of patterns, in minimize_pattern's syntax, compiled once and
+    searched in a single pass over the text.
+    Every pattern is anchored to its longest run of literal characters: the
+    anchors are searched with an Aho-Corasick automaton and only where an
+    anchor is found the wildcard and mask tokens around it are checked.
+    Patterns without literal characters are checked at every position."""
+
+    def __init__(self, patterns):
+        if is_dict(patterns):
+            patterns = patterns.iteritems()
         else:
-            raise Exception("unknown token: %r" % pc)
-        t += 1
-    return t - p_len if p >= p_len else -1
+            patterns = ((p, None) for p in patterns)
+        self.patterns = []
+        self.names = []
+        self.tokens = []
+        self.lengths = []
+        self._compiled = []
+        self._bare = []
+        anchors = {}
+        self._anchored = []
+        for pattern, name in patterns:
+            tokens = minimize_pattern(pattern)
+            if not tokens:
+                raise WildSyntaxError("empty pattern")
+            pid = len(self.tokens)
+            self.patterns.append(pattern)
+            self.names.append(name)
+            self.tokens.append(tokens)
+            self.lengths.append(len(tokens))
+            a_off, anchor = _literal_anchor(tokens)
+            a_end = a_off + len(anchor)
+            if anchor:
+                aid = anchors.setdefault(anchor, len(anchors))
+                if aid == len(self._anchored):
+                    self._anchored.append([])
+                self._anchored[aid].append((pid, a_end))
+            else:
+                self._bare.append(pid)
+            self._compiled.append(None)
+        self._ac = AhoCorasick(sorted(anchors, key=anchors.get))
+        self._first = None
+        self.maxlen = max(self.lengths) if self.lengths else 0
 
+    def __len__(self):
+        return len(self.patterns)
 
+    def dump(self, path, stamp=''):
+        """Writes the compiled set in *path*, it can be loaded by
+        PatternSet.load. *stamp* (max 20 bytes) identifies the source of the
+        patterns, usually its digest"""
+        if len(stamp) > 20:
+            raise ValueError("stamp too long: %r" % stamp)
+        path = os.path.abspath(str(path))
+        ac = self._ac
+        states = len(ac)
+        typecode = 'H' if states <= 0xFFFF else 'I'
+        row_fmt = struct.Struct('>256%s' % typecode)
+        tables = marshal.dumps((self.patterns, self.names, self.lengths,
+                                self._bare,
+                                [tuple(pids) for pids in self._anchored],
+                                ac.patterns,
+                                [ac.outputs(state)
+                                 for state in xrange(0, states)]))
+        tmp = '%s.tmp' % path
+        with fd.File.open(tmp, fd.FO_WRITETR, 0644) as fpset:
+            fpset.write(_PSET_HEADER.pack(PSET_MAGIC, PSET_VERSION, stamp,
+                                          typecode, states, len(tables)))
+            fpset.write(tables)
+            for state in xrange(0, states):
+                fpset.write(row_fmt.pack(*ac.row(state)))
+        os.rename(tmp, path)
 
-class SearchTree(object):
+    @classmethod
+    def load(cls, path, stamp=None):
+        """Returns the PatternSet written by dump in *path*. The file is
+        mmap'ed and the transitions of the automaton are read only for the
+        visited states. If *stamp* is not None and it is different from the
+        dumped one ValueError is raised"""
+        path = os.path.abspath(str(path))
+        with fd.File.open(path, fd.FO_READEX) as fpset:
+            if len(fpset) < _PSET_HEADER.size:
+                raise ValueError("wrong pattern set format: %r" % path)
+            pmap = mmap.mmap(int(fpset), 0, access=mmap.ACCESS_READ)
+        magic, version, pstamp, typecode, states, tsize = \
+            _PSET_HEADER.unpack_from(pmap, 0)
+        row_fmt = struct.Struct('>256%s' % typecode) \
+            if typecode in 'HI' else None
+        toff = _PSET_HEADER.size + tsize
+        if magic != PSET_MAGIC or version != PSET_VERSION or \
+           row_fmt is None or len(pmap) != toff + states * row_fmt.size:
+            pmap.close()
+            raise ValueError("wrong pattern set format: %r" % path)
+        if stamp is not None and pstamp != stamp.ljust(20, '\x00'):
+            pmap.close()
+            raise ValueError("pattern set out of date: %r" % path)
+        try:
+            patterns, names, lengths, bare, anchored, anchors, outs = \
+                marshal.loads(pmap[_PSET_HEADER.size:toff])
+        except (ValueError, EOFError, TypeError):
+            pmap.close()
+            raise ValueError("wrong pattern set format: %r" % path)
+        self = cls.__new__(cls)
+        self.patterns = patterns
+        self.names = names
+        self.tokens = _Tokens(self)
+        self.lengths = lengths
+        self.maxlen = max(lengths) if lengths else 0
+        self._compiled = [None] * len(patterns)
+        self._bare = bare
+        self._anchored = anchored
+        self._first = None
 
-    def __init__(self, token=None, eop=None, parent=None, name=None):
-        self.parent = parent
-        self.token = token
-        self.eop = bool(eop)
-        self.children = {}
-        self.name = name
+        def table(state):
+            return row_fmt.unpack_from(pmap, toff + state * row_fmt.size)
 
-    def add(self, token, eop=None):
-        node = SearchTree(token, eop, self)
-        self.children[token] = node
-        return node
+        self._ac = AhoCorasick.from_table(anchors, outs, table)
+        return self
 
-    def __getitem__(self, token):
-        return self.children[token]
+    def compiled(self, pid):
+        """Returns the BytePattern of pattern *pid*, compiled on first use"""
+        bpat = self._compiled[pid]
+        if bpat is None:
+            bpat = self._compiled[pid] = BytePattern(self.patterns[pid])
+        return bpat
 
-    def tokens(self):
-        return self.children.keys()
+    def match(self, window, pid):
+        """Returns a true value if pattern *pid* matches the beginning of
+        window"""
+        return self.compiled(pid).match(window)
 
-    def items(self):
-        return self.children.items()
+    def _first_tokens(self):
+        """Returns (by_char, any_char): the list of the ids of the patterns
+        that accept every character as first token and, for every
+        character, the ids of the other patterns that accept it"""
+        if self._first is None:
+            by_char = [[] for _ in xrange(0, 256)]
+            any_char = []
+            for pid, pattern in enumerate(self.patterns):
+                tk = minimize_pattern(pattern)[0]
+                if tk is MASK_ALL_CHAR:
+                    any_char.append(pid)
+                elif is_str(tk):
+                    by_char[ord(tk)].append(pid)
+                else:
+                    for ch in xrange(0, 256):
+                        if tk & (1 << ch):
+                            by_char[ch].append(pid)
+            self._first = by_char, any_char
+        return self._first
+
+    def match_at(self, text, pos=0):
+        """Returns the sorted list of the ids of the patterns that match text
+        at position pos. Only the patterns whose first token accepts
+        text[pos] are checked, the text after pos+maxlen is never read"""
+        pos = int(pos)
+        if pos < 0:
+            raise ValueError("negative offset: %d" % pos)
+        window = text[pos:pos+self.maxlen]
+        if not window:
+            return []
+        by_char, any_char = self._first_tokens()
+        match = self.match
+        return [pid for pid in sorted(by_char[ord(window[0])] + any_char)
+                if match(window, pid)]
 
-    def ancestors(self):
-        node = self
-        while node:
-            yield node
-            node = node.parent
+    def search(self, text, offset=0, stop=None):
+        """Yields the tuples (position, pattern_id) of all the occurrences,
+        also overlapping, of the patterns in text[offset:stop], sorted by
+        position and pattern id.
+        text can be a string or a sequence-like object (pysec.io.fd.File,
+        pysec.core.memory.Memory) that will be read in blocks. An occurrence
+        can start in a block before the one where it's found, so the ones
+        closer than maxlen to the end of a block are held back until the
+        next block is searched."""
+        offset = int(offset)
+        if offset < 0:
+            raise ValueError("negative offset: %d" % offset)
+        t_len = len(text)
+        stop = t_len if stop is None else min(int(stop), t_len)
+        lengths = self.lengths
+        anchored = self._anchored
+        match = self.match
+        state = 0
+        pending = []
+        for base, data, start, end in _blocks(text, offset, stop):
+            d_start = base + start
+            d_end = base + end
+            state, hits = self._ac.scan(data, state, start, end)
+            found = []
+            for a_end, aid in hits:
+                a_end += base
+                for pid, p_aend in anchored[aid]:
+                    pos = a_end - p_aend
+                    p_end = pos + lengths[pid]
+                    if pos < offset or p_end > stop:
+                        continue
+                    if base <= pos and p_end <= base + len(data):
+                        window = data[pos-base:p_end-base]
+                    else:
+                        window = text[pos:p_end]
+                    if match(window, pid):
+                        found.append((pos, pid))
+            for pid in self._bare:
+                p_len = lengths[pid]
+                last = min(d_end, stop - p_len + 1)
+                inner = min(last, base + len(data) - p_len + 1)
+                if inner > d_start:
+                    found.extend((base + pos, pid) for pos in
+                                 self.compiled(pid).findall(
+                                     data, start, inner - base + p_len - 1))
+                for pos in xrange(max(inner, d_start), last):
+                    if match(text[pos:pos+p_len], pid):
+                        found.append((pos, pid))
+            pending.extend(found)
+            pending.sort()
+            # the next blocks find only occurrences starting from here
+            ready = bisect_left(pending, (d_end - self.maxlen + 1,))
+            for item in pending[:ready]:
+                yield item
+            del pending[:ready]
+        for item in pending:
+            yield item
+
+
+class _Tokens(Object):
+    """Tokens of the patterns of a loaded PatternSet, they are computed only
+    when requested"""
+
+    def __init__(self, pset):
+        self._pset = pset
+
+    def __len__(self):
+        return len(self._pset)
+
+    def __getitem__(self, pid):
+        return self._pset.compiled(pid).tokens
+
+    def __iter__(self):
+        for pid in xrange(0, len(self._pset)):
+            yield self[pid]
 
 
 def byte_msearch(text, patterns, offset=0):
-    if is_dict(patterns):
-        patterns = patterns.iteritems()
-    else:
-        patterns = ((p, None) for p in patterns)
-    root = SearchTree()
-    for pattern, name in patterns:
-        tree = root
-        for tk in minimize_pattern(pattern):
-            if tk in tree.children:
-                tree = tree.children[tk]
-            else:
-                tree = tree.add(tk)
-        tree.eop = 1
-        tree.name = name
+    """Yields the tuples (position, tokens, name) for all the occurrences of
+    patterns in text starting from offset. patterns can be a PatternSet, a
+    dict {pattern: name} or a sequence of patterns (name will be None)"""
+    if not isinstance(patterns, PatternSet):
+        patterns = PatternSet(patterns)
     t = int(offset)
     if t < 0:
         raise ValueError("negative offset: %d" % t)
-    t_len = len(text)
-    root.eop = 0
-    actual_trees = set([root])
-    while t < t_len and actual_trees:
-        tc = text[t]
-        next_trees = set()
-        while actual_trees:
-            tree = actual_trees.pop()
-            if tree.eop:
-                yield t, [node.token for node in reversed(tuple(tree.ancestors())[:-1])], tree.name
-                tree.eop = 0
-            for pc, node in tree.items():
-                if is_str(pc):
-                    pc = str(pc)
-                    if pc == tc:
-                        next_trees.add(node)
-                    else:
-                        next_trees.add(root)
-                elif pc is MASK_ALL_CHAR:
-                    next_trees.add(node)
-                elif is_int(pc):
-                    pc = int(pc)
-                    if pc & (1 << (ord(tc) + 1)):
-                        next_trees.add(node)
-                    else:
-                        next_trees.add(root)
-                else:
-                    raise Exception("unknown token: %r" % pc)
-        actual_trees = next_trees
-        t += 1
-
+    for pos, pid in patterns.search(text, t):
+        yield pos, patterns.tokens[pid], patterns.names[pid]
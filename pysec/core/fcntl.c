@@ -1,5 +1,7 @@
 #include <Python.h>
 #include <fcntl.h>
+#include <string.h>
+#include <unistd.h>
 
 
 PyDoc_STRVAR(fcntl_creat__doc__,
@@ -78,11 +80,42 @@ fcntl_fcntl(PyObject* self, PyObject* args, PyObject* kwds)
     return PyInt_FromLong(ret);
 }
 
+PyDoc_STRVAR(fcntl_lock__doc__,
+"lock(fildes, cmd, type, start=0, len=0)\n\n"
+"Sets a record lock of type (F_RDLCK, F_WRLCK or F_UNLCK) on len bytes\n"
+"from start, to the end of the file if len is 0, with cmd F_SETLK or\n"
+"F_SETLKW.");
+
+static PyObject*
+fcntl_lock(PyObject* self, PyObject* args, PyObject* kwds)
+{
+    int fildes, cmd, type, ret;
+    long long start = 0, len = 0;
+    struct flock lock;
+    static char *kwlist[] = {"fildes", "cmd", "type", "start", "len", NULL};
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "iii|LL:lock", kwlist, &fildes, &cmd, &type, &start, &len))
+        return NULL;
+
+    memset(&lock, 0, sizeof(lock));
+    lock.l_type = type;
+    lock.l_whence = SEEK_SET;
+    lock.l_start = (off_t)start;
+    lock.l_len = (off_t)len;
+    Py_BEGIN_ALLOW_THREADS
+    ret = fcntl(fildes, cmd, &lock);
+    Py_END_ALLOW_THREADS
+    if (ret < 0)
+        return PyErr_SetFromErrno(PyExc_OSError);
+    Py_RETURN_NONE;
+}
+
 static PyMethodDef fcntl_methods[] = {
     {"open", (PyCFunction)fcntl_open, METH_KEYWORDS, fcntl_open__doc__},
     {"openat", (PyCFunction)fcntl_openat, METH_KEYWORDS, fcntl_openat__doc__},
     {"creat", (PyCFunction)fcntl_creat, METH_KEYWORDS, fcntl_creat__doc__},
     {"fcntl", (PyCFunction)fcntl_fcntl, METH_KEYWORDS, fcntl_fcntl__doc__},
+    {"lock", (PyCFunction)fcntl_lock, METH_KEYWORDS, fcntl_lock__doc__},
     { NULL } /* sentinel */
 };
 
@@ -0,0 +1,234 @@
+/*
+ * Python Security Project (PySec) and its related class files.
+ *
+ * PySec is a set of tools for secure application development under Linux
+ *
+ * Copyright 2014 PySec development team
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *   http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+#define PY_SSIZE_T_CLEAN
+#include "Python.h"
+
+#include <math.h>
+#include <stdint.h>
+
+
+#define BINS 256
+/* k * log(k) is precomputed for the counts smaller than TABLE_SIZE */
+#define TABLE_SIZE 65536
+
+static double klogk_table[TABLE_SIZE];
+
+#define KLOGK(k) ((k) < TABLE_SIZE ? klogk_table[k] : (double)(k) * log((double)(k)))
+
+
+PyDoc_STRVAR(histogram__doc__,
+"Histograms of bytes, the counts are kept in an array('L') of 256 items.\n"
+"The bytes are counted without holding the GIL in a local histogram that\n"
+"is added to the counts after the GIL is taken again, so another thread\n"
+"can't resize the array or change the counts while they are written.");
+
+
+/* API */
+
+/* must be called with data[start:end] valid, it doesn't need the GIL */
+void
+Histogram_update(unsigned long *counts, const uint8_t *data, Py_ssize_t start, Py_ssize_t end)
+{
+    /* four partial histograms, so consecutive equal bytes don't stall on
+     * the same counter */
+    unsigned long c0[BINS] = {0}, c1[BINS] = {0}, c2[BINS] = {0}, c3[BINS] = {0};
+    Py_ssize_t i;
+    int b;
+
+    for (i = start; i + 4 <= end; i += 4) {
+        c0[data[i]]++;
+        c1[data[i+1]]++;
+        c2[data[i+2]]++;
+        c3[data[i+3]]++;
+    }
+    for (; i < end; i++)
+        c0[data[i]]++;
+    for (b = 0; b < BINS; b++)
+        counts[b] += c0[b] + c1[b] + c2[b] + c3[b];
+}
+
+/* removes the bytes of leaving and adds the bytes of entering, returns the
+ * change of the sum of c * log(c) over the counts.
+ * Returns -1 in *err if a removed byte was not counted, counts is left as
+ * it was */
+double
+Histogram_slide(unsigned long *counts, const uint8_t *leaving, Py_ssize_t llen, const uint8_t *entering, Py_ssize_t elen, int *err)
+{
+    double delta = 0.;
+    unsigned long cnt;
+    Py_ssize_t i;
+
+    *err = 0;
+    for (i = 0; i < llen; i++) {
+        cnt = counts[leaving[i]];
+        if (cnt == 0) {
+            /* the bytes already removed are counted again */
+            while (i-- > 0)
+                counts[leaving[i]]++;
+            *err = -1;
+            return 0.;
+        }
+        delta += KLOGK(cnt - 1) - KLOGK(cnt);
+        counts[leaving[i]] = cnt - 1;
+    }
+    for (i = 0; i < elen; i++) {
+        cnt = counts[entering[i]];
+        delta += KLOGK(cnt + 1) - KLOGK(cnt);
+        counts[entering[i]] = cnt + 1;
+    }
+    return delta;
+}
+
+static int
+Histogram_counts(PyObject *obj, unsigned long **counts)
+{
+    Py_ssize_t size;
+
+    if (PyObject_AsWriteBuffer(obj, (void **)counts, &size) < 0)
+        return -1;
+    if (size != BINS * sizeof(unsigned long)) {
+        PyErr_SetString(PyExc_ValueError, "counts must be an array('L') of 256 items");
+        return -1;
+    }
+    return 0;
+}
+
+/* adds the histogram added to the counts in obj, it must be called with
+ * the GIL */
+static int
+Histogram_add(PyObject *obj, const unsigned long *added)
+{
+    unsigned long *counts;
+    int b;
+
+    if (Histogram_counts(obj, &counts) < 0)
+        return -1;
+    for (b = 0; b < BINS; b++)
+        counts[b] += added[b];
+    return 0;
+}
+
+/* functions */
+
+PyDoc_STRVAR(histogram_update__doc__,
+"update(counts, data, start=0, end=-1)\n\n"
+"Adds the bytes of data[start:end] to counts, data can be any object that\n"
+"supports the buffer interface (str, mmap, pysec.core.memory.Memory).");
+
+/*@null@*/
+static PyObject*
+histogram_update(PyObject *self, PyObject *args, PyObject *kwds)
+{
+    PyObject *ocounts;
+    unsigned long *counts;
+    unsigned long added[BINS] = {0};
+    Py_buffer view;
+    Py_ssize_t start = 0, end = -1;
+    static char *kwlist[] = {"counts", "data", "start", "end", NULL};
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "Os*|nn:update", kwlist, &ocounts, &view, &start, &end))
+        return NULL;
+    if (Histogram_counts(ocounts, &counts) < 0) {
+        PyBuffer_Release(&view);
+        return NULL;
+    }
+    if (end < 0 || end > view.len)
+        end = view.len;
+    if (start < 0) {
+        PyBuffer_Release(&view);
+        PyErr_Format(PyExc_ValueError, "negative offset: %zd", start);
+        return NULL;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    Histogram_update(added, view.buf, start, end);
+    Py_END_ALLOW_THREADS
+
+    PyBuffer_Release(&view);
+    /* the array can be changed while the GIL is released */
+    if (Histogram_add(ocounts, added) < 0)
+        return NULL;
+    Py_RETURN_NONE;
+}
+
+PyDoc_STRVAR(histogram_slide__doc__,
+"slide(counts, leaving, entering) -> float\n\n"
+"Removes the bytes of leaving from counts and adds the bytes of entering,\n"
+"returns the change of the sum of c * log(c) over the counts, so the\n"
+"entropy of a sliding window is updated in constant time.");
+
+/*@null@*/
+static PyObject*
+histogram_slide(PyObject *self, PyObject *args, PyObject *kwds)
+{
+    PyObject *ocounts;
+    unsigned long *counts;
+    Py_buffer leaving, entering;
+    double delta;
+    int err;
+    static char *kwlist[] = {"counts", "leaving", "entering", NULL};
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "Os*s*:slide", kwlist, &ocounts, &leaving, &entering))
+        return NULL;
+    if (Histogram_counts(ocounts, &counts) < 0) {
+        PyBuffer_Release(&leaving);
+        PyBuffer_Release(&entering);
+        return NULL;
+    }
+
+    /* the GIL is held, the windows are short and the counts are written */
+    delta = Histogram_slide(counts, leaving.buf, leaving.len, entering.buf, entering.len, &err);
+
+    PyBuffer_Release(&leaving);
+    PyBuffer_Release(&entering);
+    if (err < 0) {
+        PyErr_SetString(PyExc_ValueError, "removed byte is not counted");
+        return NULL;
+    }
+    return PyFloat_FromDouble(delta);
+}
+
+
+static PyMethodDef histogram_methods[] = {
+    {"update", (PyCFunction)histogram_update, METH_VARARGS | METH_KEYWORDS, histogram_update__doc__},
+    {"slide", (PyCFunction)histogram_slide, METH_VARARGS | METH_KEYWORDS, histogram_slide__doc__},
+    { NULL } /* sentinel */
+};
+
+
+#ifndef PyMODINIT_FUNC
+#define PyMODINIT_FUNC void
+#endif
+PyMODINIT_FUNC
+inithistogram(void)
+{
+    PyObject *m;
+    Py_ssize_t k;
+
+    klogk_table[0] = 0.;
+    for (k = 1; k < TABLE_SIZE; k++)
+        klogk_table[k] = (double)k * log((double)k);
+
+    m = Py_InitModule3("histogram", histogram_methods, histogram__doc__);
+    if(m == NULL)
+        return;
+
+    PyModule_AddIntConstant(m, "BINS", BINS);
+}
@@ -0,0 +1,402 @@
+/*
+ * Python Security Project (PySec) and its related class files.
+ *
+ * PySec is a set of tools for secure application development under Linux
+ *
+ * Copyright 2014 PySec development team
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *   http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+#define PY_SSIZE_T_CLEAN
+#include "Python.h"
+#include "structmember.h"
+
+#include <stdint.h>
+#include <stdlib.h>
+#include <string.h>
+
+
+/* every token of a pattern is a class of 256 bits, the bit (c & 7) of the
+ * byte (c >> 3) is set if the character c is accepted */
+#define CLASS_SIZE 32
+#define IN_CLASS(cls, c) ((cls)[(c) >> 3] & (1 << ((c) & 7)))
+
+# define Pattern_Check(obj) ((obj)->ob_type == &PatternType)
+
+
+typedef struct {
+# ifndef S_SPLINT_S
+    PyObject_HEAD;
+#endif
+
+    Py_ssize_t length;
+    uint8_t *classes;
+    Py_ssize_t shift[256];
+} PatternObject;
+
+
+
+PyDoc_STRVAR(match__doc__,
+"Wildcard byte patterns matcher, patterns are sequences of classes of\n"
+"characters and are searched in any object that supports the buffer\n"
+"interface (str, mmap, pysec.core.memory.Memory) without holding the GIL.");
+
+
+/*  Pattern Type */
+
+/*@null@*/ static PyObject* PatternType__new__(PyTypeObject *, PyObject *, PyObject *);
+static void PatternType_dealloc(PyObject *);
+/*@null@*/ static PyObject* PatternType_find(PyObject *, PyObject *, PyObject *);
+/*@null@*/ static PyObject* PatternType_findall(PyObject *, PyObject *, PyObject *);
+/*@null@*/ static PyObject* PatternType_match(PyObject *, PyObject *, PyObject *);
+static Py_ssize_t PatternType_len(PyObject *);
+
+
+static PyMemberDef PatternType_members[] = {
+    {"length", T_PYSSIZET, offsetof(PatternObject, length), READONLY, "number of tokens of the pattern"},
+    { NULL } /* sentinel */
+};
+
+static PySequenceMethods PatternType_sequence = {
+    PatternType_len,
+    0,
+    0,
+    0,
+    0,
+    0,
+    0,
+    0,
+    0,
+    0
+};
+
+PyDoc_STRVAR(PatternType_find__doc__,
+"find(data, start=0, end=-1) -> int\n\n"
+"Returns the position of the first occurrence of the pattern in\n"
+"data[start:end], -1 if it's not found.");
+
+PyDoc_STRVAR(PatternType_findall__doc__,
+"findall(data, start=0, end=-1) -> list\n\n"
+"Returns the positions of all the occurrences, also overlapping, of the\n"
+"pattern in data[start:end].");
+
+PyDoc_STRVAR(PatternType_match__doc__,
+"match(data, pos=0) -> bool\n\n"
+"Returns True if the pattern matches data at position pos.");
+
+static PyMethodDef PatternType_methods[] = {
+    {"find", (PyCFunction)PatternType_find, METH_KEYWORDS, PatternType_find__doc__},
+    {"findall", (PyCFunction)PatternType_findall, METH_KEYWORDS, PatternType_findall__doc__},
+    {"match", (PyCFunction)PatternType_match, METH_KEYWORDS, PatternType_match__doc__},
+    { NULL } /* sentinel */
+};
+
+PyDoc_STRVAR(match_PatternType__doc__,
+"Pattern(classes)\n\n"
+"Compiled pattern, classes is a string of 32 bytes for every token of\n"
+"the pattern.");
+
+static PyTypeObject PatternType = {
+    PyObject_HEAD_INIT(NULL)
+    0,                          /*ob_size*/
+    "match.Pattern",            /*tp_name*/
+    sizeof(PatternObject),      /*tp_basicsize*/
+    0,                          /*tp_itemsize*/
+    PatternType_dealloc,        /*tp_dealloc*/
+    0,                          /*tp_print*/
+    0,                          /*tp_getattr*/
+    0,                          /*tp_setattr*/
+    0,                          /*tp_compare*/
+    0,                          /*tp_repr*/
+    0,                          /*tp_as_number*/
+    &PatternType_sequence,      /*tp_as_sequence*/
+    0,                          /*tp_as_mapping*/
+    0,                          /*tp_hash */
+    0,                          /*tp_call*/
+    0,                          /*tp_str*/
+    0,                          /*tp_getattro*/
+    0,                          /*tp_setattro*/
+    0,                          /*tp_as_buffer*/
+    Py_TPFLAGS_DEFAULT,         /*tp_flags*/
+    match_PatternType__doc__,   /* tp_doc */
+    0,		                    /* tp_traverse */
+    0,		                    /* tp_clear */
+    0,		                    /* tp_richcompare */
+    0,		                    /* tp_weaklistoffset */
+    0,		                    /* tp_iter */
+    0,		                    /* tp_iternext */
+    PatternType_methods,        /* tp_methods */
+    PatternType_members,        /* tp_members */
+    0,                          /* tp_getset */
+    0,                          /* tp_base */
+    0,                          /* tp_dict */
+    0,                          /* tp_descr_get */
+    0,                          /* tp_descr_set */
+    0,                          /* tp_dictoffset */
+    0,                          /* tp_init */
+    0,                          /* tp_alloc */
+    PatternType__new__,         /* tp_new */
+};
+
+/* API */
+
+/*@null@*/
+PyObject*
+Pattern_New(const uint8_t *classes, Py_ssize_t length)
+{
+    PatternObject *pat;
+    const uint8_t *cls;
+    Py_ssize_t i;
+    int ch;
+
+    pat = (PatternObject *)PatternType.tp_alloc(&PatternType, 0);
+    if (pat == NULL)
+        return NULL;
+
+    pat->length = length;
+    if ((pat->classes = PyMem_MALLOC(length * CLASS_SIZE)) == NULL) {
+        Py_DECREF(pat);
+        return PyErr_NoMemory();
+    }
+    memcpy(pat->classes, classes, length * CLASS_SIZE);
+
+    /* Horspool's table, the shift for a character is the distance from the
+     * end of the pattern of the last class (excluding the end) that
+     * accepts it */
+    for (ch = 0; ch < 256; ch++)
+        pat->shift[ch] = length;
+    for (i = 0; i < length - 1; i++) {
+        cls = classes + i * CLASS_SIZE;
+        for (ch = 0; ch < 256; ch++) {
+            if (IN_CLASS(cls, ch))
+                pat->shift[ch] = length - 1 - i;
+        }
+    }
+
+    return (PyObject *)pat;
+}
+
+int
+Pattern_match(PatternObject *pat, const uint8_t *text, Py_ssize_t pos)
+{
+    Py_ssize_t i;
+
+    for (i = pat->length - 1; i >= 0; i--) {
+        if (!IN_CLASS(pat->classes + i * CLASS_SIZE, text[pos + i]))
+            return 0;
+    }
+    return 1;
+}
+
+/* must be called with text[start:end] valid, it doesn't need the GIL */
+Py_ssize_t
+Pattern_find(PatternObject *pat, const uint8_t *text, Py_ssize_t start, Py_ssize_t end)
+{
+    Py_ssize_t pos, last;
+
+    last = end - pat->length;
+    for (pos = start; pos <= last; pos += pat->shift[text[pos + pat->length - 1]]) {
+        if (Pattern_match(pat, text, pos))
+            return pos;
+    }
+    return -1;
+}
+
+static int
+Pattern_bounds(Py_buffer *view, Py_ssize_t *start, Py_ssize_t *end)
+{
+    if (*end < 0 || *end > view->len)
+        *end = view->len;
+    if (*start < 0) {
+        PyErr_Format(PyExc_ValueError, "negative offset: %zd", *start);
+        return -1;
+    }
+    return 0;
+}
+
+/* methods */
+
+/*@null@*/
+static PyObject*
+PatternType__new__(PyTypeObject *subtype, PyObject *args, PyObject *kwds)
+{
+    const char *classes;
+    Py_ssize_t size;
+    static char *kwlist[] = { "classes", NULL };
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "s#:Pattern", kwlist, &classes, &size))
+        return NULL;
+    if (size == 0 || size % CLASS_SIZE) {
+        PyErr_Format(PyExc_ValueError, "wrong classes size: %zd", size);
+        return NULL;
+    }
+    return Pattern_New((const uint8_t *)classes, size / CLASS_SIZE);
+}
+
+static void
+PatternType_dealloc(PyObject* self)
+{
+    PyMem_FREE(((PatternObject *)self)->classes);
+    Py_TYPE(self)->tp_free(self);
+}
+
+static Py_ssize_t
+PatternType_len(PyObject *o)
+{
+    if (!Pattern_Check(o)) {
+        PyErr_BadArgument();
+        return -1;
+    }
+    return ((PatternObject *)o)->length;
+}
+
+/*@null@*/
+static PyObject*
+PatternType_find(PyObject *self, PyObject *args, PyObject *kwds)
+{
+    Py_buffer view;
+    Py_ssize_t start = 0, end = -1, where;
+    static char *kwlist[] = {"data", "start", "end", NULL};
+
+    if (!Pattern_Check(self)) {
+        PyErr_BadArgument();
+        return NULL;
+    }
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "s*|nn:find", kwlist, &view, &start, &end))
+        return NULL;
+    if (Pattern_bounds(&view, &start, &end) < 0) {
+        PyBuffer_Release(&view);
+        return NULL;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    where = Pattern_find((PatternObject *)self, view.buf, start, end);
+    Py_END_ALLOW_THREADS
+
+    PyBuffer_Release(&view);
+    return PyInt_FromSsize_t(where);
+}
+
+/*@null@*/
+static PyObject*
+PatternType_findall(PyObject *self, PyObject *args, PyObject *kwds)
+{
+    Py_buffer view;
+    Py_ssize_t start = 0, end = -1, where, *found = NULL, *tmp, n = 0, size = 0, i;
+    int nomem = 0;
+    PyObject *list, *item;
+    static char *kwlist[] = {"data", "start", "end", NULL};
+
+    if (!Pattern_Check(self)) {
+        PyErr_BadArgument();
+        return NULL;
+    }
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "s*|nn:findall", kwlist, &view, &start, &end))
+        return NULL;
+    if (Pattern_bounds(&view, &start, &end) < 0) {
+        PyBuffer_Release(&view);
+        return NULL;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    while ((where = Pattern_find((PatternObject *)self, view.buf, start, end)) >= 0) {
+        if (n == size) {
+            size = size ? size * 2 : 64;
+            if ((tmp = realloc(found, size * sizeof(Py_ssize_t))) == NULL) {
+                nomem = 1;
+                break;
+            }
+            found = tmp;
+        }
+        found[n++] = where;
+        start = where + 1;
+    }
+    Py_END_ALLOW_THREADS
+
+    PyBuffer_Release(&view);
+    if (nomem) {
+        free(found);
+        return PyErr_NoMemory();
+    }
+    if ((list = PyList_New(n)) == NULL) {
+        free(found);
+        return NULL;
+    }
+    for (i = 0; i < n; i++) {
+        if ((item = PyInt_FromSsize_t(found[i])) == NULL) {
+            free(found);
+            Py_DECREF(list);
+            return NULL;
+        }
+        PyList_SET_ITEM(list, i, item);
+    }
+    free(found);
+    return list;
+}
+
+/*@null@*/
+static PyObject*
+PatternType_match(PyObject *self, PyObject *args, PyObject *kwds)
+{
+    Py_buffer view;
+    Py_ssize_t pos = 0;
+    int res;
+    static char *kwlist[] = {"data", "pos", NULL};
+
+    if (!Pattern_Check(self)) {
+        PyErr_BadArgument();
+        return NULL;
+    }
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "s*|n:match", kwlist, &view, &pos))
+        return NULL;
+    if (pos < 0) {
+        PyBuffer_Release(&view);
+        PyErr_Format(PyExc_ValueError, "negative offset: %zd", pos);
+        return NULL;
+    }
+
+    res = pos + ((PatternObject *)self)->length <= view.len &&
+          Pattern_match((PatternObject *)self, view.buf, pos);
+    PyBuffer_Release(&view);
+    return PyBool_FromLong(res);
+}
+
+
+static PyMethodDef match_methods[] = {
+    { NULL } /* sentinel */
+};
+
+
+#ifndef PyMODINIT_FUNC
+#define PyMODINIT_FUNC void
+#endif
+PyMODINIT_FUNC
+initmatch(void)
+{
+    PyObject *m;
+
+    PatternType.tp_new = PatternType__new__;
+    if (PyType_Ready(&PatternType) < 0)
+        return;
+
+    m = Py_InitModule3("match", match_methods, match__doc__);
+    if(m == NULL)
+        return;
+
+    Py_INCREF(&PatternType);
+    PyModule_AddObject(m, "Pattern", (PyObject *)&PatternType);
+    PyModule_AddIntConstant(m, "CLASS_SIZE", CLASS_SIZE);
+}
@@ -63,6 +63,9 @@ static int MemoryType_assslice(PyObject *, Py_ssize_t, Py_ssize_t, PyObject *);
 static int MemoryType_contains(PyObject *, PyObject *);
 /*@null@*/ static PyObject* MemoryType_read(PyObject *self, PyObject *args, PyObject *kwds);
 /*@null@*/ static PyObject* MemoryType_write(PyObject *self, PyObject *args, PyObject *kwds);
+static Py_ssize_t MemoryType_getreadbuf(PyObject *, Py_ssize_t, void **);
+static Py_ssize_t MemoryType_getsegcount(PyObject *, Py_ssize_t *);
+static int MemoryType_getbuffer(PyObject *, Py_buffer *, int);
 
 
 static PyMemberDef MemoryType_members[] = {
@@ -83,6 +86,15 @@ static PySequenceMethods MemoryType_sequence = {
     0
 };
 
+static PyBufferProcs MemoryType_buffer = {
+    MemoryType_getreadbuf,
+    MemoryType_getreadbuf,
+    MemoryType_getsegcount,
+    (charbufferproc)MemoryType_getreadbuf,
+    MemoryType_getbuffer,
+    0
+};
+
 
 static PyMethodDef MemoryType_methods[] = {
     {"set", (PyCFunction)MemoryType_set, METH_KEYWORDS, "TODO"},
@@ -119,8 +131,9 @@ static PyTypeObject MemoryType = {
     MemoryType_str,             /*tp_str*/
     0,                          /*tp_getattro*/
     0,                          /*tp_setattro*/
-    0,                          /*tp_as_buffer*/
-    Py_TPFLAGS_DEFAULT,         /*tp_flags*/
+    &MemoryType_buffer,         /*tp_as_buffer*/
+    Py_TPFLAGS_DEFAULT |
+      Py_TPFLAGS_HAVE_NEWBUFFER,  /*tp_flags*/
     memory_MemoryType__doc__,       /* tp_doc */
     0,		                    /* tp_traverse */
     0,		                    /* tp_clear */
@@ -390,7 +403,7 @@ MemoryType_set(PyObject *self, PyObject *args, PyObject *kwds)
         return NULL;
     }
 
-    if (!PyArg_ParseTupleAndKeywords(args, kwds, "n:set", kwlist, &n, &b))
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "nb:set", kwlist, &n, &b))
         return NULL;
     old = Memory_set((MemoryObject *)self, n, b);
     if (old < 0)
@@ -618,12 +631,15 @@ MemoryType_assitem(PyObject *o, Py_ssize_t i, PyObject *v)
         if (tmp == NULL)
             return -1;
         val = PyInt_AsLong(tmp);
+        Py_DECREF(tmp);
         if (val == -1 && PyErr_Occurred())
             return -1;
         if (val < 0 || val > 255) {
-            PyErr_Format(PyExc_IndexError, "index out of bounds, %ld", val);
+            PyErr_Format(PyExc_ValueError, "byte out of range, %ld", val);
             return -1;
         }
+        if (Memory_set((MemoryObject *)o, i, (uint8_t)val) < 0)
+            return -1;
     }
     else {
         PyErr_SetString(PyExc_TypeError, "value must be a 1-char string or a 1-byte integer");
@@ -675,6 +691,34 @@ MemoryType_assslice(PyObject *o, Py_ssize_t a, Py_ssize_t b, PyObject* v)
     return 0;
 }
 
+/* buffer methods */
+
+static Py_ssize_t
+MemoryType_getreadbuf(PyObject *o, Py_ssize_t segment, void **ptr)
+{
+    if (segment != 0) {
+        PyErr_SetString(PyExc_SystemError, "accessing non-existent memory segment");
+        return -1;
+    }
+    *ptr = ((MemoryObject *)o)->mem;
+    return ((MemoryObject *)o)->size;
+}
+
+static Py_ssize_t
+MemoryType_getsegcount(PyObject *o, Py_ssize_t *lenp)
+{
+    if (lenp != NULL)
+        *lenp = ((MemoryObject *)o)->size;
+    return 1;
+}
+
+static int
+MemoryType_getbuffer(PyObject *o, Py_buffer *view, int flags)
+{
+    return PyBuffer_FillInfo(view, o, ((MemoryObject *)o)->mem,
+                             ((MemoryObject *)o)->size, 0, flags);
+}
+
 /*
 int tp_print(MemoryObject* self, FILE *file, int flags)
 {
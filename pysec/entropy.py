@@ -17,33 +17,41 @@
 # limitations under the License.
 #
 # -*- coding: ascii -*-
+from array import array
 import math
+import mmap
 
-from pysec.core import Dict
+from pysec.core import Dict, Object, histogram
+from pysec.core.memory import Memory
+from pysec.io import fd
 from pysec import lang
 
-__all__ = 'Entropy', 'ent_bytes'
+__all__ = 'Entropy', 'ByteCounter', 'SymbolCounter', 'ent_bytes', \
+          'byte_histogram', 'hist_entropy', 'ent_profile'
+
+
+CHUNK_SIZE = 2 ** 16
+
+# objects counted directly by pysec.core.histogram, files are read in chunks
+_BUFFERS = str, bytearray, buffer, mmap.mmap, Memory
 
 
 class Entropy(Dict):
 
     def __init__(self, *symbols, **freqs):
         super(Entropy, self).__init__((sym, 0) for sym in symbols)
-        count = 0
+        self.count = 0
         for sym, freq in freqs.iteritems():
-            freq = int(freq)
-            if freq < 0:
-                raise ValueError(lang.ENT_NEGATIVE_FREQ % freq)
             self[sym] = freq
-            count += freq
-        self.count = count
 
     def increment(self, symbol):
-        self[symbol] += 1
-        return self[symbol]
+        freq = super(Entropy, self).__getitem__(symbol) + 1
+        super(Entropy, self).__setitem__(symbol, freq)
+        self.count += 1
+        return freq
 
     def __setitem__(self, symbol, freq):
-        old_freq = self[symbol]
+        old_freq = self.get(symbol, 0)
         freq = int(freq)
         if freq < 0:
             raise ValueError(lang.ENT_NEGATIVE_FREQ % freq)
@@ -57,38 +65,256 @@ class Entropy(Dict):
         return self.entropy()
 
     def entropy(self, base=2):
-        h = 0
-        base = int(base)
-        if base < 2:
-            raise ValueError(lang.ENT_NEGATIVE_BASE % base)
-        count = self.count
-        for value in self.iteritems():
-            if not value:
-                continue
-            p_i = float(value) / count
-            h -= p_i * math.log(p_i, base)
-        return h
+        return hist_entropy(self.values(), base)
 
     def iterincrement(self, *values):
         for val in values:
             self.increment(val)
 
     def clone(self):
-        return Entropy(**self)
+        ent = Entropy()
+        ent.update(self)
+        return ent
+
+    def update(self, other=(), **freqs):
+        """Sets the frequencies as dict.update does, the count is kept"""
+        if hasattr(other, 'keys'):
+            for sym in other.keys():
+                self[sym] = other[sym]
+        else:
+            for sym, freq in other:
+                self[sym] = freq
+        for sym, freq in freqs.iteritems():
+            self[sym] = freq
+
+
+class ByteCounter(Object):
+    """Counts of the 256 byte values, kept in an array('L')"""
+
+    def __init__(self, data=None):
+        self.counts = array('L', [0]) * histogram.BINS
+        if data is not None:
+            self.update(data)
+
+    def update(self, data):
+        """Counts the bytes in data, it can be an object accepted by
+        byte_histogram or an iterable of 1-char strings or integers. If an
+        error occurs the counts are not changed"""
+        if isinstance(data, _BUFFERS) or isinstance(data, fd.File):
+            byte_histogram(data, self.counts)
+            return
+        counts = array('L', [0]) * histogram.BINS
+        for byte in data:
+            if isinstance(byte, (int, long)):
+                if not 0 <= byte < histogram.BINS:
+                    raise ValueError(lang.ENT_WRONG_BYTE % byte)
+            else:
+                byte = str(byte)
+                if len(byte) != 1:
+                    raise ValueError(lang.ENT_WRONG_BYTE % byte)
+                byte = ord(byte)
+            counts[byte] += 1
+        _add_counts(self.counts, counts)
+
+    def merge(self, *counters):
+        """Adds the counts of other ByteCounters, e.g. computed by parallel
+        workers on different parts of the data"""
+        for counter in counters:
+            _add_counts(self.counts, counter.counts)
+        return self
+
+    def __getitem__(self, byte):
+        return self.counts[ord(byte) if isinstance(byte, str) else byte]
+
+    @property
+    def total(self):
+        """Number of counted bytes"""
+        return sum(self.counts)
+
+    def items(self):
+        """Returns the list of (byte, count) of the counted bytes"""
+        return [(chr(byte), cnt) for byte, cnt in enumerate(self.counts)
+                if cnt]
+
+    def entropy(self, base=2):
+        return hist_entropy(self.counts, base)
+
+    def __float__(self):
+        return self.entropy()
+
+
+class SymbolCounter(Object):
+    """Counts of any hashable symbols, kept in a dict"""
+
+    def __init__(self, data=None):
+        self.counts = {}
+        if data is not None:
+            self.update(data)
+
+    def update(self, data):
+        """Counts the symbols in the iterable data"""
+        counts = self.counts
+        get = counts.get
+        for sym in data:
+            counts[sym] = get(sym, 0) + 1
+
+    def merge(self, *counters):
+        """Adds the counts of other SymbolCounters, e.g. computed by parallel
+        workers on different parts of the data"""
+        counts = self.counts
+        get = counts.get
+        for counter in counters:
+            for sym, cnt in counter.counts.iteritems():
+                counts[sym] = get(sym, 0) + cnt
+        return self
+
+    def __getitem__(self, sym):
+        return self.counts.get(sym, 0)
+
+    @property
+    def total(self):
+        """Number of counted symbols"""
+        return sum(self.counts.itervalues())
+
+    def items(self):
+        """Returns the list of (symbol, count) of the counted symbols"""
+        return self.counts.items()
+
+    def entropy(self, base=2):
+        return hist_entropy(self.counts.values(), base)
+
+    def __float__(self):
+        return self.entropy()
 
 
 BYTES = ''.join(chr(ch) for ch in xrange(256))
 
 
+def byte_histogram(data, counts=None):
+    """Returns an array('L') with the counts of the 256 byte values in data,
+    if counts is not None it's updated and returned.
+    data can be a string, a buffer, a mmap, a pysec.core.memory.Memory or a
+    pysec.io.fd.File that will be read in chunks of CHUNK_SIZE: the chunks
+    are counted apart, so counts is not changed if a read fails"""
+    if counts is None:
+        counts = array('L', [0]) * histogram.BINS
+    if isinstance(data, fd.File):
+        size = len(data)
+        start = 0
+        file_counts = array('L', [0]) * histogram.BINS
+        while start < size:
+            histogram.update(file_counts, data[start:start+CHUNK_SIZE])
+            start += CHUNK_SIZE
+        _add_counts(counts, file_counts)
+    else:
+        histogram.update(counts, data)
+    return counts
+
+
+def _add_counts(counts, other):
+    """Adds the array('L') of counts other to counts"""
+    for byte, cnt in enumerate(other):
+        if cnt:
+            counts[byte] += cnt
+
+
+def hist_entropy(counts, base=2):
+    """Returns the entropy of the symbols counted in *counts*"""
+    base = int(base)
+    if base < 2:
+        raise ValueError(lang.ENT_NEGATIVE_BASE % base)
+    total = sum(counts)
+    if not total:
+        return 0.
+    log = math.log
+    h = log(total) - sum(cnt * log(cnt) for cnt in counts if cnt) / total
+    return max(h / log(base), 0.)
+
+
 def ent_bytes(bytes, base=2):
-    ent = Entropy(*BYTES)
-    for byte in bytes:
-        if isinstance(byte, int):
-            byte = chr(byte)
-        else:
-            byte = str(byte)
-            if len(byte) != 1:
-                raise ValueError(lang.ENT_WRONG_BYTE % byte)
-        ent.increment(byte)
-    return ent.entropy(base)
+    """Returns the entropy of the bytes in *bytes*, it can be an object
+    accepted by byte_histogram or an iterable of 1-char strings or integers"""
+    return ByteCounter(bytes).entropy(base)
+
+
+def _chunks(stream, size):
+    """Yields the content of *stream* in chunks of max *size* bytes, stream
+    can be an object accepted by byte_histogram, a socket (recv) or a
+    file-like object (read)"""
+    if isinstance(stream, _BUFFERS):
+        for start in xrange(0, len(stream), size):
+            yield buffer(stream, start, size)
+    elif isinstance(stream, fd.File):
+        pos = 0
+        chunk = stream.pread(size, pos)
+        while chunk:
+            yield chunk
+            pos += len(chunk)
+            chunk = stream.pread(size, pos)
+    else:
+        read = getattr(stream, 'recv', None) or stream.read
+        chunk = read(size)
+        while chunk:
+            yield chunk
+            chunk = read(size)
+
 
+def ent_profile(stream, window=4096, step=None, base=2):
+    """Yields the tuples (offset, entropy) of the windows of *window* bytes
+    of *stream*, starting every *step* bytes (default: window). stream can be
+    a string, a buffer, a mmap, a pysec.core.memory.Memory, a
+    pysec.io.fd.File, a socket or a file-like object. Only the last window
+    is kept in memory, the histogram is updated with the bytes entering and
+    leaving the window and the entropy in constant time. If the stream is
+    shorter than window the entropy of the whole stream is yielded."""
+    window = int(window)
+    step = window if step is None else int(step)
+    if window <= 0 or step <= 0:
+        raise ValueError("window and step must be positive: %d, %d"
+                         % (window, step))
+    base = int(base)
+    if base < 2:
+        raise ValueError(lang.ENT_NEGATIVE_BASE % base)
+    log = math.log
+    log_base = log(base)
+    counts = array('L', [0]) * histogram.BINS
+    ring = bytearray(window)
+    start = filled = 0
+    klogk = 0.
+    consumed = 0
+    need = window
+    for chunk in _chunks(stream, max(CHUNK_SIZE, window)):
+        chunk = bytearray(chunk)
+        pos = 0
+        while pos < len(chunk):
+            piece = chunk[pos:pos+need]
+            size = len(piece)
+            pos += size
+            consumed += size
+            if size >= window:
+                counts = array('L', [0]) * histogram.BINS
+                ring = piece[-window:]
+                start = 0
+                filled = window
+                klogk = histogram.slide(counts, '', ring)
+            else:
+                leave = max(0, filled + size - window)
+                # oldest bytes leave, the new ones are written after the
+                # remaining window
+                leaving = ring[start:start+leave]
+                leaving += ring[:leave - len(leaving)]
+                start = (start + leave) % window
+                filled -= leave
+                wpos = (start + filled) % window
+                head = piece[:window - wpos]
+                ring[wpos:wpos+len(head)] = head
+                ring[:size - len(head)] = piece[len(head):]
+                filled += size
+                klogk += histogram.slide(counts, leaving, piece)
+            need -= size
+            if not need:
+                yield consumed - filled, \
+                    max((log(filled) - klogk / filled) / log_base, 0.)
+                need = step
+    if filled and consumed < window:
+        yield 0, max((log(filled) - klogk / filled) / log_base, 0.)
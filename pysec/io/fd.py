@@ -18,6 +18,7 @@
 #
 # -*- coding: ascii -*-
 """Contains FD and FD-like classes for operations with file descriptors"""
+import errno
 import os
 
 from pysec.core import Error, Object, unistd, dirent, fcntl
@@ -397,6 +398,24 @@ class File(FD):
         byte, offset = divmod(n, 8)
         self[byte] = self[byte] | (1 << offset)
 
+    def lock(self, ltype=fcntl.F_WRLCK, start=0, length=0, wait=1):
+        """Sets a record lock of type *ltype* (fcntl.F_RDLCK, fcntl.F_WRLCK
+        or fcntl.F_UNLCK to release it) on *length* bytes from *start*, to
+        the end of file if length is 0. If *wait* is false returns a false
+        value instead of waiting for a conflicting lock."""
+        ltype = int(ltype)
+        if ltype == fcntl.F_WRLCK and \
+           not (self.flags & fcntl.O_WRONLY or self.flags & fcntl.O_RDWR):
+            raise NotWriteableFD(self)
+        try:
+            fcntl.lock(self.fd, fcntl.F_SETLKW if wait else fcntl.F_SETLK,
+                       ltype, int(start), int(length))
+        except OSError, ex:
+            if not wait and ex.errno in (errno.EACCES, errno.EAGAIN):
+                return 0
+            raise
+        return 1
+
     @write_check
     def truncate(self, length=0):
         """Truncate the file and if the pointer is in a inexistent part of file
@@ -17,24 +17,202 @@
 # limitations under the License.
 #
 # -*- coding: ascii -*-
+import os
+from bisect import bisect_left
+from collections import OrderedDict
 from types import DictType
-from pysec.core import Object
+from pysec.core import Error, Object
+from pysec.io import fd
+from pysec.kv.bloom import BloomFilter
+from pysec.kv.cache import LRUPolicy
 
 
 __all__ = 'KV', 'SoftKV', 'HardKV', 'HybridKV'
 
 
+# minimum capacity of the Bloom filters built by HardKV.open_bloom
+BLOOM_CAPACITY = 2 ** 16
+# defaults of HybridKV: cached entries, dirty entries written together in
+# write-back mode and remembered missing keys
+CACHE_ENTRIES = 2 ** 16
+CACHE_BATCH = 64
+CACHE_NEGATIVE = 2 ** 12
 
-class KV(Object, DictType):
+
+_NO_KEY = Object()
+
+# (device, inode) of the lock files held by the writers of this process,
+# fcntl locks belong to the process so they don't exclude its own writers
+_WRITER_LOCKS = set()
+
+
+class Locked(Error):
+    """Raised when the store is already opened for writing by another
+    process"""
+
+    def __init__(self, path):
+        super(Locked, self).__init__()
+        self.path = str(path)
+
+
+class ReadOnly(Error):
+    """Raised writing in a store opened in read-only mode"""
     pass
 
 
+def _items(items):
+    """Returns an iterator of the couples (key, value) of a mapping or of a
+    sequence of couples"""
+    return items.iteritems() if hasattr(items, 'iteritems') else iter(items)
+
+
+def _sync_dir(path):
+    """Flushes to the disk the directory of path, so a rename in it survives
+    a crash"""
+    with fd.Directory.open(os.path.dirname(os.path.abspath(path))) as fdir:
+        os.fsync(int(fdir))
+
+
+def _key_range(start, stop, prefix):
+    """Returns the bounds (start, stop) of the keys greater or equal than
+    start, less than stop and starting with prefix, None is unbounded"""
+    if prefix:
+        if start is None or start < prefix:
+            start = prefix
+        # the smallest string greater than the ones starting with prefix
+        end = prefix.rstrip('\xff')
+        if end:
+            end = end[:-1] + chr(ord(end[-1]) + 1)
+            if stop is None or stop > end:
+                stop = end
+    return start, stop
+
+
+def _scan_sorted(keys, start, stop, prefix, reverse):
+    """Yields the keys of the sorted list *keys* in the range given by
+    start, stop and prefix"""
+    start, stop = _key_range(start, stop, prefix)
+    low = 0 if start is None else bisect_left(keys, start)
+    high = len(keys) if stop is None else bisect_left(keys, stop)
+    if reverse:
+        while high > low:
+            high -= 1
+            yield keys[high]
+    else:
+        while low < high:
+            yield keys[low]
+            low += 1
+
+
+class KV(Object, DictType):
+
+    def get_many(self, keys):
+        """Returns a dictionary with the values of the keys that are
+        present"""
+        values = {}
+        for key in keys:
+            value = self.get(key, _NO_KEY)
+            if value is not _NO_KEY:
+                values[key] = value
+        return values
+
+    def set_many(self, items):
+        """Sets the couples (key, value) of items, a mapping or a sequence
+        of couples"""
+        for key, value in _items(items):
+            self[key] = value
+
+    def delete_many(self, keys):
+        """Deletes the keys that are present, returns how many they were"""
+        count = 0
+        for key in keys:
+            if key in self:
+                del self[key]
+                count += 1
+        return count
+
+    def _sorted_keys(self):
+        """Returns the sorted list of the keys"""
+        return sorted(self.iterkeys())
+
+    def scan(self, start=None, stop=None, prefix=None, limit=None,
+             reverse=False):
+        """Yields the items whose keys are greater or equal than start, less
+        than stop and start with prefix, in the order of the keys (reversed
+        if reverse is true). At most *limit* items are yielded, the values
+        are read only when they are reached."""
+        count = 0
+        for key in _scan_sorted(self._sorted_keys(), start, stop, prefix,
+                                reverse):
+            if limit is not None and count >= limit:
+                break
+            value = self.get(key, _NO_KEY)
+            # the key can be deleted while scanning
+            if value is not _NO_KEY:
+                yield key, value
+                count += 1
+
+
 class SoftKV(KV):
     pass
 
 
 class HardKV(KV):
 
+    # pysec.kv.bloom.BloomFilter of the keys, None if it's not used
+    bloom = None
+
+    def may_contain(self, key):
+        """Returns a false value if key is surely missing, according to the
+        Bloom filter"""
+        return self.bloom is None or key in self.bloom
+
+    def lock_writer(self, path):
+        """Returns the file *path* locked for the only writer of the store,
+        unlock_writer() releases it. Raises Locked if another writer, of this
+        or of another process, holds the lock."""
+        # the file is not opened if this process holds the lock, closing a
+        # descriptor of it would release the lock
+        try:
+            stat = os.stat(path)
+        except OSError:
+            pass
+        else:
+            if (stat.st_dev, stat.st_ino) in _WRITER_LOCKS:
+                raise Locked(path)
+        flock = fd.File.open(path, fd.FO_WRITE)
+        if not flock.lock(wait=0):
+            flock.close()
+            raise Locked(path)
+        _WRITER_LOCKS.add((flock.device, flock.inode))
+        return flock
+
+    def unlock_writer(self, flock):
+        """Releases the lock returned by lock_writer()"""
+        _WRITER_LOCKS.discard((flock.device, flock.inode))
+        flock.close()
+
+    def open_bloom(self, path, stamp, capacity=None):
+        """Loads the Bloom filter of the keys saved in *path* with *stamp*,
+        if it's missing or stale a new filter is built from the keys"""
+        try:
+            self.bloom = BloomFilter.load(path, stamp)
+        except (OSError, IOError, ValueError):
+            bloom = BloomFilter(capacity or
+                                max(len(self) * 2, BLOOM_CAPACITY))
+            bloom.update(self.iterkeys())
+            self.bloom = bloom
+        self.grow_bloom()
+
+    def grow_bloom(self):
+        """Builds the Bloom filter again for twice the keys if they are more
+        than its capacity, so its false positives stay rare. The stores call
+        it after adding keys"""
+        if self.bloom is not None and len(self) > self.bloom.capacity:
+            bloom = BloomFilter(len(self) * 2)
+            bloom.update(self.iterkeys())
+            self.bloom = bloom
+
     def size(self):
         """Get the amount of occupied memory"""
         raise NotImplementedError
@@ -43,6 +221,10 @@ class HardKV(KV):
         """Close persistent object"""
         raise NotImplementedError
 
+    def drop(self):
+        """Close persistent object and remove its files"""
+        raise NotImplementedError
+
     def __enter__(self):
         return self
 
@@ -51,26 +233,291 @@ class HardKV(KV):
         return 0
 
 
-_NO_KEY = Object()
-
-
 class HybridKV(HardKV, SoftKV):
+    """Cache of the hard store in the soft store. The cache is bounded by
+    *max_entries* entries and *max_bytes* bytes of keys and values (None
+    for no limit), the keys to evict are chosen by *policy*, a class of
+    pysec.kv.cache. The writes are done in the hard store at once or, if
+    *write_back* is true, when *batch_size* keys are dirty, when they are
+    evicted or by flush(). Up to *max_negative* missing keys are remembered
+    so they aren't looked up again in the hard store. The counters of the
+    cache are in the stats dictionary."""
 
     def __init__(self, soft_cls, hard_cls, soft_args=(), soft_kwargs=None,
-                 hard_args=(), hard_kwargs=None):
+                 hard_args=(), hard_kwargs=None, policy=LRUPolicy,
+                 max_entries=CACHE_ENTRIES, max_bytes=None, write_back=0,
+                 batch_size=CACHE_BATCH, max_negative=CACHE_NEGATIVE):
         self.soft = soft_cls(*soft_args,
                              **({} if soft_kwargs is None else soft_kwargs))
         self.hard = hard_cls(*hard_args,
                              **({} if hard_kwargs is None else hard_kwargs))
+        for name, limit in (('max_entries', max_entries),
+                            ('max_bytes', max_bytes)):
+            if limit is not None and int(limit) <= 0:
+                raise ValueError("%s is not positive: %r" % (name, limit))
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.write_back = write_back
+        self.batch_size = max(int(batch_size), 1)
+        self.max_negative = max(int(max_negative), 0)
+        self._policy = policy()
+        # sizes of the cached entries
+        self._sizes = {}
+        self._bytes = 0
+        self._dirty = set()
+        self._negative = OrderedDict()
+        self.stats = dict.fromkeys(('hits', 'misses', 'negative_hits',
+                                    'evictions', 'writes', 'flushes'), 0)
+
+    def _over_budget(self):
+        return (self.max_entries is not None and
+                len(self._sizes) > self.max_entries) or \
+               (self.max_bytes is not None and self._bytes > self.max_bytes)
+
+    def _admit(self, key, value):
+        """Adds key to the cache and evicts the entries over the budget"""
+        size = len(str(key)) + len(str(value))
+        old = self._sizes.get(key, None)
+        if old is None:
+            self._policy.insert(key)
+        else:
+            self._bytes -= old
+            self._policy.hit(key)
+        self.soft[key] = value
+        self._sizes[key] = size
+        self._bytes += size
+        while self._sizes and self._over_budget():
+            self._evict(self._policy.victim())
+
+    def _evict(self, key):
+        value = self.soft.pop(key)
+        self._bytes -= self._sizes.pop(key)
+        if key in self._dirty:
+            self._dirty.discard(key)
+            self.hard[key] = value
+        self.stats['evictions'] += 1
+
+    def _forget(self, key):
+        """Removes key from the cache without writing it"""
+        if key in self._sizes:
+            self.soft.pop(key)
+            self._bytes -= self._sizes.pop(key)
+            self._policy.remove(key)
+        self._dirty.discard(key)
+
+    def _miss(self, key):
+        """Remembers that key is missing"""
+        if self.max_negative:
+            self._negative[key] = None
+            if len(self._negative) > self.max_negative:
+                self._negative.popitem(last=False)
+
+    def flush(self):
+        """Writes the dirty entries in the hard store"""
+        if self._dirty:
+            soft = self.soft
+            self.hard.set_many((key, soft[key]) for key in self._dirty)
+            self._dirty.clear()
+            self.stats['flushes'] += 1
 
     def refresh(self):
-        raise NotImplementedError
+        """Writes the dirty entries and empties the cache, so the next reads
+        are done from the hard store"""
+        self.flush()
+        self.soft.clear()
+        self._sizes.clear()
+        self._bytes = 0
+        self._negative.clear()
+        self._policy.clear()
+
+    def scan(self, start=None, stop=None, prefix=None, limit=None,
+             reverse=False):
+        """Scans the hard store after writing the dirty entries, the items
+        read are not cached so a scan doesn't evict the hot entries"""
+        self.flush()
+        return self.hard.scan(start, stop, prefix, limit, reverse)
+
+    def size(self):
+        return self.hard.size()
+
+    def close(self):
+        self.flush()
+        self.hard.close()
+
+    def drop(self):
+        self.refresh()
+        self.hard.drop()
 
     def get(self, key, default=None):
-        value = self.soft.get(key, _NO_KEY)
-        return self.hard.get(key, default) if value is _NO_KEY else value
+        if key in self._sizes:
+            self.stats['hits'] += 1
+            self._policy.hit(key)
+            return self.soft[key]
+        if key in self._negative:
+            self.stats['negative_hits'] += 1
+            return default
+        self.stats['misses'] += 1
+        value = self.hard.get(key, _NO_KEY) if self.hard.may_contain(key) \
+            else _NO_KEY
+        if value is _NO_KEY:
+            self._miss(key)
+            return default
+        self._admit(key, value)
+        return value
+
+    def get_many(self, keys):
+        """Returns a dictionary with the values of the keys that are
+        present, the keys that are not cached are read from the hard store
+        with a single call"""
+        values = {}
+        missing = []
+        stats = self.stats
+        for key in keys:
+            if key in self._sizes:
+                stats['hits'] += 1
+                self._policy.hit(key)
+                values[key] = self.soft[key]
+            elif key in self._negative:
+                stats['negative_hits'] += 1
+            else:
+                stats['misses'] += 1
+                missing.append(key)
+        may_contain = self.hard.may_contain
+        found = self.hard.get_many([key for key in missing
+                                    if may_contain(key)])
+        for key in missing:
+            value = found.get(key, _NO_KEY)
+            if value is _NO_KEY:
+                self._miss(key)
+            else:
+                values[key] = value
+                self._admit(key, value)
+        return values
+
+    def set_many(self, items):
+        """Sets the couples (key, value) of items, in write-through mode they
+        are written in the hard store with a single call"""
+        items = list(_items(items))
+        if not self.write_back:
+            self.hard.set_many(items)
+        for key, value in items:
+            self.stats['writes'] += 1
+            self._negative.pop(key, None)
+            if self.write_back:
+                self._dirty.add(key)
+            self._admit(key, value)
+        if len(self._dirty) >= self.batch_size:
+            self.flush()
+
+    def delete_many(self, keys):
+        """Deletes the keys that are present, returns how many they were"""
+        keys = list(keys)
+        self.flush()
+        for key in keys:
+            self._forget(key)
+            self._miss(key)
+        return self.hard.delete_many(keys)
 
     def __getitem__(self, key):
-        value = self.soft.get(key, _NO_KEY)
-        return self.hard.get[key] if value is _NO_KEY else value
+        value = self.get(key, _NO_KEY)
+        if value is _NO_KEY:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.stats['writes'] += 1
+        self._negative.pop(key, None)
+        if self.write_back:
+            # marked before admitting, so an eviction writes it
+            self._dirty.add(key)
+        else:
+            self.hard[key] = value
+        self._admit(key, value)
+        if len(self._dirty) >= self.batch_size:
+            self.flush()
+
+    def __delitem__(self, key):
+        cached = key in self._sizes
+        self._forget(key)
+        try:
+            del self.hard[key]
+        except KeyError:
+            if not cached:
+                raise
+        self._miss(key)
+
+    def __contains__(self, key):
+        return self.get(key, _NO_KEY) is not _NO_KEY
+
+    def __len__(self):
+        self.flush()
+        return len(self.hard)
+
+    def __iter__(self):
+        self.flush()
+        return iter(self.hard)
+
+    def __str__(self):
+        return '<HybridKV %s>' % hex(id(self))
+
+    def __repr__(self):
+        return '{%s}' % ', '.join('%r: %r' % (k, v)
+                                  for k, v in self.iteritems())
+
+    def clear(self):
+        self.refresh()
+        self.hard.clear()
+
+    def copy(self):
+        return dict(self.iteritems())
+
+    @classmethod
+    def fromkeys(seq, value=None):
+        raise NotImplementedError
+
+    def has_key(self, key):
+        return key in self
+
+    def items(self):
+        return list(self.iteritems())
+
+    def iteritems(self):
+        self.flush()
+        return self.hard.iteritems()
+
+    def values(self):
+        return list(self.itervalues())
+
+    def itervalues(self):
+        return (value for _, value in self.iteritems())
+
+    def keys(self):
+        return list(self)
+
+    def iterkeys(self):
+        return iter(self)
+
+    def pop(self, key, *default):
+        value = self.get(key, _NO_KEY)
+        if value is _NO_KEY:
+            if default:
+                return default[0]
+            raise KeyError(key)
+        del self[key]
+        return value
+
+    def popitem(self):
+        for key, value in self.iteritems():
+            del self[key]
+            return key, value
+        raise KeyError("popitem(): dictionary is empty")
+
+    def setdefault(self, key, default=None):
+        value = self.get(key, _NO_KEY)
+        if value is _NO_KEY:
+            self[key] = value = default
+        return value
 
+    def update(self, *other, **kwargs):
+        for items in other + (kwargs,):
+            self.set_many(items)
@@ -0,0 +1,129 @@
+# Python Security Project (PySec) and its related class files.
+#
+# PySec is a set of tools for secure application development under Linux
+#
+# Copyright 2014 PySec development team
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# -*- coding: ascii -*-
+"""Bloom filters to skip the key-value stores that don't contain a key"""
+import hashlib
+import math
+import os
+import struct
+
+from pysec.core import Object
+from pysec.core.memory import Memory
+from pysec.io import fd
+
+
+__all__ = 'BloomFilter',
+
+
+# default false positive probability
+ERROR_RATE = 0.01
+# file header: magic, version, bits, hash functions, length of the stamp
+BLOOM_MAGIC = 'PYSECBLM'
+BLOOM_VERSION = 1
+_HEADER = struct.Struct('>8sIQIH')
+
+
+class BloomFilter(Object):
+    """Set of keys with false positives and no false negatives, sized for
+    *capacity* keys with a false positive probability of *error_rate*.
+    The bits are kept in a pysec.core.memory.Memory, every key sets nhashes
+    bits computed by double hashing. The filter doesn't grow: with more keys
+    than capacity the false positives become more frequent."""
+
+    def __init__(self, capacity, error_rate=ERROR_RATE):
+        capacity = int(capacity)
+        if capacity <= 0:
+            raise ValueError("capacity is not positive: %r" % capacity)
+        error_rate = float(error_rate)
+        if not 0. < error_rate < 1.:
+            raise ValueError("wrong error rate: %r" % error_rate)
+        nbits = int(math.ceil(-capacity * math.log(error_rate) /
+                              math.log(2) ** 2))
+        self._setup(nbits, max(1, int(round(nbits * math.log(2) /
+                                            capacity))))
+        self.capacity = capacity
+
+    def _setup(self, nbits, nhashes):
+        self.nbits = nbits
+        self.nhashes = nhashes
+        self.bits = Memory((nbits + 7) / 8)
+        # keys for which the filter is sized, approximated by the optimal
+        # number of hash functions if it's loaded
+        self.capacity = max(1, int(nbits * math.log(2) / nhashes))
+
+    def _positions(self, key):
+        """Returns the bits of key"""
+        hash1, hash2 = struct.unpack('>QQ', hashlib.md5(str(key)).digest())
+        nbits = self.nbits
+        return [(hash1 + i * hash2) % nbits for i in xrange(0, self.nhashes)]
+
+    def add(self, key):
+        bits = self.bits
+        for pos in self._positions(key):
+            byte = pos >> 3
+            bits[byte] = bits[byte] | (1 << (pos & 7))
+
+    def update(self, keys):
+        for key in keys:
+            self.add(key)
+
+    def __contains__(self, key):
+        bits = self.bits
+        for pos in self._positions(key):
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return 0
+        return 1
+
+    def clear(self):
+        self.bits[0:len(self.bits)] = '\0' * len(self.bits)
+
+    def dump(self, path, stamp=''):
+        """Saves the filter in *path*, *stamp* identifies the state of the
+        keys. The file is replaced only when it's complete."""
+        stamp = str(stamp)
+        tmp_path = '%s.tmp' % path
+        with fd.File.open(tmp_path, fd.FO_WRITETR) as fbloom:
+            fbloom.write(_HEADER.pack(BLOOM_MAGIC, BLOOM_VERSION, self.nbits,
+                                      self.nhashes, len(stamp)) + stamp +
+                         self.bits[0:len(self.bits)])
+            os.fsync(int(fbloom))
+        os.rename(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, stamp=None):
+        """Loads a filter saved by dump, raises ValueError if the file is not
+        valid or if stamp is not None and it's different from the saved
+        one"""
+        with fd.File.open(path, fd.FO_READEX) as fbloom:
+            data = fbloom[0:len(fbloom)]
+        if len(data) < _HEADER.size:
+            raise ValueError("bloom filter too short")
+        magic, version, nbits, nhashes, slen = _HEADER.unpack_from(data)
+        if magic != BLOOM_MAGIC or version != BLOOM_VERSION:
+            raise ValueError("unknown bloom filter format")
+        saved = data[_HEADER.size:_HEADER.size+slen]
+        if stamp is not None and str(stamp) != saved:
+            raise ValueError("stamp mismatch: %r" % saved)
+        bits = data[_HEADER.size+slen:]
+        if not nbits or not nhashes or len(bits) != (nbits + 7) / 8:
+            raise ValueError("wrong bloom filter size")
+        self = cls.__new__(cls)
+        self._setup(nbits, nhashes)
+        self.bits[0:len(bits)] = bits
+        return self
@@ -0,0 +1,168 @@
+# Python Security Project (PySec) and its related class files.
+#
+# PySec is a set of tools for secure application development under Linux
+#
+# Copyright 2014 PySec development team
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# -*- coding: ascii -*-
+"""Eviction policies of the cache of pysec.kv.HybridKV, a policy tracks the
+cached keys and chooses the key to evict"""
+from collections import OrderedDict
+import heapq
+
+from pysec.core import Object
+
+
+__all__ = 'LRUPolicy', 'LFUPolicy', 'ARCPolicy'
+
+
+class LRUPolicy(Object):
+    """Evicts the least recently used key"""
+
+    def __init__(self):
+        self._keys = OrderedDict()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def insert(self, key):
+        """Tracks a key added to the cache"""
+        self._keys[key] = None
+
+    def hit(self, key):
+        """Tracks an access to a cached key"""
+        del self._keys[key]
+        self._keys[key] = None
+
+    def remove(self, key):
+        """Stops tracking a key removed from the cache"""
+        self._keys.pop(key, None)
+
+    def victim(self):
+        """Returns the key to evict and stops tracking it"""
+        return self._keys.popitem(last=False)[0]
+
+    def clear(self):
+        self._keys.clear()
+
+
+class LFUPolicy(Object):
+    """Evicts the least frequently used key, the least recently used one
+    between the keys with the same count"""
+
+    def __init__(self):
+        self._counts = {}
+        # (count, age, key), the entries with an old count are skipped
+        self._heap = []
+        self._age = 0
+
+    def __len__(self):
+        return len(self._counts)
+
+    def _push(self, key, count):
+        self._age += 1
+        self._counts[key] = count
+        heapq.heappush(self._heap, (count, self._age, key))
+        if len(self._heap) > 2 * len(self._counts) + 64:
+            # drops the stale entries
+            self._heap = [entry for entry in self._heap
+                          if self._counts.get(entry[2]) == entry[0]]
+            heapq.heapify(self._heap)
+
+    def insert(self, key):
+        self._push(key, 1)
+
+    def hit(self, key):
+        self._push(key, self._counts[key] + 1)
+
+    def remove(self, key):
+        self._counts.pop(key, None)
+
+    def victim(self):
+        counts = self._counts
+        while 1:
+            count, _, key = heapq.heappop(self._heap)
+            if counts.get(key) == count:
+                del counts[key]
+                return key
+
+    def clear(self):
+        self._counts.clear()
+        self._heap = []
+
+
+class ARCPolicy(Object):
+    """Adaptive replacement cache: the keys seen once and the ones seen more
+    times are kept in two LRU lists, the evicted keys are remembered in two
+    ghost lists and a hit in a ghost list moves the target size of the
+    lists. The capacity of the original algorithm is the number of cached
+    keys, so it works with budgets of bytes too."""
+
+    def __init__(self):
+        self._t1 = OrderedDict()
+        self._t2 = OrderedDict()
+        self._b1 = OrderedDict()
+        self._b2 = OrderedDict()
+        # target size of t1
+        self._target = 0
+
+    def __len__(self):
+        return len(self._t1) + len(self._t2)
+
+    def insert(self, key):
+        size = len(self)
+        if key in self._b1:
+            self._target = min(size, self._target +
+                               max(len(self._b2) / len(self._b1), 1))
+            del self._b1[key]
+            self._t2[key] = None
+        elif key in self._b2:
+            self._target = max(0, self._target -
+                               max(len(self._b1) / len(self._b2), 1))
+            del self._b2[key]
+            self._t2[key] = None
+        else:
+            self._t1[key] = None
+
+    def hit(self, key):
+        if key in self._t1:
+            del self._t1[key]
+        else:
+            del self._t2[key]
+        self._t2[key] = None
+
+    def remove(self, key):
+        self._t1.pop(key, None)
+        self._t2.pop(key, None)
+
+    def victim(self):
+        if self._t1 and (len(self._t1) > self._target or not self._t2):
+            key = self._t1.popitem(last=False)[0]
+            self._b1[key] = None
+        else:
+            key = self._t2.popitem(last=False)[0]
+            self._b2[key] = None
+        # the ghost lists remember as many keys as the cache
+        size = max(len(self), 1)
+        while len(self._b1) > size:
+            self._b1.popitem(last=False)
+        while len(self._b2) > size:
+            self._b2.popitem(last=False)
+        return key
+
+    def clear(self):
+        for keys in (self._t1, self._t2, self._b1, self._b2):
+            keys.clear()
+        self._target = 0
@@ -0,0 +1,179 @@
+# Python Security Project (PySec) and its related class files.
+#
+# PySec is a set of tools for secure application development under Linux
+#
+# Copyright 2014 PySec development team
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# -*- coding: ascii -*-
+"""Codecs of the values of the key-value stores. A codec turns a value in a
+string and back, decode() accepts any object with the buffer interface so
+the stores pass a view of the record they read instead of a copy."""
+import zlib
+
+from pysec.core import Object
+
+
+__all__ = 'Codec', 'IntCodec', 'FieldsCodec', 'CompressCodec', 'ZlibCodec'
+
+
+# values shorter than this are never compressed
+COMPRESS_THRESHOLD = 512
+# first byte of the values encoded by CompressCodec
+FLAG_RAW = '\x00'
+FLAG_COMPRESSED = '\x01'
+
+
+def pack_varint(num):
+    """Returns the unsigned integer num in 7 bits groups, the least
+    significant first, the high bit is set in all the bytes but the last"""
+    if num < 0:
+        raise ValueError("negative number: %d" % num)
+    data = bytearray()
+    while num > 0x7f:
+        data.append(num & 0x7f | 0x80)
+        num >>= 7
+    data.append(num)
+    return str(data)
+
+
+def unpack_varint(data, pos=0):
+    """Returns the number packed by pack_varint() at data[pos] and the
+    position after it"""
+    num = shift = 0
+    size = len(data)
+    while 1:
+        if pos >= size:
+            raise ValueError("truncated varint")
+        byte = ord(data[pos])
+        num |= (byte & 0x7f) << shift
+        pos += 1
+        if not byte & 0x80:
+            return num, pos
+        shift += 7
+
+
+def pack_fields(fields):
+    """Returns the strings in fields, everyone preceded by its length"""
+    return ''.join('%s%s' % (pack_varint(len(field)), field)
+                   for field in fields)
+
+
+def unpack_fields(data):
+    """Returns the list of the strings packed by pack_fields()"""
+    fields = []
+    pos = 0
+    size = len(data)
+    while pos < size:
+        flen, pos = unpack_varint(data, pos)
+        if pos + flen > size:
+            raise ValueError("truncated field")
+        fields.append(data[pos:pos+flen])
+        pos += flen
+    return fields
+
+
+class Codec(Object):
+    """Codec of strings, the values are stored as they are"""
+
+    def encode(self, value):
+        return str(value)
+
+    def decode(self, data):
+        return str(data)
+
+
+class IntCodec(Codec):
+    """Codec of integers, they are stored as varints after a zigzag
+    encoding, so small negative numbers are short too"""
+
+    def encode(self, value):
+        value = int(value)
+        return pack_varint(value << 1 if value >= 0 else (-value << 1) - 1)
+
+    def decode(self, data):
+        num, pos = unpack_varint(data)
+        if pos != len(data):
+            raise ValueError("data after the varint")
+        return num >> 1 if not num & 1 else -((num + 1) >> 1)
+
+
+class FieldsCodec(Codec):
+    """Codec of tuples of strings, every field is preceded by its length"""
+
+    def encode(self, value):
+        return pack_fields(str(field) for field in value)
+
+    def decode(self, data):
+        return tuple(unpack_fields(data))
+
+
+class CompressCodec(Codec):
+    """Compresses with *compress* the values encoded by *codec* that are
+    long at least *threshold* bytes, if that makes them shorter. A flag byte
+    tells whether the value is compressed, *decompress* is called with it
+    and *max_size*, the limit of the decompressed size: a positive number
+    or None for no limit."""
+
+    def __init__(self, compress, decompress, codec=None,
+                 threshold=COMPRESS_THRESHOLD, max_size=None):
+        self.compress = compress
+        self.decompress = decompress
+        self.codec = Codec() if codec is None else codec
+        self.threshold = int(threshold)
+        if max_size is not None:
+            max_size = int(max_size)
+            # zlib takes 0 as no limit
+            if max_size <= 0:
+                raise ValueError("max_size is not positive: %r" % max_size)
+        self.max_size = max_size
+
+    def encode(self, value):
+        data = self.codec.encode(value)
+        if len(data) >= self.threshold:
+            packed = self.compress(data)
+            if len(packed) < len(data):
+                return '%s%s' % (FLAG_COMPRESSED, packed)
+        return '%s%s' % (FLAG_RAW, data)
+
+    def decode(self, data):
+        flag = data[:1]
+        if flag == FLAG_RAW:
+            return self.codec.decode(buffer(data, 1))
+        if flag == FLAG_COMPRESSED:
+            return self.codec.decode(self.decompress(buffer(data, 1),
+                                                     self.max_size))
+        raise ValueError("unknown flag: %r" % flag)
+
+
+def _inflate(data, max_size):
+    """Decompresses data, raises ValueError if the result is longer than
+    max_size"""
+    if max_size is None:
+        return zlib.decompress(data)
+    dec = zlib.decompressobj()
+    value = dec.decompress(data, max_size)
+    if dec.unconsumed_tail:
+        raise ValueError("decompressed value too long")
+    return value
+
+
+class ZlibCodec(CompressCodec):
+    """CompressCodec that uses zlib with the compression *level*"""
+
+    def __init__(self, codec=None, threshold=COMPRESS_THRESHOLD, level=6,
+                 max_size=None):
+        level = int(level)
+        CompressCodec.__init__(self, lambda data: zlib.compress(data, level),
+                               _inflate, codec, threshold, max_size)
@@ -0,0 +1,574 @@
+# Python Security Project (PySec) and its related class files.
+#
+# PySec is a set of tools for secure application development under Linux
+#
+# Copyright 2014 PySec development team
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# -*- coding: ascii -*-
+"""Key-value store with an on-disk hash index, only the items requested are
+read from the disk"""
+import hashlib
+import os
+import struct
+from collections import OrderedDict
+
+from pysec.alg import Blocks
+from pysec.io import fd
+from pysec.kv import HardKV, _items
+from pysec.kv.codec import Codec
+from pysec.kv.simple import InvalidFormat, REC_SET, RECORD_LEN, \
+                            make_record, parse_record, _RECORD
+
+
+__all__ = 'HashKV',
+
+
+# index header: magic, version, clean flag, generation of the data file,
+# generation of a stale data file, capacity, items, used slots (items and
+# deleted). The stale data file is the one being written by a compaction
+# or, after it, the old one: it's removed if the compaction is interrupted.
+MAGIC = 'PYSECHKV'
+VERSION = 1
+HEADER_FMT = '>8sIIIIQQQ'
+HEADER_LEN = struct.calcsize(HEADER_FMT)
+_HEADER = struct.Struct(HEADER_FMT)
+# slot: hash of the key, offset and size of the record in the data file
+SLOT_FMT = '>QQI'
+SLOT_LEN = struct.calcsize(SLOT_FMT)
+_SLOT = struct.Struct(SLOT_FMT)
+_HASH = struct.Struct('>Q')
+EMPTY = 0
+DELETED = 1
+MIN_CAPACITY = 64
+# the index is resized when the used slots are more than this fraction
+MAX_LOAD = 0.6
+# slots read with a single pread while probing
+PROBE_SLOTS = 8
+# size of the writes done rebuilding the files
+WRITE_SIZE = 2 ** 16
+# bytes of the keys read with the head of a record when only the keys are
+# needed, longer keys need a second read
+KEY_READ = 64
+
+
+def _hash(key):
+    """Returns the 64 bit hash of key, it's never EMPTY or DELETED"""
+    khash = _HASH.unpack_from(hashlib.sha1(key).digest())[0]
+    return khash if khash > DELETED else khash + 2
+
+
+def _open_pair(path):
+    """Returns the read and the write descriptors of path"""
+    frd = fd.File.open(path, fd.FO_READ)
+    fwr = fd.File.open(path, fd.FO_WRITE)
+    if frd.inode != fwr.inode:
+        raise Exception('file %r changed' % path)
+    return frd, fwr
+
+
+def _insert_slot(frd, fwr, capacity, khash, offset, size):
+    """Writes the slot (khash, offset, size) in the first empty slot of the
+    index with *capacity* slots read by frd and written by fwr"""
+    mask = capacity - 1
+    slot = khash & mask
+    while 1:
+        count = min(PROBE_SLOTS, capacity - slot)
+        data = frd.pread(count * SLOT_LEN, HEADER_LEN + slot * SLOT_LEN)
+        for pos in xrange(0, count * SLOT_LEN, SLOT_LEN):
+            if _HASH.unpack_from(data, pos)[0] == EMPTY:
+                fwr.pwrite(_SLOT.pack(khash, offset, size),
+                           HEADER_LEN + slot * SLOT_LEN + pos)
+                return
+        slot = (slot + count) & mask
+
+
+class HashKV(HardKV):
+    """Key-value store made of an index file at *path*, an open addressing
+    hash table with linear probing, and a data file where the records are
+    appended. A lookup needs a read from the index and one from the data
+    file, the data are never loaded in memory. The index is rebuilt when
+    it's too full, compact() rewrites the data file without the dead
+    records. If *sync* is true every write is flushed to the disk. If
+    *bloom* is true a Bloom filter of the keys is kept and saved in the
+    file path.bloom, so most lookups of missing keys don't read the
+    disk. The values are stored encoded by *codec*, a
+    pysec.kv.codec.Codec, by default as strings. Only a process at a time
+    can open the store, it holds a lock on the file path.lock. The keys
+    are not kept in memory, but scan() needs their sorted list: it uses
+    memory proportional to the number of the items."""
+
+    def __init__(self, path, capacity=MIN_CAPACITY, sync=0, bloom=0,
+                 codec=None):
+        self.path = str(path)
+        self._sync = sync
+        self.codec = Codec() if codec is None else codec
+        # sorted list of the keys used by scan(), None if it must be rebuilt
+        self._keys = None
+        self._idx_rd = self._idx_wr = self._dat_rd = self._dat_wr = None
+        self._flock = self.lock_writer(self._lock_path())
+        try:
+            self._open(capacity)
+        except:
+            self._close_fds()
+            raise
+        if bloom:
+            self.open_bloom(self._bloom_path(), self._stamp())
+
+    def _open(self, capacity):
+        self._idx_rd, self._idx_wr = _open_pair(self.path)
+        if not len(self._idx_rd):
+            capacity = max(int(capacity), MIN_CAPACITY)
+            self._capacity = 1 << (capacity - 1).bit_length()
+            self._gen = self._stale = self._count = self._used = 0
+            self._idx_wr.truncate(HEADER_LEN + self._capacity * SLOT_LEN)
+        else:
+            header = self._idx_rd.pread(HEADER_LEN, 0)
+            if len(header) != HEADER_LEN:
+                raise InvalidFormat("index too short")
+            magic, version, clean, self._gen, self._stale, self._capacity, \
+                self._count, self._used = _HEADER.unpack(header)
+            if magic != MAGIC:
+                raise InvalidFormat("wrong magic: %r" % magic)
+            if version != VERSION:
+                raise InvalidFormat("unknown version: %r" % version)
+            if len(self._idx_rd) != HEADER_LEN + self._capacity * SLOT_LEN:
+                raise InvalidFormat("wrong index size")
+            if not clean:
+                self._recount()
+        self._dat_rd, self._dat_wr = _open_pair(self._data_path(self._gen))
+        self._end = len(self._dat_rd)
+        self._remove_stale()
+        self._write_header(0)
+
+    def _bloom_path(self):
+        return '%s.bloom' % self.path
+
+    def _lock_path(self):
+        return '%s.lock' % self.path
+
+    def _stamp(self):
+        """Returns the state of the keys saved with the Bloom filter"""
+        return '%d:%d' % (self._gen, self._end)
+
+    def _data_path(self, gen):
+        return '%s.%d' % (self.path, gen)
+
+    def _tmp_path(self):
+        return '%s.tmp' % self.path
+
+    def _remove_stale(self):
+        """Removes the files left by an interrupted rebuild: the stale data
+        file recorded in the header and the temporary files of the index and
+        of the Bloom filter"""
+        paths = [self._tmp_path(), '%s.tmp' % self._bloom_path()]
+        if self._stale != self._gen:
+            paths.append(self._data_path(self._stale))
+        for path in paths:
+            if os.path.exists(path):
+                os.unlink(path)
+
+    def _write_header(self, clean):
+        self._idx_wr.pwrite(_HEADER.pack(MAGIC, VERSION, clean, self._gen,
+                                         self._stale, self._capacity,
+                                         self._count, self._used), 0)
+
+    def _slots(self):
+        """Yields (slot, hash, offset, size) of the slots in use, reading the
+        index sequentially"""
+        data = Blocks(self._idx_rd)
+        for slot in xrange(0, self._capacity):
+            pos = HEADER_LEN + slot * SLOT_LEN
+            khash, offset, size = _SLOT.unpack(data[pos:pos+SLOT_LEN])
+            if khash != EMPTY:
+                yield slot, khash, offset, size
+
+    def _recount(self):
+        """Counts the items and the used slots after a crash"""
+        self._count = self._used = 0
+        for _, khash, _, _ in self._slots():
+            self._used += 1
+            if khash != DELETED:
+                self._count += 1
+
+    def _record(self, offset, size):
+        return parse_record(self._dat_rd.pread(size, offset))
+
+    def _key(self, offset, size):
+        """Returns the key of the record at offset, its value is not read"""
+        data = self._dat_rd.pread(min(size, RECORD_LEN + KEY_READ), offset)
+        if len(data) < RECORD_LEN:
+            raise InvalidFormat("record too short")
+        flag, klen, vlen, _ = _RECORD.unpack_from(data)
+        if flag != REC_SET or size != RECORD_LEN + klen + vlen:
+            raise InvalidFormat("corrupted record")
+        key = data[RECORD_LEN:RECORD_LEN+klen]
+        if len(key) < klen:
+            key += self._dat_rd.pread(klen - len(key), offset + len(data))
+        return key
+
+    def _find(self, key, khash):
+        """Returns (slot, value, reuse): slot of key and its encoded value
+        or, if key is missing, the slot where it can be inserted and None,
+        reuse is true if that slot contained a deleted item"""
+        mask = self._capacity - 1
+        slot = khash & mask
+        free = None
+        while 1:
+            count = min(PROBE_SLOTS, self._capacity - slot)
+            data = self._idx_rd.pread(count * SLOT_LEN,
+                                      HEADER_LEN + slot * SLOT_LEN)
+            for pos in xrange(0, count * SLOT_LEN, SLOT_LEN):
+                shash, offset, size = _SLOT.unpack_from(data, pos)
+                if shash == EMPTY:
+                    if free is None:
+                        return slot + pos / SLOT_LEN, None, 0
+                    return free, None, 1
+                if shash == DELETED:
+                    if free is None:
+                        free = slot + pos / SLOT_LEN
+                elif shash == khash:
+                    _, rkey, value = self._record(offset, size)
+                    if rkey == key:
+                        return slot + pos / SLOT_LEN, value, 0
+            slot = (slot + count) & mask
+
+    def _write_slot(self, slot, khash, offset=0, size=0, sync=1):
+        self._idx_wr.pwrite(_SLOT.pack(khash, offset, size),
+                            HEADER_LEN + slot * SLOT_LEN)
+        if sync and self._sync:
+            os.fsync(int(self._idx_wr))
+
+    def _append(self, data):
+        """Appends data to the data file, returns its offset"""
+        offset = self._end
+        self._dat_wr.pwrite(data, offset)
+        self._end += len(data)
+        if self._sync:
+            os.fsync(int(self._dat_wr))
+        return offset
+
+    def _put(self, key, khash, offset, size, sync=1):
+        """Points the slot of key to the record at offset, the record must be
+        already written"""
+        slot, old, reuse = self._find(key, khash)
+        self._write_slot(slot, khash, offset, size, sync)
+        if self.bloom is not None:
+            self.bloom.add(key)
+        if old is None:
+            self._count += 1
+            self._keys = None
+            if not reuse:
+                self._used += 1
+                capacity = self._capacity
+                if self._used > capacity * MAX_LOAD:
+                    # the index grows only if the deleted items are few
+                    self._rebuild(capacity * 2
+                                  if self._count > capacity * MAX_LOAD / 2
+                                  else capacity)
+
+    def _rebuild(self, capacity, compact=0, entries=None):
+        """Writes a new index with *capacity* slots and the entries (hash,
+        offset, size), by default the ones in use. If compact is true the
+        live records are copied in a new data file too. The entries are
+        streamed from the old index and written in the new one at their
+        slots, so the memory used doesn't grow with the items. The new
+        index replaces the old one with a rename."""
+        if entries is None:
+            entries = ((khash, offset, size) for _, khash, offset, size
+                       in self._slots() if khash != DELETED)
+        gen = self._gen
+        # after the rename the old data file is the stale one
+        stale = gen if compact else self._stale
+        fdat = None
+        if compact:
+            gen += 1
+            # the new data file is removed if the compaction is interrupted
+            self._stale = gen
+            self._write_header(0)
+            os.fsync(int(self._idx_wr))
+            fdat = fd.File.open(self._data_path(gen), fd.FO_WRITETR)
+        tmp_path = self._tmp_path()
+        count = end = 0
+        try:
+            with fd.File.open(tmp_path, fd.FO_WRITETR) as fidx_wr, \
+                    fd.File.open(tmp_path, fd.FO_READ) as fidx_rd:
+                fidx_wr.truncate(HEADER_LEN + capacity * SLOT_LEN)
+                chunk = []
+                clen = 0
+                for khash, offset, size in entries:
+                    if fdat is not None:
+                        chunk.append(self._dat_rd.pread(size, offset))
+                        offset = end
+                        end += size
+                        clen += size
+                        if clen >= WRITE_SIZE:
+                            fdat.write(''.join(chunk))
+                            chunk = []
+                            clen = 0
+                    _insert_slot(fidx_rd, fidx_wr, capacity, khash, offset,
+                                 size)
+                    count += 1
+                if fdat is not None:
+                    fdat.write(''.join(chunk))
+                    os.fsync(int(fdat))
+                fidx_wr.pwrite(_HEADER.pack(MAGIC, VERSION, 0, gen, stale,
+                                            capacity, count, count), 0)
+                os.fsync(int(fidx_wr))
+        finally:
+            if fdat is not None:
+                fdat.close()
+        # the new index is committed by the rename
+        os.rename(tmp_path, self.path)
+        self._idx_rd.close()
+        self._idx_wr.close()
+        self._idx_rd, self._idx_wr = _open_pair(self.path)
+        self._capacity = capacity
+        self._stale = stale
+        self._count = self._used = count
+        if gen != self._gen:
+            self._dat_rd.close()
+            self._dat_wr.close()
+            os.unlink(self._data_path(self._gen))
+            self._gen = gen
+            self._dat_rd, self._dat_wr = _open_pair(self._data_path(gen))
+            self._end = len(self._dat_rd)
+
+    def compact(self):
+        """Rewrites the data file without the dead records"""
+        self._rebuild(self._capacity, 1)
+
+    def capacity(self):
+        """Returns the number of slots of the index"""
+        return self._capacity
+
+    def size(self):
+        return self._end + HEADER_LEN + self._capacity * SLOT_LEN
+
+    def sync(self):
+        """Flushes the files to the disk"""
+        self._write_header(0)
+        os.fsync(int(self._dat_wr))
+        os.fsync(int(self._idx_wr))
+
+    def close(self):
+        if self._idx_wr is not None:
+            os.fsync(int(self._dat_wr))
+            self._write_header(1)
+            os.fsync(int(self._idx_wr))
+            if self.bloom is not None:
+                self.bloom.dump(self._bloom_path(), self._stamp())
+        self._close_fds()
+
+    def _close_fds(self):
+        for name in ('_idx_rd', '_idx_wr', '_dat_rd', '_dat_wr'):
+            fdesc = getattr(self, name, None)
+            if fdesc is not None:
+                fdesc.close()
+                setattr(self, name, None)
+        if self._flock is not None:
+            self.unlock_writer(self._flock)
+            self._flock = None
+
+    def drop(self):
+        self.close()
+        os.unlink(self._data_path(self._gen))
+        os.unlink(self.path)
+        if os.path.exists(self._bloom_path()):
+            os.unlink(self._bloom_path())
+        os.unlink(self._lock_path())
+
+    def __len__(self):
+        return self._count
+
+    def _get(self, key):
+        """Returns the encoded value of key, None if it's missing"""
+        if not self.may_contain(key):
+            return None
+        return self._find(key, _hash(key))[1]
+
+    def __getitem__(self, key):
+        key = str(key)
+        value = self._get(key)
+        if value is None:
+            raise KeyError(key)
+        return self.codec.decode(value)
+
+    def __setitem__(self, key, value):
+        key = str(key)
+        record = make_record(REC_SET, key, self.codec.encode(value))
+        # the record is written before the slot that points to it
+        self._put(key, _hash(key), self._append(record), len(record))
+        self.grow_bloom()
+
+    def __delitem__(self, key):
+        key = str(key)
+        slot, old, _ = self._find(key, _hash(key))
+        if old is None:
+            raise KeyError(key)
+        self._write_slot(slot, DELETED)
+        self._count -= 1
+        self._keys = None
+
+    def get_many(self, keys):
+        """Returns a dictionary with the values of the keys that are
+        present, the index is probed in the order of the slots"""
+        mask = self._capacity - 1
+        lookups = []
+        for key in keys:
+            key = str(key)
+            if self.may_contain(key):
+                khash = _hash(key)
+                lookups.append((khash & mask, khash, key))
+        lookups.sort()
+        values = {}
+        decode = self.codec.decode
+        for _, khash, key in lookups:
+            value = self._find(key, khash)[1]
+            if value is not None:
+                values[key] = decode(value)
+        return values
+
+    def set_many(self, items):
+        """Sets the couples (key, value) of items, their records are appended
+        to the data file with a single write before the slots are updated"""
+        records = OrderedDict()
+        encode = self.codec.encode
+        for key, value in _items(items):
+            key = str(key)
+            records.pop(key, None)
+            records[key] = make_record(REC_SET, key, encode(value))
+        if not records:
+            return
+        offset = self._append(''.join(records.itervalues()))
+        for key, record in records.iteritems():
+            self._put(key, _hash(key), offset, len(record), 0)
+            offset += len(record)
+        if self._sync:
+            os.fsync(int(self._idx_wr))
+        self.grow_bloom()
+
+    def delete_many(self, keys):
+        """Deletes the keys that are present, returns how many they were"""
+        count = 0
+        for key in keys:
+            key = str(key)
+            slot, old, _ = self._find(key, _hash(key))
+            if old is not None:
+                self._write_slot(slot, DELETED, sync=0)
+                self._count -= 1
+                self._keys = None
+                count += 1
+        if count and self._sync:
+            os.fsync(int(self._idx_wr))
+        return count
+
+    def _sorted_keys(self):
+        """Returns the sorted list of the keys, it's built reading the keys
+        of the records and kept until a key is added or deleted"""
+        if self._keys is None:
+            self._keys = sorted(self)
+        return self._keys
+
+    def __contains__(self, key):
+        return self._get(str(key)) is not None
+
+    def __iter__(self):
+        """Yields the keys in the order of the index, only the keys of the
+        records are read"""
+        for _, khash, offset, size in self._slots():
+            if khash != DELETED:
+                yield self._key(offset, size)
+
+    def __str__(self):
+        return '<HashKV %s>' % hex(id(self))
+
+    def __repr__(self):
+        return '{%s}' % ', '.join('%r: %r' % (k, v)
+                                  for k, v in self.iteritems())
+
+    def clear(self):
+        self._rebuild(MIN_CAPACITY, 1, [])
+        self._keys = None
+        if self.bloom is not None:
+            self.bloom.clear()
+
+    def copy(self):
+        return dict(self.iteritems())
+
+    @classmethod
+    def fromkeys(seq, value=None):
+        raise NotImplementedError
+
+    def get(self, key, default=None):
+        value = self._get(str(key))
+        return default if value is None else self.codec.decode(value)
+
+    def has_key(self, key):
+        return key in self
+
+    def items(self):
+        return list(self.iteritems())
+
+    def iteritems(self):
+        """Yields the items in the order of the data file, so it's read
+        sequentially"""
+        entries = sorted((offset, size) for _, khash, offset, size
+                         in self._slots() if khash != DELETED)
+        data = Blocks(self._dat_rd)
+        decode = self.codec.decode
+        for offset, size in entries:
+            _, key, value = parse_record(data[offset:offset+size])
+            yield key, decode(value)
+
+    def values(self):
+        return list(self.itervalues())
+
+    def itervalues(self):
+        return (value for _, value in self.iteritems())
+
+    def keys(self):
+        return list(self)
+
+    def iterkeys(self):
+        return iter(self)
+
+    def pop(self, key, *default):
+        key = str(key)
+        slot, value, _ = self._find(key, _hash(key))
+        if value is None:
+            if default:
+                return default[0]
+            raise KeyError(key)
+        self._write_slot(slot, DELETED)
+        self._count -= 1
+        self._keys = None
+        return self.codec.decode(value)
+
+    def popitem(self):
+        for key, value in self.iteritems():
+            del self[key]
+            return key, value
+        raise KeyError("popitem(): dictionary is empty")
+
+    def setdefault(self, key, default=None):
+        value = self._get(str(key))
+        if value is None:
+            self[key] = default
+            return self[key]
+        return self.codec.decode(value)
+
+    def update(self, *other, **kwargs):
+        for items in other + (kwargs,):
+            self.set_many(items)
@@ -27,21 +27,36 @@ __name__ = 'pysec.kv.kyoto'
 
 log.register_actions('KYOTOKV_NEW', 'KYOTOKV_SET', 'KYOTOKV_GET',
                      'KYOTOKV_DEL', 'KYOTOKV_CLEAR', 'KYOTOKV_POP',
-                     'KYOTOKV_UPDATE', 'KYOTOKV_CLOSE')
+                     'KYOTOKV_UPDATE', 'KYOTOKV_CLOSE', 'KYOTOKV_GET_MANY',
+                     'KYOTOKV_SET_MANY', 'KYOTOKV_DEL_MANY')
 
 
 _OPEN_MODE = kyoto.DB.OWRITER | kyoto.DB.OREADER | kyoto.DB.OCREATE
+# readers share the file lock of Kyoto Cabinet and fail instead of waiting
+# for a writer
+_READ_MODE = kyoto.DB.OREADER | kyoto.DB.OTRYLOCK
+# databases that keep the keys sorted: on-memory and cache tree, file tree
+# and directory tree (forest)
+_ORDERED = '+', '%', '.kct', '.kcf'
 
 
 class KyotoKV(kv.HardKV):
 
     @log.wrap(log.actions.KYOTOKV_NEW, fields=('path',), lib=__name__)
-    def __init__(self, path, parse=lambda v: v, unparse=lambda v: v):
+    def __init__(self, path, parse=lambda v: v, unparse=lambda v: v,
+                 codec=None, readonly=0):
         self.fk = kyoto.DB()
-        if not self.fk.open(path, _OPEN_MODE):
+        self.readonly = readonly
+        if not self.fk.open(path, _READ_MODE if readonly else _OPEN_MODE):
             raise self.fk.error()
         self.parse = parse
         self.unparse = unparse
+        # the values are encoded by codec, if it's given, instead of parse
+        self.encode = parse if codec is None else codec.encode
+        self.decode = unparse if codec is None else codec.decode
+        path = path.split('#', 1)[0]
+        self.ordered = path in _ORDERED or \
+            os.path.splitext(path)[1] in _ORDERED
 
     @log.wrap(log.actions.KYOTOKV_CLOSE, lib=__name__)
     def close(self):
@@ -61,11 +76,11 @@ class KyotoKV(kv.HardKV):
         value = self.fk.get(self.parse(key))
         if value is None:
             raise self.fk.error()
-        return self.unparse(value)
+        return self.decode(value)
 
     @log.wrap(log.actions.KYOTOKV_SET, fields=('key', 'value'), lib=__name__)
     def __setitem__(self, key, value):
-        if not self.fk.set(self.parse(key), self.parse(value)):
+        if not self.fk.set(self.parse(key), self.encode(value)):
             raise self.fk.error()
 
     @log.wrap(log.actions.KYOTOKV_DEL, fields=('key',), lib=__name__)
@@ -73,6 +88,29 @@ class KyotoKV(kv.HardKV):
         if not self.fk.remove(self.parse(key)):
             raise self.fk.error()
 
+    @log.wrap(log.actions.KYOTOKV_GET_MANY, lib=__name__)
+    def get_many(self, keys):
+        parse, unparse, decode = self.parse, self.unparse, self.decode
+        values = self.fk.get_bulk([parse(key) for key in keys], 1)
+        if values is None:
+            raise self.fk.error()
+        return dict((unparse(key), decode(value))
+                    for key, value in values.iteritems())
+
+    @log.wrap(log.actions.KYOTOKV_SET_MANY, lib=__name__)
+    def set_many(self, items):
+        parse, encode = self.parse, self.encode
+        if self.fk.set_bulk(dict((parse(key), encode(value))
+                                 for key, value in kv._items(items)), 1) < 0:
+            raise self.fk.error()
+
+    @log.wrap(log.actions.KYOTOKV_DEL_MANY, result='count', lib=__name__)
+    def delete_many(self, keys):
+        count = self.fk.remove_bulk([self.parse(key) for key in keys], 1)
+        if count < 0:
+            raise self.fk.error()
+        return count
+
     def __contains__(self, key):
         return self.fk.check(self.parse(key)) >= 0
 
@@ -104,7 +142,7 @@ class KyotoKV(kv.HardKV):
     @log.wrap(log.actions.KYOTOKV_GET, fields=('key',), lib=__name__)
     def get(self, key, default=None):
         value = self.fk.get(self.parse(key))
-        return default if value is None else self.unparse(value)
+        return default if value is None else self.decode(value)
 
     def has_key(self, key):
         return key in self
@@ -113,7 +151,7 @@ class KyotoKV(kv.HardKV):
         return list(self.iteritems())
 
     def iteritems(self):
-        unparse = self.unparse
+        unparse, decode = self.unparse, self.decode
         try:
             cursor = self.fk.cursor()
             cursor.jump()
@@ -121,7 +159,53 @@ class KyotoKV(kv.HardKV):
                 record = cursor.get(1)
                 if record is None:
                     break
-                yield unparse(record[0]), unparse(record[1])
+                yield unparse(record[0]), decode(record[1])
+        finally:
+            cursor.disable()
+
+    def scan(self, start=None, stop=None, prefix=None, limit=None,
+             reverse=False):
+        """Yields the items in the range of keys, a tree database is read
+        with a cursor from the first key of the range, the others are
+        scanned sorting all their keys"""
+        if not self.ordered:
+            return kv.KV.scan(self, start, stop, prefix, limit, reverse)
+        parse = self.parse
+        start, stop = kv._key_range(None if start is None else parse(start),
+                                    None if stop is None else parse(stop),
+                                    None if prefix is None else parse(prefix))
+        return self._cursor_scan(start, stop, limit, reverse)
+
+    def _cursor_scan(self, start, stop, limit, reverse):
+        unparse, decode = self.unparse, self.decode
+        cursor = self.fk.cursor()
+        # the cursor is disabled also when the scan is not completed
+        try:
+            if reverse:
+                found = cursor.jump_back() if stop is None else \
+                        cursor.jump_back(stop)
+            else:
+                found = cursor.jump() if start is None else \
+                        cursor.jump(start)
+            count = 0
+            while found and (limit is None or count < limit):
+                record = cursor.get()
+                if record is None:
+                    break
+                key, value = record
+                if reverse:
+                    if start is not None and key < start:
+                        break
+                    found = cursor.step_back()
+                    # jump_back() stops on the first key not greater
+                    if stop is not None and key >= stop:
+                        continue
+                else:
+                    if stop is not None and key >= stop:
+                        break
+                    found = cursor.step()
+                yield unparse(key), decode(value)
+                count += 1
         finally:
             cursor.disable()
 
@@ -148,19 +232,24 @@ class KyotoKV(kv.HardKV):
         item = self.fk.shift()
         if item is None:
             raise KeyError("popitem(): dictionary is empty")
-        return self.unparse(item[0]), self.unparse(item[1])
+        return self.unparse(item[0]), self.decode(item[1])
 
     def setdefault(self, key, default=None):
-        key = self.parse(key)
-        return self[key] if self.fk.add(key, self.parse(default)) else default
+        if self.fk.add(self.parse(key), self.encode(default)):
+            return default
+        return self[key]
 
     @log.wrap(log.actions.KYOTOKV_UPDATE, lib=__name__)
-    def update(self, **other):
-        parse = self.parse
-        self.fk.set_bulks(((parse(k), parse(v))
-                          for k, v in other.iteritems()), 1)
+    def update(self, *other, **kwargs):
+        parse, encode = self.parse, self.encode
+        records = {}
+        for items in other + (kwargs,):
+            records.update((parse(k), encode(v))
+                           for k, v in kv._items(items))
+        if self.fk.set_bulk(records, 1) < 0:
+            raise self.fk.error()
 
     def cas(self, key, oval, nval):
-        if not self.fk.cas(self.parse(key), self.parse(oval),
-                           self.parse(nval)):
+        if not self.fk.cas(self.parse(key), self.encode(oval),
+                           self.encode(nval)):
             raise self.fk.error()
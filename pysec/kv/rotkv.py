@@ -17,10 +17,39 @@
 # limitations under the License.
 #
 # -*- coding: ascii -*-
-from pysec.kv import HardKV
+"""Key-value store split in more files with bounded size and number"""
+from itertools import izip
+from pysec.core import Object
+from pysec.kv import HardKV, _items
+from pysec.kv.bloom import BloomFilter
+
+
+__all__ = 'RotationKV',
+
+
+_NO_KEY = Object()
+
+
+def _may_contain(kv, bloom, key):
+    """Returns a false value if key is surely missing from kv, bloom is the
+    filter kept for kv, None if kv has its own"""
+    return kv.may_contain(key) if bloom is None else key in bloom
 
 
 class RotationKV(HardKV):
+    """Key-value store that writes in the newest of a list of HardKV, a new
+    one is made by *maker* (a callable without arguments) when the size of
+    the newest exceeds *maxsize* and the oldest is dropped when they are
+    more than *maxfiles*. *files* are existing HardKV, from the oldest.
+    Reads look for the key from the newest store, every store has a Bloom
+    filter so the stores without the key are skipped: its own if it keeps
+    one, otherwise one kept in memory by the RotationKV. These filters are
+    built again larger when the keys of their store exceed their
+    capacity."""
+
+    # minimum keys and false positive probability of the Bloom filters
+    bloom_capacity = 2 ** 16
+    bloom_error_rate = 0.01
 
     def __init__(self, maker, maxsize, maxfiles, *files):
         maxsize = int(maxsize)
@@ -33,79 +62,230 @@ class RotationKV(HardKV):
         self.maxfiles = maxfiles
         self.maker = maker
         self._kvs = []
+        # Bloom filters of the stores without their own, None for the others
+        self._blooms = []
+        for kv in files:
+            self._push(kv)
+        if not self._kvs:
+            self._push(maker())
+        self._trim()
+
+    def _new_bloom(self, kv):
+        """Returns a Bloom filter of the keys of kv, sized for twice them"""
+        bloom = BloomFilter(max(len(kv) * 2, self.bloom_capacity),
+                            self.bloom_error_rate)
+        bloom.update(kv.iterkeys())
+        return bloom
+
+    def _push(self, kv):
+        # the filter is not given to the store, it would save it
+        self._blooms.append(None if kv.bloom is not None
+                            else self._new_bloom(kv))
+        self._kvs.append(kv)
+
+    def _added(self, keys):
+        """Adds keys, written in the newest store, to its filter"""
+        bloom = self._blooms[-1]
+        if bloom is None:
+            return
+        kv = self._kvs[-1]
+        if len(kv) > bloom.capacity:
+            self._blooms[-1] = self._new_bloom(kv)
+        else:
+            bloom.update(keys)
+
+    def _trim(self):
+        """Drops the oldest stores exceeding maxfiles"""
+        while len(self._kvs) > self.maxfiles:
+            self._blooms.pop(0)
+            self._kvs.pop(0).drop()
+
+    def rotate(self):
+        """Makes a new store for the writes"""
+        self._push(self.maker())
+        self._trim()
+
+    def _lookup(self, key):
+        """Returns the value of key in the newest store, _NO_KEY if it's
+        missing"""
+        for kv, bloom in izip(reversed(self._kvs), reversed(self._blooms)):
+            if _may_contain(kv, bloom, key):
+                value = kv.get(key, _NO_KEY)
+                if value is not _NO_KEY:
+                    return value
+        return _NO_KEY
 
     def __len__(self):
-        return sum(len(kv) for kv in self._kvs)
+        return sum(1 for _ in self.iterkeys())
 
     def __getitem__(self, key):
-        raise NotImplementedError
+        value = self._lookup(key)
+        if value is _NO_KEY:
+            raise KeyError(key)
+        return value
 
     def __setitem__(self, key, value):
-        raise NotImplementedError
+        kv = self._kvs[-1]
+        kv[key] = value
+        self._added((key,))
+        if kv.size() > self.maxsize:
+            self.rotate()
 
     def __delitem__(self, key):
-        raise NotImplementedError
+        found = 0
+        for kv, bloom in izip(self._kvs, self._blooms):
+            if _may_contain(kv, bloom, key) and key in kv:
+                del kv[key]
+                found = 1
+        if not found:
+            raise KeyError(key)
+
+    def get_many(self, keys):
+        """Returns a dictionary with the values of the keys that are
+        present, every store is asked only for the keys not found in the
+        newer ones"""
+        missing = list(keys)
+        values = {}
+        for kv, bloom in izip(reversed(self._kvs), reversed(self._blooms)):
+            if not missing:
+                break
+            found = kv.get_many([key for key in missing
+                                 if _may_contain(kv, bloom, key)])
+            if found:
+                values.update(found)
+                missing = [key for key in missing if key not in found]
+        return values
+
+    def set_many(self, items):
+        items = list(_items(items))
+        kv = self._kvs[-1]
+        kv.set_many(items)
+        self._added(key for key, _ in items)
+        if kv.size() > self.maxsize:
+            self.rotate()
+
+    def delete_many(self, keys):
+        keys = list(keys)
+        deleted = set()
+        for kv, bloom in izip(self._kvs, self._blooms):
+            found = [key for key in keys
+                     if _may_contain(kv, bloom, key) and key in kv]
+            if found:
+                kv.delete_many(found)
+                deleted.update(found)
+        return len(deleted)
+
+    def _sorted_keys(self):
+        keys = set()
+        for kv in self._kvs:
+            keys.update(kv._sorted_keys())
+        return sorted(keys)
 
     def __contains__(self, key):
-        raise NotImplementedError
+        return self._lookup(key) is not _NO_KEY
 
     def __iter__(self):
-        raise NotImplementedError
+        seen = set()
+        for kv in reversed(self._kvs):
+            for key in kv:
+                if key not in seen:
+                    seen.add(key)
+                    yield key
 
     def __str__(self):
-        raise NotImplementedError
+        return '<RotationKV %s>' % hex(id(self))
 
     def __repr__(self):
-        raise NotImplementedError
+        return '{%s}' % ', '.join('%r: %r' % (k, v)
+                                  for k, v in self.iteritems())
 
     def size(self):
-        raise NotImplementedError
+        return sum(kv.size() for kv in self._kvs)
+
+    def close(self):
+        for kv in self._kvs:
+            kv.close()
+
+    def drop(self):
+        for kv in self._kvs:
+            kv.drop()
+        self._kvs = []
+        self._blooms = []
 
     def clear(self):
-        raise NotImplementedError
+        for kv, bloom in izip(self._kvs, self._blooms):
+            kv.clear()
+            if bloom is not None:
+                bloom.clear()
 
     def copy(self):
-        raise NotImplementedError
+        return dict(self.iteritems())
 
     @classmethod
     def fromkeys(seq, value=None):
         raise NotImplementedError
 
     def get(self, key, default=None):
-        raise NotImplementedError
+        value = self._lookup(key)
+        return default if value is _NO_KEY else value
 
     def has_key(self, key):
-        raise NotImplementedError
+        return key in self
 
     def items(self):
-        raise NotImplementedError
+        return list(self.iteritems())
 
     def iteritems(self):
-        raise NotImplementedError
+        """Yields the items from the newest store, the keys overwritten in a
+        newer store are skipped"""
+        seen = set()
+        for kv in reversed(self._kvs):
+            for key, value in kv.iteritems():
+                if key not in seen:
+                    seen.add(key)
+                    yield key, value
 
     def values(self):
-        raise NotImplementedError
+        return list(self.itervalues())
 
     def itervalues(self):
-        raise NotImplementedError
+        return (value for _, value in self.iteritems())
 
     def keys(self):
-        raise NotImplementedError
+        return list(self)
 
     def iterkeys(self):
-        raise NotImplementedError
+        return iter(self)
 
-    def pop(self, key):
-        raise NotImplementedError
+    def pop(self, key, *default):
+        value = self._lookup(key)
+        if value is _NO_KEY:
+            if default:
+                return default[0]
+            raise KeyError(key)
+        del self[key]
+        return value
 
     def popitem(self):
-        raise NotImplementedError
+        for key, value in self.iteritems():
+            del self[key]
+            return key, value
+        raise KeyError("popitem(): dictionary is empty")
 
     def setdefault(self, key, default=None):
-        raise NotImplementedError
+        value = self._lookup(key)
+        if value is _NO_KEY:
+            self[key] = value = default
+        return value
 
-    def update(self, **other):
-        raise NotImplementedError
+    def update(self, *other, **kwargs):
+        for items in other + (kwargs,):
+            self.set_many(items)
 
     def cas(self, key, oval, nval):
-        raise NotImplementedError
+        """Sets key to nval if its value is oval, returns a true value if it
+        was set"""
+        if self._lookup(key) != oval:
+            return 0
+        self[key] = nval
+        return 1
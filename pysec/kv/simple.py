@@ -1,14 +1,42 @@
+import os
 import struct
+from itertools import izip
+from zlib import crc32
+
+from pysec.alg import Blocks
 from pysec.core import Error
 from pysec.io import fd
-from pysec.kv import HardKV
+from pysec.kv import HardKV, ReadOnly, _items, _sync_dir
+from pysec.kv.codec import Codec
+
 
+# file header: magic, version
+MAGIC = 'PYSECSKV'
+VERSION = 1
+HEADER_FMT = '>8sI'
+HEADER_LEN = struct.calcsize(HEADER_FMT)
+_HEADER = struct.Struct(HEADER_FMT)
+# record: flag, key's length, value's length, crc32 of the other fields, key
+# and value
+RECORD_FMT = '>BIII'
+RECORD_LEN = struct.calcsize(RECORD_FMT)
+_RECORD = struct.Struct(RECORD_FMT)
+_RECORD_HEAD = struct.Struct(RECORD_FMT[:-1])
+_CRC = struct.Struct('>I')
+REC_SET = 1
+REC_DEL = 2
+MAX_DATA_SIZE = 2 ** 32 - 1
+# close() compacts the log if the dead records are more than this fraction
+# of the file
+COMPACT_RATIO = 0.5
+# size of the writes done by compact()
+WRITE_SIZE = 2 ** 16
 
+# format of the files written by the old versions: sizes and data of keys
+# and values one after the other
 SIZE_LEN = 8
 SIZE_FMT = '>Q'
-DATA_FMT = '>%ds'
-ITEM_FMT = '>Q%ds'
-MAX_DATA_SIZE = 2 ** 8 - 1
+_SIZE = struct.Struct(SIZE_FMT)
 
 
 class InvalidFormat(Error):
@@ -19,59 +47,470 @@ class UnexpectedEOF(InvalidFormat):
     pass
 
 
+def make_record(flag, key, value=''):
+    """Returns the record of the couple key, value"""
+    if len(key) > MAX_DATA_SIZE or len(value) > MAX_DATA_SIZE:
+        raise ValueError("data too long")
+    head = _RECORD_HEAD.pack(flag, len(key), len(value))
+    crc = crc32(value, crc32(key, crc32(head))) & 0xffffffff
+    return '%s%s%s%s' % (head, _CRC.pack(crc), key, value)
+
+
+def parse_record(record):
+    """Returns (flag, key, value) of a whole record, value is a buffer of
+    record so it's not copied. Raises InvalidFormat if it's corrupted"""
+    if len(record) < RECORD_LEN:
+        raise InvalidFormat("record too short")
+    flag, klen, vlen, crc = _RECORD.unpack_from(record)
+    if flag not in (REC_SET, REC_DEL) or \
+       len(record) != RECORD_LEN + klen + vlen or \
+       crc32(buffer(record, RECORD_LEN),
+             crc32(buffer(record, 0, RECORD_LEN - 4))) & 0xffffffff != crc:
+        raise InvalidFormat("corrupted record")
+    return flag, record[RECORD_LEN:RECORD_LEN+klen], \
+        buffer(record, RECORD_LEN + klen)
+
+
 class SimpleKV(HardKV):
+    """Key-value store kept in a log of records appended to the file at
+    *path*: sets and deletes append a record (a tombstone for deletes) and
+    the index in memory maps the keys to the offsets of their last records.
+    compact() rewrites the live records in a new file that atomically
+    replaces the old one. If *sync* is true every write is flushed to the
+    disk. If *bloom* is true a Bloom filter of the keys is kept and saved
+    in the file path.bloom. The values are stored encoded by *codec*, a
+    pysec.kv.codec.Codec, by default as strings.
 
-    def __init__(self, path):
-        path = str(path)
-        self.frd = fd.File.open(path, fd.FO_READ)
-        self.fwr = fd.File.open(path, fd.FO_WRITE)
-        if self.frd.inode != self.fwr.inode:
-            raise Exception('file %r changed' % path)
-        if len(self.frd):
-            self._read()
-
-    def _read(self):
-        frd = self.frd
-        frd.moveto(0)
-        items = []
-        while 1:
-            # read size
-            size = frd.read(SIZE_LEN)
-            if not size:
+    Only a process at a time can write, it holds a lock on the file
+    path.lock. If *readonly* is true the log is read without locks: the
+    records are never changed and the compacted log replaces the old one
+    with a rename, so the reads see a consistent snapshot and never wait
+    for the writer. refresh() moves the snapshot to the current state."""
+
+    def __init__(self, path, sync=0, bloom=0, codec=None, readonly=0):
+        self.path = str(path)
+        self._sync = sync
+        self.codec = Codec() if codec is None else codec
+        self.readonly = readonly
+        self._index = {}
+        # sorted list of the keys used by scan(), None if it must be rebuilt
+        self._keys = None
+        self._end = 0
+        self._garbage = 0
+        self.frd = self.fwr = self._flock = None
+        if not readonly:
+            self._flock = self.lock_writer(self._lock_path())
+        try:
+            self._open()
+            if readonly and self._end < HEADER_LEN:
+                # the writer has not written the header yet
+                self._end = HEADER_LEN
+            elif self._end:
+                self._load()
+            else:
+                self.fwr.pwrite(_HEADER.pack(MAGIC, VERSION), 0)
+                self._end = HEADER_LEN
+        except:
+            self._close_fds()
+            self._unlock()
+            raise
+        if bloom:
+            self.open_bloom(self._bloom_path(), self._end)
+
+    def _bloom_path(self):
+        return '%s.bloom' % self.path
+
+    def _lock_path(self):
+        return '%s.lock' % self.path
+
+    def _check_writable(self):
+        if self.readonly:
+            raise ReadOnly()
+
+    def _load(self):
+        magic, version = _HEADER.unpack(self.frd.pread(HEADER_LEN, 0)
+                                        .ljust(HEADER_LEN, '\0'))
+        if magic != MAGIC:
+            self._read_legacy()
+        elif version != VERSION:
+            raise InvalidFormat("unknown version: %r" % version)
+        else:
+            self._scan(HEADER_LEN)
+
+    def _open(self):
+        path = self.path
+        if self.readonly:
+            self.frd = fd.File.open(path, fd.FO_READEX)
+        else:
+            self.frd = fd.File.open(path, fd.FO_READ)
+            self.fwr = fd.File.open(path, fd.FO_WRITE)
+            if self.frd.inode != self.fwr.inode:
+                raise Exception('file %r changed' % path)
+        self._end = len(self.frd)
+
+    def _scan(self, pos):
+        """Adds to the index the records from pos reading the log
+        sequentially, a torn or corrupted tail (left by a crash) is
+        truncated. In read-only mode the scan stops before a record that
+        is being written, the next one starts from there."""
+        data = Blocks(self.frd)
+        size = len(data)
+        index = self._index
+        bloom = self.bloom
+        garbage = self._garbage
+        start = pos
+        while pos < size:
+            head = data[pos:pos+RECORD_LEN]
+            if len(head) < RECORD_LEN:
+                break
+            _, klen, vlen, _ = _RECORD.unpack(head)
+            end = pos + RECORD_LEN + klen + vlen
+            if end > size:
                 break
-            size = struct.unpack(SIZE_FMT, size)[0]
-            # read data
-            data = frd.read(size)
-            if len(data) != size:
+            try:
+                flag, key, _ = parse_record(data[pos:end])
+            except InvalidFormat:
+                break
+            old = index.pop(key, None)
+            if old is not None:
+                garbage += old[1]
+            if flag == REC_SET:
+                index[key] = pos, end - pos
+                if bloom is not None:
+                    bloom.add(key)
+            else:
+                garbage += end - pos
+            pos = end
+        if pos < size and not self.readonly:
+            self.fwr.truncate(pos)
+        if pos != start:
+            self._keys = None
+        self._end = pos
+        self._garbage = garbage
+        self.grow_bloom()
+
+    def refresh(self):
+        """Reads the records appended by the writer since the last refresh,
+        in read-only mode. If the log was replaced by a compaction the new one
+        is loaded."""
+        if not self.readonly:
+            return
+        try:
+            inode = os.stat(self.path).st_ino
+        except OSError:
+            # the store was dropped, the snapshot is still readable
+            return
+        if inode == self.frd.inode:
+            self._scan(self._end)
+            return
+        self._close_fds()
+        self._open()
+        self._index = {}
+        self._keys = None
+        self._garbage = 0
+        if self.bloom is not None:
+            self.bloom.clear()
+        if self._end >= HEADER_LEN:
+            self._load()
+        else:
+            self._end = HEADER_LEN
+
+    def _read_legacy(self):
+        """Converts a file of the old format"""
+        data = Blocks(self.frd)
+        size = len(data)
+        items = []
+        pos = 0
+        while pos < size:
+            dlen = data[pos:pos+SIZE_LEN]
+            if len(dlen) != SIZE_LEN:
                 raise UnexpectedEOF
-            data = struct.unpack(DATA_FMT % size, data)[0]
-            items.append(data)
+            dlen = _SIZE.unpack(dlen)[0]
+            pos += SIZE_LEN
+            items.append(data[pos:pos+dlen])
+            if len(items[-1]) != dlen:
+                raise UnexpectedEOF
+            pos += dlen
         if len(items) % 2 != 0:
             raise InvalidFormat
-        while items:
-            key = items.pop(0)
-            value = items.pop(0)
-            self[key] = value
-
-    def _write(self):
-        fwr = self.fwr
-        fwr.truncate(0)
-        fwr.moveto(0)
-        for key, value in self.iteritems():
-            key = str(key)
-            value = str(value)
-            key = struct.pack(ITEM_FMT % len(key), len(key), key)
-            value = struct.pack(ITEM_FMT % len(value), len(value), value)
-            item = '%s%s' % (key, value)
-            fwr.write(item)
+        self._rewrite(izip(items[::2], items[1::2]))
+
+    def _rewrite(self, items):
+        """Writes items, keys and encoded values, in a new log that replaces
+        the current one"""
+        self._check_writable()
+        tmp_path = '%s.tmp' % self.path
+        index = {}
+        pos = HEADER_LEN
+        with fd.File.open(tmp_path, fd.FO_WRITETR) as ftmp:
+            chunk = [_HEADER.pack(MAGIC, VERSION)]
+            clen = HEADER_LEN
+            for key, value in items:
+                record = make_record(REC_SET, key, value)
+                index[key] = pos, len(record)
+                pos += len(record)
+                chunk.append(record)
+                clen += len(record)
+                if clen >= WRITE_SIZE:
+                    ftmp.write(''.join(chunk))
+                    chunk = []
+                    clen = 0
+            ftmp.write(''.join(chunk))
+            os.fsync(int(ftmp))
+        os.rename(tmp_path, self.path)
+        _sync_dir(self.path)
+        self._close_fds()
+        self._open()
+        self._index = index
+        self._keys = None
+        self._end = pos
+        self._garbage = 0
+
+    def _append(self, record):
+        self._check_writable()
+        pos = self._end
+        self.fwr.pwrite(record, pos)
+        self._end = pos + len(record)
+        if self._sync:
+            os.fsync(int(self.fwr))
+        return pos
+
+    def _value(self, entry):
+        pos, size = entry
+        return self.codec.decode(parse_record(self.frd.pread(size, pos))[2])
+
+    def _records(self):
+        """Yields the keys and the encoded values in the order of the log,
+        so the file is read sequentially"""
+        data = Blocks(self.frd)
+        for key, (pos, size) in sorted(self._index.iteritems(),
+                                       key=lambda item: item[1][0]):
+            yield key, parse_record(data[pos:pos+size])[2]
+
+    def compact(self):
+        """Rewrites the live records in a new log, the old one is replaced
+        only when the new one is complete"""
+        self._rewrite(self._records())
+
+    def garbage(self):
+        """Returns the bytes of the log occupied by dead records"""
+        return self._garbage
+
+    def size(self):
+        return self._end
+
+    def sync(self):
+        """Flushes the log to the disk"""
+        if self.fwr is not None:
+            os.fsync(int(self.fwr))
+
+    def _close_fds(self):
+        for name in ('frd', 'fwr'):
+            fdesc = getattr(self, name, None)
+            if fdesc is not None:
+                fdesc.close()
+                setattr(self, name, None)
 
     def close(self):
-        self._write()
-        fd = getattr(self, 'frd')
-        if fd:
-            fd.close()
-        fd = getattr(self, 'fwr')
-        if fd:
-            fd.close()
+        if not self.readonly and self.fwr is not None:
+            if self._garbage > self._end * COMPACT_RATIO:
+                self.compact()
+            else:
+                os.fsync(int(self.fwr))
+            if self.bloom is not None:
+                self.bloom.dump(self._bloom_path(), self._end)
+        self._close_fds()
+        self._unlock()
+
+    def _unlock(self):
+        if self._flock is not None:
+            self.unlock_writer(self._flock)
+            self._flock = None
+
+    def drop(self):
+        self._check_writable()
+        self._close_fds()
+        os.unlink(self.path)
+        if os.path.exists(self._bloom_path()):
+            os.unlink(self._bloom_path())
+        os.unlink(self._lock_path())
+        self._unlock()
+
+    def __len__(self):
+        return len(self._index)
+
+    def __getitem__(self, key):
+        return self._value(self._index[str(key)])
+
+    def __setitem__(self, key, value):
+        key = str(key)
+        record = make_record(REC_SET, key, self.codec.encode(value))
+        pos = self._append(record)
+        if self.bloom is not None:
+            self.bloom.add(key)
+        old = self._index.get(key, None)
+        if old is None:
+            self._keys = None
+        else:
+            self._garbage += old[1]
+        self._index[key] = pos, len(record)
+        self.grow_bloom()
+
+    def __delitem__(self, key):
+        key = str(key)
+        old = self._index[key]
+        record = make_record(REC_DEL, key)
+        self._append(record)
+        del self._index[key]
+        self._keys = None
+        self._garbage += old[1] + len(record)
+
+    def get_many(self, keys):
+        """Returns a dictionary with the values of the keys that are
+        present, the records are read in the order of the log"""
+        index = self._index
+        entries = []
+        for key in keys:
+            key = str(key)
+            entry = index.get(key, None)
+            if entry is not None:
+                entries.append((entry, key))
+        entries.sort()
+        return dict((key, self._value(entry)) for entry, key in entries)
+
+    def set_many(self, items):
+        """Sets the couples (key, value) of items appending their records to
+        the log with a single write"""
+        records = []
+        entries = []
+        pos = self._end
+        encode = self.codec.encode
+        for key, value in _items(items):
+            key = str(key)
+            record = make_record(REC_SET, key, encode(value))
+            records.append(record)
+            entries.append((key, pos, len(record)))
+            pos += len(record)
+        if not records:
+            return
+        self._append(''.join(records))
+        index = self._index
+        bloom = self.bloom
+        for key, pos, size in entries:
+            if bloom is not None:
+                bloom.add(key)
+            old = index.get(key, None)
+            if old is None:
+                self._keys = None
+            else:
+                self._garbage += old[1]
+            index[key] = pos, size
+        self.grow_bloom()
+
+    def delete_many(self, keys):
+        """Deletes the keys that are present appending their tombstones to
+        the log with a single write, returns how many they were"""
+        self._check_writable()
+        index = self._index
+        deleted = {}
+        records = []
+        for key in keys:
+            key = str(key)
+            if key in index and key not in deleted:
+                record = make_record(REC_DEL, key)
+                records.append(record)
+                deleted[key] = len(record)
+        if not records:
+            return 0
+        # the index is changed only after the tombstones are written
+        self._append(''.join(records))
+        for key, size in deleted.iteritems():
+            self._garbage += index.pop(key)[1] + size
+        self._keys = None
+        return len(records)
+
+    def _sorted_keys(self):
+        if self._keys is None:
+            self._keys = sorted(self._index)
+        return self._keys
+
+    def __contains__(self, key):
+        return str(key) in self._index
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __str__(self):
+        return '<SimpleKV %s>' % hex(id(self))
+
+    def __repr__(self):
+        return '{%s}' % ', '.join('%r: %r' % (k, v)
+                                  for k, v in self.iteritems())
+
+    def clear(self):
+        # a new empty log, the readers keep the old one until they refresh
+        self._rewrite(())
+        if self.bloom is not None:
+            self.bloom.clear()
+
+    def copy(self):
+        return dict(self.iteritems())
+
+    @classmethod
+    def fromkeys(seq, value=None):
+        raise NotImplementedError
+
+    def get(self, key, default=None):
+        entry = self._index.get(str(key), None)
+        return default if entry is None else self._value(entry)
+
+    def has_key(self, key):
+        return key in self
+
+    def items(self):
+        return list(self.iteritems())
+
+    def iteritems(self):
+        """Yields the items in the order of the log, so the file is read
+        sequentially"""
+        decode = self.codec.decode
+        return ((key, decode(value)) for key, value in self._records())
+
+    def values(self):
+        return list(self.itervalues())
+
+    def itervalues(self):
+        return (value for _, value in self.iteritems())
+
+    def keys(self):
+        return list(self)
+
+    def iterkeys(self):
+        return iter(self)
+
+    def pop(self, key, *default):
+        key = str(key)
+        if key not in self._index:
+            if default:
+                return default[0]
+            raise KeyError(key)
+        value = self[key]
+        del self[key]
+        return value
+
+    def popitem(self):
+        if not self._index:
+            raise KeyError("popitem(): dictionary is empty")
+        key = iter(self._index).next()
+        return key, self.pop(key)
 
+    def setdefault(self, key, default=None):
+        key = str(key)
+        if key in self._index:
+            return self[key]
+        self[key] = default
+        return self[key]
 
+    def update(self, *other, **kwargs):
+        for items in other + (kwargs,):
+            self.set_many(items)
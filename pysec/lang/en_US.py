@@ -44,6 +44,7 @@ LOAD_DUP_LIB = "duplicated library: %r %d.%d.%d"
 LOAD_LIB_NOT_FOUND = "library %r not found"
 LOAD_LIB_VER_NOT_FOUND = "library %r %r not found"
 LOAD_INVALID_HASH = "module %r %r in %r don't match hash %r"
+LOAD_WRONG_CTAB_FORMAT = "wrong compiled tab format: %r"
 
 STR_WRONG_BYTE = "wrong byte value: %r"
 
@@ -44,6 +44,7 @@ LOAD_DUP_LIB = "libreria gia' presente: %r %d.%d.%d"
 LOAD_LIB_NOT_FOUND = "libreria %r non presente"
 LOAD_LIB_VER_NOT_FOUND = "libreria %r %r non presente"
 LOAD_INVALID_HASH = "modulo %r %r in %r non corrisponde all'hash %r"
+LOAD_WRONG_CTAB_FORMAT = "formato della tab compilata errato: %r"
 
 STR_WRONG_BYTE = "valore byte errato: %r"
 
@@ -27,18 +27,31 @@
 # _HASHES = {<str>: <built-in function>}
 # _OTHER_LETTERS = <str>
 # _TAB = {<str>: <dict>}
+# _CTABS = [<instance load.CompiledTab>]
+# _PROFILE = {(<str>, (*<int>)|<NoneType>): {<str>: <int>}}
+# _PROFILING = <int>
 # base64 = <module base64>
 # fd = <module pysec.io.fd>
 # hashlib = <module hashlib>
 # imp = <module imp>
+# mmap = <module mmap>
 # os = <module os>
+# struct = <module struct>
+# sys = <module sys>
+# threading = <module threading>
 import imp
 import os
 import hashlib
 import base64
+import mmap
+import struct
+import sys
+import threading
+from contextlib import contextmanager
 from types import ModuleType
 
 from pysec.core import Object
+from pysec.core.monotonic import monotonic
 from pysec.io import fd
 from pysec import log
 from pysec import lang
@@ -46,11 +59,12 @@ from pysec import lang
 
 __name__ = 'pysec.load'
 
-__all__ = 'load_tab', 'importlib', 'make_line'
+__all__ = 'load_tab', 'load_ctab', 'compile_tab', 'importlib', 'make_line', \
+          'CompiledTab', 'start_profile', 'stop_profile', 'profile_report'
 
 
 # set actions
-log.register_actions('LOAD_TAB', 'IMPORT_LIB')
+log.register_actions('LOAD_TAB', 'LOAD_CTAB', 'COMPILE_TAB', 'IMPORT_LIB')
 
 
 ASCII_LETTERS = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
@@ -70,6 +84,10 @@ _HASHES = {
 }
 
 
+_HASH_NAMES = dict((hs_func, hs_name)
+                   for hs_name, hs_func in _HASHES.iteritems())
+
+
 _FIRST_LETTERS = '_%s' % ASCII_LETTERS
 _OTHER_LETTERS = '_%s%s' % (ASCII_LETTERS, DIGITS)
 
@@ -145,75 +163,248 @@ def _hash(path, hs_obj):
             chunk = fmod.read(4096)
 
 
-def get_hash(path, hs_maker):
-    """Calculates the hash of module in path"""
+def _module_files(path):
+    """Returns the sorted list of files of module in path"""
     # path = <str>
-    # hs_maker = <function>
     # dirpath = <str>
     # filenames = [<str>]
-    # files = [<str>]
     # fname = <str>
+    # return [<str>]
+    if os.path.isfile(path):
+        return [path]
+    elif os.path.isdir(path):
+        return sorted([os.path.join(dirpath, fname)
+                      for dirpath, _, filenames in os.walk(path)
+                      for fname in filenames
+                      if os.path.isfile(os.path.join(dirpath, fname))])
+    # raise <instance ImportError>
+    raise ImportError("invalid file type %r" % path)
+
+
+def _files_hash(files, hs_maker):
+    """Calculates the hash of the list of files"""
+    # files = [<str>]
+    # hs_maker = <function>
     # fpath = <str>
     # hs_mod = <HASH object>
     # return <str>
     hs_mod = hs_maker()
-    if os.path.isfile(path):
-        files = [path]
-    elif os.path.isdir(path):
-        files = sorted([os.path.join(dirpath, fname)
-                       for dirpath, _, filenames in os.walk(path)
-                       for fname in filenames
-                       if os.path.isfile(os.path.join(dirpath, fname))])
-    else:
-        # raise <instance ImportError>
-        raise ImportError("invalid file type %r" % path)
     for fpath in files:
         _hash(fpath, hs_mod)
     return hs_mod.hexdigest()
 
 
+def get_hash(path, hs_maker):
+    """Calculates the hash of module in path"""
+    # path = <str>
+    # hs_maker = <function>
+    # return <str>
+    return _files_hash(_module_files(path), hs_maker)
+
+
+_PROFILE = {}
+_PROFILING = 0
+_PROFILE_LOCK = threading.Lock()
+
+
+def start_profile():
+    """Starts to record the time spent by load_tab, load_ctab and importlib.
+    Previous records are discarded"""
+    # return <NoneType>
+    global _PROFILING
+    with _PROFILE_LOCK:
+        _PROFILE.clear()
+    _PROFILING = 1
+
+
+def stop_profile():
+    """Stops to record the loading times, the records are kept for
+    profile_report"""
+    # return <NoneType>
+    global _PROFILING
+    _PROFILING = 0
+
+
+@contextmanager
+def _timer(name, version, stage):
+    """Adds the time spent in the with-block to *stage* of the library
+    *name* (or tab if version is None), if profiling is active"""
+    # name = <str>
+    # version = (*<int>)|<NoneType>
+    # stage = <str>
+    # start = <int>
+    if not _PROFILING:
+        yield
+        return
+    start = monotonic()
+    try:
+        yield
+    finally:
+        _record(name, version, stage, monotonic() - start)
+
+
+def _record(name, version, stage, elapsed):
+    """Adds *elapsed* nanoseconds to *stage* of the library *name* (or tab
+    if version is None)"""
+    # name = <str>
+    # version = (*<int>)|<NoneType>
+    # stage = <str>
+    # elapsed = <int>
+    # stages = {<str>: <int>}
+    # return <NoneType>
+    with _PROFILE_LOCK:
+        stages = _PROFILE.setdefault((name, version), {})
+        stages[stage] = stages.get(stage, 0) + elapsed
+
+
+def profile_report(emit=0):
+    """Returns the recorded times as a list of tuples:
+        (name, version, total, {stage: time})
+    sorted from the slowest library. Times are in nanoseconds, version is None
+    for tabs (name is the tab's path).
+    Stages are: 'parse' for the tabs, 'lookup', 'walk', 'hash_<algorithm>',
+    'find' and 'exec' for the libraries.
+    If emit is true every row is logged as a success event of LOAD_TAB or
+    IMPORT_LIB action, the log must be started."""
+    # emit = <int>
+    # name = <str>
+    # report = [<tuple>]
+    # stages = {<str>: <int>}
+    # total = <int>
+    # version = (*<int>)|<NoneType>
+    # return [<tuple>]
+    with _PROFILE_LOCK:
+        report = [(name, version, sum(stages.itervalues()), dict(stages))
+                  for (name, version), stages
+                  in _PROFILE.iteritems()]
+    report.sort(key=lambda row: row[2], reverse=True)
+    if emit:
+        for name, version, total, stages in report:
+            if version is None:
+                with log.ctx(log.actions.LOAD_TAB, {'path': name}):
+                    log.success(total=total, **stages)
+            else:
+                with log.ctx(log.actions.IMPORT_LIB,
+                             {'name': name, 'version': version}):
+                    log.success(total=total, **stages)
+    return report
+
+
 _CACHE = {}
 _TAB = {}
 
 
+class _Module(Object, ModuleType):
+    """_Module is the type of a _LazyModule after that it's loaded, it behaves
+    as a normal module"""
+    pass
+
+
 class _LazyModule(Object, ModuleType):
-    """_LazyModule is a module that instances their attribute in lazy mode"""
-    # instance.module = <NoneType>|<module>
-    # instance.name = <str>
+    """_LazyModule is a module placeholder, the library is loaded inside the
+    placeholder itself the first time that one of its attributes is used and
+    then the placeholder becomes a normal module"""
+    # instance.__lazy__ = (<str>, (*<int>), <dict>, <NoneType>|<instance load._Prefetch>)
 
-    def __init__(self, name, version):
+    def __init__(self, name, version, mod_info, prefetch=0):
+        # self = <instance load._LazyModule>
+        # name = <str>
+        # version = (*<int>)
+        # mod_info = {<str>: ?}
+        # prefetch = <int>
+        # thread = <NoneType>|<instance load._Prefetch>
+        # return <NoneType>
+        name = str(name)
+        ModuleType.__init__(self, name)
+        thread = None
+        if prefetch:
+            thread = _Prefetch(name, version, mod_info)
+            thread.start()
+        self.__dict__['__lazy__'] = name, version, mod_info, thread
+
+    def __resolve(self):
+        """Verify and load the library in this module"""
         # self = <instance load._LazyModule>
         # name = <str>
         # version = (*<int>)
+        # mod_info = {<str>: ?}
+        # thread = <NoneType>|<instance load._Prefetch>
         # return <NoneType>
-        self.name = str(name)
-        self.version = version
-        self.module = None
+        lazy = self.__dict__.get('__lazy__', None)
+        if lazy is not None and lazy[3] is not None:
+            lazy[3].join()
+        imp.acquire_lock()
+        try:
+            # another thread could have loaded it, or it's the library's code
+            # that is using its module
+            lazy = self.__dict__.pop('__lazy__', None)
+            if lazy is None:
+                return
+            name, version, mod_info, thread = lazy
+            try:
+                if thread is None:
+                    _verify(name, version, mod_info)
+                elif thread.error is not None:
+                    raise thread.error
+                _exec_module(name, version, mod_info, self)
+            except:
+                self.__dict__['__lazy__'] = name, version, mod_info, None
+                raise
+            self.__class__ = _Module
+        finally:
+            imp.release_lock()
 
     def __getattr__(self, name):
         # self = <instance load._LazyModule>
         # name = <str>
-        # return <module>
-        # raise NameError: undefined: getattr
-        return getattr(self.module or importlib(self.name, self.version), name)
+        # return ?
+        self.__resolve()
+        return ModuleType.__getattribute__(self, name)
 
     def __setattr__(self, name, value):
         # self = <instance load._LazyModule>
         # name = <str>
         # value = ?
         # return <NoneType>
-        setattr(self.module or importlib(self.name, self.version), name, value)
+        self.__resolve()
+        ModuleType.__setattr__(self, name, value)
 
     def __delattr__(self, name):
         # self = <instance load._LazyModule>
         # name = <str>
         # return <NoneType>
-        delattr(self.module or importlib(self.name, self.version), name)
+        self.__resolve()
+        ModuleType.__delattr__(self, name)
 
 
-@log.wrap(log.actions.LOAD_TAB, fields=('path',), lib=__name__)
-def load_tab(path):
-    """Updates internal tab of modules"""
+class _Prefetch(threading.Thread):
+    """Thread that verifies the hashes of a lazy module while the application
+    goes on"""
+    # instance.error = <NoneType>|<instance ImportError>
+
+    def __init__(self, name, version, mod_info):
+        # self = <instance load._Prefetch>
+        # name = <str>
+        # version = (*<int>)
+        # mod_info = {<str>: ?}
+        # return <NoneType>
+        super(_Prefetch, self).__init__(name='prefetch-%s' % name)
+        self.daemon = True
+        self.lib = name, version, mod_info
+        self.error = None
+
+    def run(self):
+        # self = <instance load._Prefetch>
+        # return <NoneType>
+        try:
+            _verify(*self.lib)
+        except Exception, ex:
+            self.error = ex
+
+
+def _parse_tab(path):
+    """Parse a text tab and returns its content as a dict:
+        {name: {version: {'path': path, 'hash': hashes}}}"""
     # path = <str>
     # _tab = {<str>: <dict>}
     # fields = <str>
@@ -224,8 +415,7 @@ def load_tab(path):
     # mod_vers = {<str>: <dict>}
     # name = <str>
     # version = <NoneType>|(*<int>)
-    # return <NoneType>
-    path = os.path.abspath(str(path))
+    # return {<str>: <dict>}
     _tab = {}
     with fd.File.open(path, fd.FO_READEX) as ftab:
         for lineno, line in enumerate(ftab.lines()):
@@ -258,13 +448,286 @@ def load_tab(path):
                 raise ImportError(lang.LOAD_DUP_LIB
                                   % (name, version[0], version[1], version[2]))
             mod_vers[version] = {'path': path, 'hash': hashes}
-    _TAB.update(_tab)
+    return _tab
+
+
+@log.wrap(log.actions.LOAD_TAB, fields=('path',), lib=__name__)
+def load_tab(path):
+    """Updates internal tab of modules"""
+    # path = <str>
+    # return <NoneType>
+    path = os.path.abspath(str(path))
+    with _timer(path, None, 'parse'):
+        _TAB.update(_parse_tab(path))
+
+
+# Compiled tab layout (big-endian):
+#   header      magic, format version, number of records
+#   index       one record for every (name, version), sorted by name and
+#               version: offset and length of the name, version's numbers,
+#               offset and length of the data
+#   data        library's path and hashes' string separated by a NUL byte
+# Names and data are addressed by absolute offsets, so the file can be
+# searched directly from a read-only mmap without parsing it.
+CTAB_MAGIC = 'PYSECTAB'
+CTAB_VERSION = 1
+_CTAB_HEADER = struct.Struct('>8sII')
+_CTAB_RECORD = struct.Struct('>IIIIIII')
+
+
+class CompiledTab(Object):
+    """Read-only view of a compiled tab. Lookups do a binary search over the
+    mmap'ed index and decode only the records of the requested library"""
+    # instance.path = <str>
+    # instance.size = <int>
+    # instance._map = <mmap>
+
+    def __init__(self, path):
+        # self = <instance load.CompiledTab>
+        # path = <str>
+        # ftab = <instance pysec.io.fd.File>
+        # magic = <str>
+        # version = <int>
+        # return <NoneType>
+        self.path = path = os.path.abspath(str(path))
+        with fd.File.open(path, fd.FO_READEX) as ftab:
+            if len(ftab) < _CTAB_HEADER.size:
+                # raise <instance ImportError>
+                raise ImportError(lang.LOAD_WRONG_CTAB_FORMAT % path)
+            self._map = mmap.mmap(int(ftab), 0, access=mmap.ACCESS_READ)
+        magic, version, size = _CTAB_HEADER.unpack_from(self._map, 0)
+        if magic != CTAB_MAGIC or version != CTAB_VERSION or \
+           len(self._map) < _CTAB_HEADER.size + size * _CTAB_RECORD.size:
+            self._map.close()
+            # raise <instance ImportError>
+            raise ImportError(lang.LOAD_WRONG_CTAB_FORMAT % path)
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+    def close(self):
+        """Release the mmap'ed file"""
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        self.close()
+        return 0
+
+    def _record(self, index):
+        """Returns the unpacked index record at position *index*"""
+        return _CTAB_RECORD.unpack_from(self._map, _CTAB_HEADER.size +
+                                        index * _CTAB_RECORD.size)
+
+    def _name(self, index):
+        """Returns the library's name of record at position *index*"""
+        noff, nlen = _CTAB_RECORD.unpack_from(self._map, _CTAB_HEADER.size +
+                                              index * _CTAB_RECORD.size)[:2]
+        return self._map[noff:noff+nlen]
+
+    def names(self):
+        """Generator of the libraries' names, in sorted order"""
+        last = None
+        for index in xrange(0, self.size):
+            name = self._name(index)
+            if name != last:
+                yield name
+                last = name
+
+    def get(self, name, default=None):
+        """Returns the versions of the library *name* in the same format of
+        the text tab: {version: {'path': path, 'hash': hashes}}"""
+        # name = <str>
+        # lo = <int>
+        # hi = <int>
+        # mid = <int>
+        # vers = {(*<int>): <dict>}
+        # return {(*<int>): <dict>}|?
+        name = str(name)
+        lo, hi = 0, self.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._name(mid) < name:
+                lo = mid + 1
+            else:
+                hi = mid
+        vers = {}
+        while lo < self.size:
+            noff, nlen, v0, v1, v2, doff, dlen = self._record(lo)
+            if self._map[noff:noff+nlen] != name:
+                break
+            path, _, hashes = self._map[doff:doff+dlen].partition('\x00')
+            hashes = parse_hashes(hashes)
+            if hashes is None:
+                # raise <instance ImportError>
+                raise ImportError(lang.LOAD_WRONG_CTAB_FORMAT % self.path)
+            vers[(v0, v1, v2)] = {'path': path, 'hash': hashes}
+            lo += 1
+        return vers or default
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+
+@log.wrap(log.actions.COMPILE_TAB, fields=('src', 'dst'), lib=__name__)
+def compile_tab(src, dst):
+    """Compile the text tab in *src* and write it in *dst*, the compiled tab
+    can be loaded by load_ctab"""
+    # src = <str>
+    # dst = <str>
+    # data = [<str>]
+    # doff = <int>
+    # ftab = <instance pysec.io.fd.File>
+    # hashes = <str>
+    # index = [<str>]
+    # name = <str>
+    # names = [<str>]
+    # noff = <int>
+    # records = [<tuple>]
+    # tmp = <str>
+    # version = (*<int>)
+    # return <NoneType>
+    src = os.path.abspath(str(src))
+    dst = os.path.abspath(str(dst))
+    _tab = _parse_tab(src)
+    records = sorted((name, version, info)
+                     for name, vers in _tab.iteritems()
+                     for version, info in vers.iteritems())
+    names = sorted(_tab)
+    # names are stored once, just after the index
+    noff = _CTAB_HEADER.size + len(records) * _CTAB_RECORD.size
+    name_offs = {}
+    for name in names:
+        name_offs[name] = noff
+        noff += len(name)
+    doff = noff
+    index = []
+    data = []
+    for name, version, info in records:
+        hashes = ' '.join('%s:%s' % (_HASH_NAMES[hs_func], hval)
+                          for hs_func, hval in info['hash'].iteritems())
+        chunk = '%s\x00%s' % (info['path'], hashes)
+        index.append(_CTAB_RECORD.pack(name_offs[name], len(name),
+                                       version[0], version[1], version[2],
+                                       doff, len(chunk)))
+        data.append(chunk)
+        doff += len(chunk)
+    tmp = '%s.tmp' % dst
+    with fd.File.open(tmp, fd.FO_WRITETR, 0644) as ftab:
+        ftab.write(''.join([_CTAB_HEADER.pack(CTAB_MAGIC, CTAB_VERSION,
+                                              len(records))] +
+                           index + names + data))
+    os.rename(tmp, dst)
+
+
+_CTABS = []
+
+
+@log.wrap(log.actions.LOAD_CTAB, fields=('path',), lib=__name__)
+def load_ctab(path):
+    """Adds a compiled tab to the tabs searched by importlib. Only the index's
+    header is read, libraries are decoded when they are imported"""
+    # path = <str>
+    # return <instance load.CompiledTab>
+    path = os.path.abspath(str(path))
+    with _timer(path, None, 'parse'):
+        ctab = CompiledTab(path)
+    _CTABS.append(ctab)
+    return ctab
+
+
+def _find_lib(name):
+    """Returns the versions of library *name* from the text tab or from the
+    compiled tabs, None if it doesn't exist"""
+    # name = <str>
+    # ctab = <instance load.CompiledTab>
+    # vers = {(*<int>): <dict>}|<NoneType>
+    # return {(*<int>): <dict>}|<NoneType>
+    vers = _TAB.get(name, None)
+    if vers is None:
+        for ctab in reversed(_CTABS):
+            vers = ctab.get(name)
+            if vers is not None:
+                _TAB[name] = vers
+                break
+    return vers
+
+
+def _verify(name, version, mod_info):
+    """Checks the hashes of library, raise an ImportError if they don't
+    match"""
+    # name = <str>
+    # version = (*<int>)
+    # mod_info = {<str>: ?}
+    # files = [<str>]
+    # hs_maker = <function>
+    # hs_val = <str>
+    # hval = <str>
+    # path = <str>
+    # return <NoneType>
+    path = mod_info['path']
+    with _timer(name, version, 'walk'):
+        files = _module_files(path)
+    for hs_maker, hval in mod_info['hash'].iteritems():
+        with _timer(name, version,
+                    'hash_%s' % _HASH_NAMES.get(hs_maker, 'unknown')):
+            hs_val = _files_hash(files, hs_maker)
+        if hs_val != hval:
+            # raise <instance ImportError>
+            raise ImportError(lang.LOAD_INVALID_HASH
+                              % (name, version, path, hval))
+
+
+def _exec_module(name, version, mod_info, module=None):
+    """Executes the library and saves it in cache. If module is not None the
+    library's code will be executed inside it.
+    It must be called with the import lock held"""
+    # name = <str>
+    # version = (*<int>)
+    # mod_info = {<str>: ?}
+    # module = <NoneType>|<module>
+    # desc = <tuple>
+    # fdir = <str>
+    # fname = <str>
+    # fobj = <file>
+    # mod = <module>
+    # old = <NoneType>|<module>
+    # path = <str>
+    # return <module>
+    fdir, fname = os.path.split(mod_info['path'])
+    with _timer(name, version, 'find'):
+        # raise <instance ImportError>
+        fobj, path, desc = imp.find_module(os.path.splitext(fname)[0],
+                                           [fdir])
+    old = sys.modules.get(name, None)
+    try:
+        if module is not None:
+            # imp.load_module reuses the module in sys.modules
+            sys.modules[name] = module
+        with _timer(name, version, 'exec'):
+            # raise <instance ImportError>
+            mod = imp.load_module(name, fobj, path, desc)
+    except:
+        if module is not None:
+            if old is None:
+                sys.modules.pop(name, None)
+            else:
+                sys.modules[name] = old
+        raise
+    finally:
+        if fobj is not None:
+            fobj.close()
+    _CACHE[(name, version)] = mod
+    return mod
 
 
 @log.wrap(log.actions.IMPORT_LIB,
-          fields=('name', 'version', 'lazy', '_reload'),
+          fields=('name', 'version', 'lazy', '_reload', 'prefetch'),
           result='module', lib=__name__)
-def importlib(name, version=None, lazy=0, _reload=0):
+def importlib(name, version=None, lazy=0, _reload=0, prefetch=0):
     """Load a library and return it.
     name        library's name
     version     if it's None it load lastest library, otherwise load the
@@ -275,24 +738,22 @@ def importlib(name, version=None, lazy=0, _reload=0):
     _reload     if false search library in cache and returns it if exists
                 otherwise it load it. If _reload is true load library anse save
                 it in cache
+    prefetch    if true and lazy is true, the library's hashes are verified
+                in a background thread
     """
     # name = <str>
     # version = <NoneType>
     # lazy = <int>
     # _reload = <int>
-    # desc = <tuple>
-    # fdir = <str>
-    # fname = <str>
-    # fobj = <file>
-    # hs_maker = <function>
-    # hval = <str>
-    # mod = <NoneType>
+    # prefetch = <int>
+    # mod = <module>
+    # start = <int>
     # mod_info = {<function>: <str>}
-    # path = <str>
     # vers = <NoneType>
-    # return <instance load._LazyModule>
+    # return <instance load._LazyModule>|<module>
     name = str(name)
-    vers = _TAB.get(name, None)
+    start = monotonic() if _PROFILING else 0
+    vers = _find_lib(name)
     if vers is None:
         # raise <instance ImportError>
         raise ImportError(lang.LOAD_LIB_NOT_FOUND % name)
@@ -301,28 +762,19 @@ def importlib(name, version=None, lazy=0, _reload=0):
     elif version not in vers:
         # raise <instance ImportError>
         raise ImportError(lang.LOAD_LIB_VER_NOT_FOUND % (name, version))
+    if start:
+        _record(name, version, 'lookup', monotonic() - start)
     if not _reload and (name, version) in _CACHE:
         return _CACHE[(name, version)]
     mod_info = vers.get(version)
+    if lazy:
+        mod = _CACHE[(name, version)] = _LazyModule(name, version, mod_info,
+                                                    prefetch)
+        return mod
     try:
         imp.acquire_lock()
-        path = mod_info['path']
-        if lazy:
-            return _LazyModule(name, path)
-        else:
-            fdir, fname = os.path.split(path)
-            for hs_maker, hval in mod_info['hash'].iteritems():
-                if get_hash(path, hs_maker) != hval:
-                    # raise <instance ImportError>
-                    raise ImportError(lang.LOAD_INVALID_HASH
-                                      % (name, version, path, hval))
-            # raise <instance ImportError>
-            fobj, path, desc = imp.find_module(os.path.splitext(fname)[0],
-                                               [fdir])
-            # raise <instance ImportError>
-            mod = imp.load_module(name, fobj, path, desc)
-            _CACHE[(name, version)] = mod
-            return mod
+        _verify(name, version, mod_info)
+        return _exec_module(name, version, mod_info)
     finally:
         imp.release_lock()
 
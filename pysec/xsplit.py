@@ -18,6 +18,7 @@
 #
 # -*- coding: ascii -*-
 """Splitters for sequence-like objects to improve memory usage and speed"""
+from pysec.alg import blocks
 
 
 def xsplit(val, sep, keep_sep=0, start=0, stop=None, find=None):
@@ -25,7 +26,9 @@ def xsplit(val, sep, keep_sep=0, start=0, stop=None, find=None):
     object), breaking at sep and using find function, to search sep, from start
     to stop indices of val.
 
-    If find is None, it use val.find function to search sep."""
+    If find is None, it use val.find function to search sep.
+    Objects without random access (pysec.io.fd.File) are read in blocks."""
+    val = blocks(val)
     return (val[a:b] for a, b
             in xbounds(val, sep, keep_sep, start, stop, find))
 
@@ -35,7 +38,10 @@ def xbounds(val, sep, keep_sep=0, start=0, stop=None, find=None):
     breaking at sep and using find function, to search sep, from start to stop
     indices of val.
 
-    If find is None, it use val.find function to search sep."""
+    If find is None, it use val.find function to search sep.
+    Objects without random access (pysec.io.fd.File) are read in blocks
+    through pysec.alg.Blocks, that is also passed to find."""
+    val = blocks(val)
     if stop is None:
         stop = len(val)
     if find is None:
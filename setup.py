@@ -44,6 +44,8 @@ exts = [
     Extension('pysec.core.fcntl', ['pysec/core/fcntl.c']),
     Extension('pysec.core.stat', ['pysec/core/stat.c']),
     Extension('pysec.core.memory', ['pysec/core/memory.c']),
+    Extension('pysec.core.match', ['pysec/core/match.c']),
+    Extension('pysec.core.histogram', ['pysec/core/histogram.c'], libraries=['m']),
     Extension('pysec.core.dirent', ['pysec/core/dirent.c']),
     Extension('pysec.core.socket', ['pysec/core/socket.c']),
     Extension('pysec.heap.fibonacci', ['pysec/heap/fibonacci.c']),
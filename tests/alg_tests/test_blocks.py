@@ -0,0 +1,95 @@
+#!/usr/bin/python -OOBtt
+"""This test searches random patterns in a file read in small blocks through
+pysec.alg.Blocks, with every search algorithm and with pysec.xsplit, and
+checks the occurrences and the number of reads from the file.
+If any errors occur the test displays a "FAILED" message"""
+import os
+import random
+import sys
+import tempfile
+
+from pysec import alg
+from pysec.core.memory import Memory
+from pysec.io import fd
+from pysec.xsplit import xbounds, xlines
+
+
+ALGORITHMS = alg.knp, alg.rk, alg.bmh, alg.two_way, alg.search
+
+
+class CountedFile(object):
+    """File that counts the reads"""
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.reads = 0
+
+    def __len__(self):
+        return len(self.fp)
+
+    def __getitem__(self, index):
+        self.reads += 1
+        return self.fp[index]
+
+
+def brute_search(text, pattern, start, stop):
+    plen = len(pattern)
+    return [i for i in xrange(start, stop - plen + 1)
+            if text[i:i+plen] == pattern]
+
+
+def main():
+    sys.stdout.write("BASIC BLOCKS TEST: ")
+    rnd = random.Random(5)
+    text = ''.join(rnd.choice('ab\n') for _ in xrange(3000))
+    fno, path = tempfile.mkstemp()
+    try:
+        os.write(fno, text)
+        os.close(fno)
+        with fd.File.open(path, fd.FO_READEX) as ftext:
+            for _ in xrange(100):
+                plen = rnd.randint(1, 10)
+                pos = rnd.randint(0, len(text) - plen)
+                pattern = text[pos:pos+plen]
+                start = rnd.randint(0, 100)
+                stop = rnd.randint(len(text) - 100, len(text))
+                expected = brute_search(text, pattern, start, stop)
+                for algorithm in ALGORITHMS:
+                    source = alg.Blocks(ftext, rnd.randint(3, 40))
+                    found = list(algorithm(source, pattern, start, stop))
+                    if found != expected:
+                        sys.stdout.write("FAILED %s(%r, %d, %d)\n" %
+                            (algorithm.__name__, pattern, start, stop))
+                        return
+            source = alg.Blocks(ftext, 16)
+            for algorithm in ALGORITHMS:
+                if list(algorithm(source, 'ab\nabc')) != []:
+                    sys.stdout.write("FAILED %s without occurrences\n" %
+                                     algorithm.__name__)
+                    return
+            lines = list(xlines(text))
+            if list(xlines(ftext)) != lines or \
+               list(xlines(ftext, find=alg.knp_first)) != lines:
+                sys.stdout.write("FAILED xlines\n")
+                return
+            counted = CountedFile(ftext)
+            list(xbounds(counted, '\n', find=alg.search_first))
+            for algorithm in ALGORITHMS:
+                list(algorithm(counted, 'ab\nab'))
+            if counted.reads > 6 * (len(text) / alg.BLOCK_SIZE + 2):
+                sys.stdout.write("FAILED with %d reads\n" % counted.reads)
+                return
+    finally:
+        os.unlink(path)
+    mem = Memory(len(text))
+    mem[0:len(text)] = text
+    if list(xlines(mem, find=alg.bmh_first)) != list(xlines(text)) or \
+       list(alg.knp(mem, 'ab\nab')) != brute_search(text, 'ab\nab', 0,
+                                                     len(text)):
+        sys.stdout.write("FAILED with Memory\n")
+        return
+    sys.stdout.write("PASSED\n")
+
+
+if __name__ == '__main__':
+    main()
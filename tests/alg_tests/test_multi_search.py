@@ -0,0 +1,71 @@
+#!/usr/bin/python -OOBtt
+"""This test searches a set of random literal patterns in random data stored
+in a string, a Memory object and a file, in blocks small enough to split the
+occurrences, and compares them with the ones found by brute force.
+If any errors occur the test displays a "FAILED" message"""
+import os
+import random
+import sys
+import tempfile
+
+from pysec import alg
+from pysec.core.memory import Memory
+from pysec.io import fd
+
+
+def brute_msearch(text, patterns, start, stop):
+    found = []
+    for pid, pattern in enumerate(patterns):
+        plen = len(pattern)
+        found.extend((pos, pid) for pos in xrange(start, stop - plen + 1)
+                     if text[pos:pos+plen] == pattern)
+    # sorted by end, then by decreasing length
+    return sorted(found, key=lambda (pos, pid): (pos + len(patterns[pid]),
+                                                 pos, pid))
+
+
+def main():
+    sys.stdout.write("BASIC MULTI PATTERN TEST: ")
+    rnd = random.Random(11)
+    text = ''.join(rnd.choice('abcd') for _ in xrange(5000))
+    patterns = set()
+    while len(patterns) < 200:
+        plen = rnd.randint(1, 9)
+        pos = rnd.randint(0, len(text) - plen)
+        patterns.add(text[pos:pos+plen] if rnd.random() < 0.8 else
+                     ''.join(rnd.choice('abcde') for _ in xrange(plen)))
+    patterns = sorted(patterns)
+    ac = alg.AhoCorasick(patterns)
+    mem = Memory(len(text))
+    mem[0:len(text)] = text
+    fno, path = tempfile.mkstemp()
+    try:
+        os.write(fno, text)
+        os.close(fno)
+        with fd.File.open(path, fd.FO_READEX) as ftext:
+            for start, stop in ((0, None), (17, 4000), (3000, 3010)):
+                expected = brute_msearch(text, patterns, start,
+                                         len(text) if stop is None else stop)
+                for source in (text, mem, ftext):
+                    for size in (7, 64, alg.BLOCK_SIZE):
+                        found = list(ac.search(source, start, stop, size))
+                        if found != expected:
+                            sys.stdout.write("FAILED with %s in blocks of "
+                                "%d\n" % (type(source).__name__, size))
+                            return
+            chunks = list(ftext.chunks(333))
+            if list(ac.search_chunks(chunks)) != \
+               brute_msearch(text, patterns, 0, len(text)):
+                sys.stdout.write("FAILED with chunks\n")
+                return
+    finally:
+        os.unlink(path)
+    if list(alg.multi_search(text, patterns, 100, 200)) != \
+       brute_msearch(text, patterns, 100, 200):
+        sys.stdout.write("FAILED multi_search\n")
+        return
+    sys.stdout.write("PASSED\n")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/python -OOBtt
+"""This test searches random patterns in random texts stored in a string, a
+list, a Memory object and a file with every search algorithm of pysec.alg and
+compares the occurrences with the ones found by brute force.
+If any errors occur the test displays a "FAILED" message"""
+import os
+import random
+import sys
+import tempfile
+
+from pysec import alg
+from pysec.core.memory import Memory
+from pysec.io import fd
+
+
+ALGORITHMS = alg.knp, alg.rk, alg.bmh, alg.two_way, alg.search
+
+
+def brute_search(text, pattern, start, stop):
+    plen = len(pattern)
+    return [i for i in xrange(start, stop - plen + 1)
+            if text[i:i+plen] == pattern]
+
+
+def main():
+    sys.stdout.write("BASIC SEARCH TEST: ")
+    rnd = random.Random(7)
+    for _ in xrange(300):
+        alphabet = 'ab' if rnd.random() < 0.5 else 'abcdefgh'
+        text = ''.join(rnd.choice(alphabet)
+                       for _ in xrange(rnd.randint(0, 300)))
+        plen = rnd.randint(1, 12)
+        if text and rnd.random() < 0.5:
+            pos = rnd.randint(0, len(text) - 1)
+            pattern = text[pos:pos+plen]
+        else:
+            pattern = ''.join(rnd.choice(alphabet) for _ in xrange(plen))
+        start = rnd.randint(0, len(text) / 4)
+        stop = rnd.randint(start, len(text))
+        expected = brute_search(text, pattern, start, stop)
+        for algorithm in ALGORITHMS:
+            found = list(algorithm(text, pattern, start, stop))
+            if found != expected:
+                sys.stdout.write("FAILED %s(%r, %r, %d, %d)\n" %
+                    (algorithm.__name__, text, pattern, start, stop))
+                return
+            found = list(algorithm(list(text), list(pattern), start, stop))
+            if algorithm is not alg.knp and found != expected:
+                sys.stdout.write("FAILED %s with a list\n" %
+                                 algorithm.__name__)
+                return
+        if list(alg.rk(text, pattern, start, stop, hash)) != expected:
+            sys.stdout.write("FAILED rk with checksum\n")
+            return
+    text = 'abc' * 1000 + 'needle' + 'abc' * 1000
+    mem = Memory(len(text))
+    mem[0:len(text)] = text
+    fno, path = tempfile.mkstemp()
+    try:
+        os.write(fno, text)
+        os.close(fno)
+        with fd.File.open(path, fd.FO_READEX) as ftext:
+            for source in (mem, ftext):
+                for algorithm in ALGORITHMS[1:]:
+                    if list(algorithm(source, 'needle', 100)) != [3000] or \
+                       list(algorithm(source, 'needle', 0, 3005)):
+                        sys.stdout.write("FAILED %s with %s\n" %
+                            (algorithm.__name__, type(source).__name__))
+                        return
+    finally:
+        os.unlink(path)
+    for first in (alg.rk_first, alg.bmh_first, alg.two_way_first,
+                  alg.search_first):
+        if first(text, 'needle') != 3000 or first(text, 'pin') != -1:
+            sys.stdout.write("FAILED %s\n" % first.__name__)
+            return
+    sys.stdout.write("PASSED\n")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+#!/usr/bin/python -OOBtt
+"""This test dumps a PatternSet, loads it again and compares the results of
+the two sets, then checks that a wrong stamp or a corrupted file are
+refused.
+If any errors occur the test displays a "FAILED" message"""
+import os
+import random
+import sys
+import tempfile
+
+from pysec import binary
+
+
+def main():
+    sys.stdout.write("BASIC DUMP SET TEST: ")
+    rnd = random.Random(3)
+    text = ''.join(rnd.choice('ab1.\x00') for _ in xrange(3000))
+    patterns = dict((''.join(rnd.choice(['a', 'b', '1', '?', '#', '\\.',
+                                         '\\x00'])
+                             for _ in xrange(rnd.randint(1, 6))), 'n%d' % i)
+                    for i in xrange(50))
+    pset = binary.PatternSet(patterns)
+    _, path = tempfile.mkstemp()
+    try:
+        pset.dump(path, 'stamp')
+        lset = binary.PatternSet.load(path, 'stamp')
+        if list(pset.search(text)) != list(lset.search(text)):
+            sys.stdout.write("FAILED searching with the loaded set\n")
+            return
+        if list(binary.byte_msearch(text, pset)) != \
+                list(binary.byte_msearch(text, lset)):
+            sys.stdout.write("FAILED byte_msearch with the loaded set\n")
+            return
+        try:
+            binary.PatternSet.load(path, 'other')
+        except ValueError:
+            pass
+        else:
+            sys.stdout.write("FAILED refusing a wrong stamp\n")
+            return
+        with open(path, 'r+b') as fpset:
+            fpset.truncate(os.path.getsize(path) - 1)
+        try:
+            binary.PatternSet.load(path)
+        except ValueError:
+            pass
+        else:
+            sys.stdout.write("FAILED refusing a truncated file\n")
+            return
+    finally:
+        os.unlink(path)
+    sys.stdout.write("PASSED\n")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/python -OOBtt
+"""This test searches random wildcard patterns with the C matcher in a string,
+in a Memory object and in a mmap, also from many threads at the same time,
+and compares the results with a brute force search.
+If any errors occur the test displays a "FAILED" message"""
+import mmap
+import os
+import random
+import sys
+import tempfile
+import threading
+
+from pysec import binary
+from pysec.core.memory import Memory
+
+from test_msearch import brute_search
+
+
+def main():
+    sys.stdout.write("BASIC MATCH TEST: ")
+    rnd = random.Random(2)
+    text = ''.join(rnd.choice('ab1.\x00\xff') for _ in xrange(5000))
+    patterns = [''.join(rnd.choice(['a', 'b', '1', '?', '#', '@', '\\.',
+                                    '\\x00', '\\xff'])
+                        for _ in xrange(rnd.randint(1, 6)))
+                for _ in xrange(40)]
+    mem = Memory(len(text))
+    mem[0:len(text)] = text
+    fd, path = tempfile.mkstemp()
+    try:
+        os.write(fd, text)
+        mtext = mmap.mmap(fd, len(text), prot=mmap.PROT_READ)
+    finally:
+        os.close(fd)
+        os.unlink(path)
+    expected = {}
+    for pattern in patterns:
+        bpat = binary.compile(pattern)
+        expected[pattern] = list(brute_search(text, bpat.tokens))
+        for data in (text, mem, mtext):
+            if bpat.findall(data) != expected[pattern]:
+                sys.stdout.write("FAILED searching %r in %s\n"
+                                 % (pattern, type(data).__name__))
+                return
+            if list(bpat.finditer(data, 7, 4000)) != \
+                    [pos for pos in expected[pattern]
+                     if pos >= 7 and pos + len(bpat) <= 4000]:
+                sys.stdout.write("FAILED iterating %r in %s\n"
+                                 % (pattern, type(data).__name__))
+                return
+    errors = []
+
+    def scan(data):
+        for pattern in patterns:
+            if binary.compile(pattern).findall(data) != expected[pattern]:
+                errors.append(pattern)
+
+    threads = [threading.Thread(target=scan, args=(data,))
+               for data in (text, mem, mtext) * 4]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    mtext.close()
+    if errors:
+        sys.stdout.write("FAILED scanning from threads %r\n" % errors)
+        return
+    sys.stdout.write("PASSED\n")
+
+
+if __name__ == '__main__':
+    main()
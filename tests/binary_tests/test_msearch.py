@@ -0,0 +1,73 @@
+#!/usr/bin/python -OOBtt
+"""This test searches random wildcard patterns in a random text with
+byte_msearch and compares the result with a brute force search, also reading
+the text from a file in small blocks, and matches them at given positions.
+If any errors occur the test displays a "FAILED" message"""
+import os
+import random
+import sys
+import tempfile
+
+from pysec import binary
+from pysec.io import fd
+
+
+def brute_search(text, tokens):
+    for pos in xrange(0, len(text) - len(tokens) + 1):
+        for i, tk in enumerate(tokens):
+            ch = text[pos + i]
+            if tk is binary.MASK_ALL_CHAR:
+                continue
+            elif isinstance(tk, str):
+                if tk != ch:
+                    break
+            elif not tk & (1 << ord(ch)):
+                break
+        else:
+            yield pos
+
+
+def main():
+    sys.stdout.write("BASIC MULTI SEARCH TEST: ")
+    rnd = random.Random(0)
+    text = ''.join(rnd.choice('ab1.') for _ in xrange(2000))
+    patterns = [''.join(rnd.choice('ab1?#@') for _ in xrange(rnd.randint(1, 5)))
+                for _ in xrange(40)]
+    patterns.append('\\x61\\x62?\\x31')
+    patterns.append('\\.')
+    pset = binary.PatternSet(patterns)
+    expected = sorted((pos, pid) for pid, tokens in enumerate(pset.tokens)
+                      for pos in brute_search(text, tokens))
+    if list(pset.search(text)) != expected:
+        sys.stdout.write("FAILED searching a string\n")
+        return
+    if any(pset.match_at(text, pos) !=
+           [pid for ppos, pid in expected if ppos == pos]
+           for pos in xrange(0, len(text) + 1)):
+        sys.stdout.write("FAILED matching at a position\n")
+        return
+    found = sorted(pos for pos, _, _ in binary.byte_msearch(text, pset))
+    if found != sorted(pos for pos, _ in expected):
+        sys.stdout.write("FAILED with byte_msearch\n")
+        return
+    _, path = tempfile.mkstemp()
+    block_size = binary.BLOCK_SIZE
+    try:
+        with open(path, 'w') as ftext:
+            ftext.write(text)
+        binary.BLOCK_SIZE = 64
+        with fd.File.open(path, fd.FO_READEX) as ftext:
+            # the occurrences across blocks are yielded in order too
+            found = list(pset.search(ftext, 10, 1990))
+    finally:
+        binary.BLOCK_SIZE = block_size
+        os.unlink(path)
+    if found != [(pos, pid) for pos, pid in expected
+                 if pos >= 10 and pos + pset.lengths[pid] <= 1990]:
+        sys.stdout.write("FAILED searching a file\n")
+        return
+    sys.stdout.write("PASSED\n")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/python -OOBtt
+"""This test searches random wildcard patterns compiled with binary.compile in
+a random text and compares the results with a brute force search, also reading
+the text from a file in small blocks, then checks the cache of compiled
+patterns.
+If any errors occur the test displays a "FAILED" message"""
+import os
+import random
+import sys
+import tempfile
+
+from pysec import binary
+from pysec.io import fd
+
+from test_msearch import brute_search
+
+
+def main():
+    sys.stdout.write("BASIC SEARCH TEST: ")
+    rnd = random.Random(1)
+    text = ''.join(rnd.choice('ab1.\x00\xff') for _ in xrange(2000))
+    patterns = [''.join(rnd.choice(['a', 'b', '1', '?', '#', '@', '\\.',
+                                    '\\x00', '\\xff'])
+                        for _ in xrange(rnd.randint(1, 5)))
+                for _ in xrange(60)]
+    _, path = tempfile.mkstemp()
+    block_size = binary.BLOCK_SIZE
+    try:
+        with open(path, 'w') as ftext:
+            ftext.write(text)
+        binary.BLOCK_SIZE = 64
+        with fd.File.open(path, fd.FO_READEX) as ftext:
+            for pattern in patterns:
+                bpat = binary.compile(pattern)
+                expected = list(brute_search(text, bpat.tokens))
+                if list(bpat.finditer(text)) != expected:
+                    sys.stdout.write("FAILED searching %r in a string\n"
+                                     % pattern)
+                    return
+                first = expected[0] if expected else -1
+                if binary.byte_search(text, pattern) != first:
+                    sys.stdout.write("FAILED byte_search of %r\n" % pattern)
+                    return
+                if list(bpat.finditer(ftext, 10, 1990)) != \
+                        [pos for pos in expected
+                         if pos >= 10 and pos + len(bpat) <= 1990]:
+                    sys.stdout.write("FAILED searching %r in a file\n"
+                                     % pattern)
+                    return
+    finally:
+        binary.BLOCK_SIZE = block_size
+        os.unlink(path)
+    bpat = binary.compile('ab?1')
+    if binary.compile('ab?1') is not bpat:
+        sys.stdout.write("FAILED caching a pattern\n")
+        return
+    for i in xrange(binary.CACHE_SIZE):
+        binary.compile('\\x%02x' % (i % 256) + '?' * (i // 256))
+    if binary.compile('ab?1') is bpat:
+        sys.stdout.write("FAILED evicting a pattern\n")
+        return
+    sys.stdout.write("PASSED\n")
+
+
+if __name__ == '__main__':
+    main()
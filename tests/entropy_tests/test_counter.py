@@ -0,0 +1,98 @@
+#!/usr/bin/python -OOBtt
+"""This test counts random data with ByteCounter, SymbolCounter and Entropy,
+also merging the counters of chunks counted by different processes or
+updated by concurrent threads, and compares the entropies with the one
+computed by the definition. Wrong data must leave the counts unchanged.
+If any errors occur the test displays a "FAILED" message"""
+import math
+from multiprocessing import Pool
+import random
+import sys
+import threading
+
+from pysec import entropy
+from pysec.core import histogram
+
+
+def def_entropy(data, base=2):
+    h = 0.
+    for sym in set(data):
+        p_i = float(data.count(sym)) / len(data)
+        h -= p_i * math.log(p_i, base)
+    return h
+
+
+def count_bytes(chunk):
+    return entropy.ByteCounter(chunk)
+
+
+def main():
+    sys.stdout.write("BASIC COUNTER TEST: ")
+    rnd = random.Random(6)
+    text = ''.join(chr(int(rnd.gauss(128, 20)) % 256) for _ in xrange(50000))
+    expected = def_entropy(text)
+    counter = entropy.ByteCounter(text[:100])
+    counter.update(ord(ch) for ch in text[100:200])
+    counter.update(text[200:])
+    if abs(counter.entropy() - expected) > 1e-9 or \
+            counter.total != len(text) or counter['a'] != text.count('a'):
+        sys.stdout.write("FAILED counting bytes\n")
+        return
+    counts = list(counter.counts)
+    for fun, args in ((counter.update, (['a', 'b', 'cd'],)),
+                      (counter.update, ((1, 2, 256),)),
+                      (histogram.slide, (counter.counts, 'ab\0' * 1000, ''))):
+        try:
+            fun(*args)
+        except ValueError:
+            pass
+        if list(counter.counts) != counts:
+            sys.stdout.write("FAILED keeping the counts after an error\n")
+            return
+    shared = entropy.ByteCounter()
+    threads = [threading.Thread(target=shared.update, args=(text,))
+               for _ in xrange(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if list(shared.counts) != [cnt * 4 for cnt in counter.counts]:
+        sys.stdout.write("FAILED counting in concurrent threads\n")
+        return
+    pool = Pool(4)
+    try:
+        counters = pool.map(count_bytes, [text[pos:pos+5000]
+                                          for pos in xrange(0, len(text),
+                                                            5000)])
+    finally:
+        pool.close()
+        pool.join()
+    merged = entropy.ByteCounter().merge(*counters)
+    if list(merged.counts) != list(counter.counts):
+        sys.stdout.write("FAILED merging byte counters\n")
+        return
+    words = [rnd.choice(('alpha', 'beta', 'gamma', 3, None))
+             for _ in xrange(1000)]
+    symbols = entropy.SymbolCounter(words[:500])
+    symbols.merge(entropy.SymbolCounter(words[500:]))
+    if abs(symbols.entropy(3) - def_entropy(words, 3)) > 1e-9 or \
+            symbols[3] != words.count(3) or symbols.total != len(words):
+        sys.stdout.write("FAILED counting symbols\n")
+        return
+    ent = entropy.Entropy(*entropy.BYTES)
+    ent.iterincrement(*text)
+    if abs(ent.entropy() - expected) > 1e-9 or \
+            abs(float(ent.clone()) - expected) > 1e-9:
+        sys.stdout.write("FAILED with Entropy\n")
+        return
+    ent = entropy.Entropy(a=1)
+    ent.update([('a', 3), ('b', 1)], c=4)
+    ent.update({'b': 2})
+    if ent.count != 9 or dict(ent) != {'a': 3, 'b': 2, 'c': 4}:
+        sys.stdout.write("FAILED updating Entropy\n")
+        return
+    sys.stdout.write("PASSED\n")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/python -OOBtt
+"""This test computes the entropy of random data stored in a string, a Memory
+object, a mmap and a file with ent_bytes and compares it with the entropy
+computed by the definition.
+If any errors occur the test displays a "FAILED" message"""
+import math
+import mmap
+import os
+import random
+import sys
+import tempfile
+
+from pysec import entropy
+from pysec.core.memory import Memory
+from pysec.io import fd
+
+
+def def_entropy(data, base):
+    h = 0.
+    for ch in set(data):
+        p_i = float(data.count(ch)) / len(data)
+        h -= p_i * math.log(p_i, base)
+    return h
+
+
+def main():
+    sys.stdout.write("BASIC ENTROPY BYTES TEST: ")
+    rnd = random.Random(4)
+    text = ''.join(chr(int(rnd.expovariate(0.05)) % 256)
+                   for _ in xrange(200000))
+    expected = def_entropy(text, 2)
+    mem = Memory(len(text))
+    mem[0:len(text)] = text
+    fno, path = tempfile.mkstemp()
+    try:
+        os.write(fno, text)
+        mtext = mmap.mmap(fno, len(text), prot=mmap.PROT_READ)
+        os.close(fno)
+        with fd.File.open(path, fd.FO_READEX) as ftext:
+            for data in (text, mem, mtext, ftext, list(text),
+                         bytearray(text)):
+                if abs(entropy.ent_bytes(data) - expected) > 1e-9:
+                    sys.stdout.write("FAILED with %s\n" % type(data).__name__)
+                    return
+        mtext.close()
+    finally:
+        os.unlink(path)
+    counts = entropy.byte_histogram(text[:1000])
+    entropy.byte_histogram(text[1000:], counts)
+    if list(counts) != [text.count(chr(ch)) for ch in xrange(256)]:
+        sys.stdout.write("FAILED updating a histogram\n")
+        return
+    if abs(entropy.hist_entropy(counts, 16) - def_entropy(text, 16)) > 1e-9:
+        sys.stdout.write("FAILED with base 16\n")
+        return
+    if entropy.ent_bytes('') != 0 or entropy.ent_bytes('a' * 10) != 0:
+        sys.stdout.write("FAILED with constant data\n")
+        return
+    sys.stdout.write("PASSED\n")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/python -OOBtt
+"""This test computes the entropy profile of random data read from a string,
+a file and a socket with ent_profile and compares it with the entropy of
+every window computed from scratch.
+If any errors occur the test displays a "FAILED" message"""
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+
+from pysec import entropy
+from pysec.io import fd
+
+
+def brute_profile(data, window, step):
+    if len(data) < window:
+        return [(0, entropy.ent_bytes(data))] if data else []
+    return [(off, entropy.ent_bytes(data[off:off+window]))
+            for off in xrange(0, len(data) - window + 1, step)]
+
+
+def same(profile, expected):
+    return len(profile) == len(expected) and \
+        all(off == eoff and abs(ent - eent) < 1e-9
+            for (off, ent), (eoff, eent) in zip(profile, expected))
+
+
+def main():
+    sys.stdout.write("BASIC ENTROPY PROFILE TEST: ")
+    rnd = random.Random(5)
+    # low entropy text with a random region in the middle
+    text = ''.join(rnd.choice('abc') for _ in xrange(30000)) + \
+        os.urandom(20000) + 'x' * 30000
+    for window, step in ((1024, None), (1000, 1), (500, 64), (100, 333),
+                         (10 ** 6, None)):
+        expected = brute_profile(text, window, window if step is None
+                                 else step)
+        if step == 1:
+            expected = expected[:3000]
+            profile = []
+            for item in entropy.ent_profile(text, window, step):
+                profile.append(item)
+                if len(profile) == len(expected):
+                    break
+        else:
+            profile = list(entropy.ent_profile(text, window, step))
+        if not same(profile, expected):
+            sys.stdout.write("FAILED with a string, window %d step %r\n"
+                             % (window, step))
+            return
+    expected = brute_profile(text, 4096, 1024)
+    _, path = tempfile.mkstemp()
+    try:
+        with open(path, 'w') as ftext:
+            ftext.write(text)
+        with fd.File.open(path, fd.FO_READEX) as ftext:
+            if not same(list(entropy.ent_profile(ftext, 4096, 1024)),
+                        expected):
+                sys.stdout.write("FAILED with a file\n")
+                return
+    finally:
+        os.unlink(path)
+    reader, writer = socket.socketpair()
+
+    def send():
+        for pos in xrange(0, len(text), 777):
+            writer.sendall(text[pos:pos+777])
+        writer.close()
+
+    sender = threading.Thread(target=send)
+    sender.start()
+    profile = list(entropy.ent_profile(reader, 4096, 1024))
+    sender.join()
+    reader.close()
+    if not same(profile, expected):
+        sys.stdout.write("FAILED with a socket\n")
+        return
+    sys.stdout.write("PASSED\n")
+
+
+if __name__ == '__main__':
+    main()
@@ -39,6 +39,10 @@ import pysec.io.temp
 # kv
 print "import pysec.kv..."
 import pysec.kv
+import pysec.kv.bloom
+import pysec.kv.cache
+import pysec.kv.codec
+import pysec.kv.hashkv
 import pysec.kv.kv
 import pysec.kv.kyoto
 import pysec.kv.rotkv
@@ -0,0 +1,301 @@
+#!/usr/bin/python -OOBtt
+"""Benchmark of the pysec.kv stores: sequential and random writes and reads,
+lookups of missing keys, bulk loads, batch reads, iteration, prefix scans,
+reopen time and size on disk. The results are printed in JSON, with
+--compare they are checked against the results of a previous run.
+
+The sizes of keys and values are distributions:
+    fixed:N         N bytes
+    uniform:A:B     from A to B bytes
+    exp:M           exponential with mean M bytes (at least 1)
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+from pysec.core.monotonic import monotonic
+from pysec.kv import HybridKV
+from pysec.kv.cache import LRUPolicy
+from pysec.kv.hashkv import HashKV
+from pysec.kv.rotkv import RotationKV
+from pysec.kv.simple import SimpleKV
+try:
+    from pysec.kv.kyoto import KyotoKV
+except ImportError:
+    KyotoKV = None
+
+
+# sizes of the stores of RotationKV
+ROTATION_SIZE = 2 ** 22
+ROTATION_FILES = 1024
+
+
+def size_dist(spec):
+    """Returns a function that takes a random.Random and returns a size
+    following the distribution *spec*"""
+    kind, _, args = spec.partition(':')
+    try:
+        args = [int(arg) for arg in args.split(':')]
+        if kind == 'fixed' and len(args) == 1:
+            return lambda rnd: args[0]
+        if kind == 'uniform' and len(args) == 2:
+            return lambda rnd: rnd.randint(args[0], args[1])
+        if kind == 'exp' and len(args) == 1:
+            return lambda rnd: max(1, int(rnd.expovariate(1. / args[0])))
+    except ValueError:
+        pass
+    raise ValueError("wrong size distribution: %r" % spec)
+
+
+def open_simple(path, opts):
+    return SimpleKV(path)
+
+
+def open_hash(path, opts):
+    return HashKV(path)
+
+
+def open_kyoto(path, opts):
+    return KyotoKV('%s.kch' % path)
+
+
+def open_hybrid(path, opts):
+    return HybridKV(dict, SimpleKV, hard_args=(path,), policy=LRUPolicy,
+                    max_entries=opts.cache)
+
+
+def open_rotation(path, opts):
+    paths = []
+    for name in os.listdir(os.path.dirname(path)):
+        num = name.rpartition('.')[2]
+        if name.startswith(os.path.basename(path) + '.') and num.isdigit():
+            paths.append((int(num), os.path.join(os.path.dirname(path),
+                                                 name)))
+    paths.sort()
+    counter = [paths[-1][0] + 1 if paths else 0]
+
+    def maker():
+        counter[0] += 1
+        return SimpleKV('%s.%d' % (path, counter[0] - 1))
+    return RotationKV(maker, ROTATION_SIZE, ROTATION_FILES,
+                      *[SimpleKV(fpath) for _, fpath in paths])
+
+
+BACKENDS = {
+    'simple': open_simple,
+    'hash': open_hash,
+    'kyoto': open_kyoto,
+    'hybrid': open_hybrid,
+    'rotation': open_rotation,
+}
+
+
+def make_data(opts):
+    """Returns the keys, the values and the missing keys, the keys start
+    with their 8 digits index so they are unique"""
+    rnd = random.Random(opts.seed)
+    key_size = size_dist(opts.key_size)
+    value_size = size_dist(opts.value_size)
+    text = ''.join(chr(rnd.randint(32, 126)) for _ in xrange(2 ** 16))
+    keys = []
+    values = []
+    for num in xrange(opts.count):
+        key = '%08d' % num
+        keys.append(key + text[:max(0, key_size(rnd) - len(key))])
+        size = min(value_size(rnd), len(text))
+        pos = rnd.randint(0, len(text) - size)
+        values.append(text[pos:pos+size])
+    missing = ['missing%08d' % num for num in xrange(opts.count)]
+    return keys, values, missing
+
+
+def access_order(count, rnd, pattern):
+    """Returns the indexes of a random access, uniform or skewed towards
+    few hot keys"""
+    if pattern == 'uniform':
+        return [rnd.randrange(count) for _ in xrange(count)]
+    return [int(rnd.expovariate(10. / count)) % count
+            for _ in xrange(count)]
+
+
+def seconds(start):
+    """Returns the seconds since start, a value of monotonic() in
+    nanoseconds"""
+    return (monotonic() - start) / 1e9
+
+
+def timed(results, name, ops, fun, *args):
+    start = monotonic()
+    fun(*args)
+    elapsed = seconds(start)
+    results[name] = {'ops': ops, 'seconds': elapsed,
+                     'ops_per_sec': ops / elapsed if elapsed else None}
+
+
+def disk_size(tmp_dir):
+    return sum(os.path.getsize(os.path.join(tmp_dir, name))
+               for name in os.listdir(tmp_dir))
+
+
+def run_backend(name, opts, data):
+    keys, values, missing = data
+    count = len(keys)
+    rnd = random.Random(opts.seed)
+    order = access_order(count, rnd, opts.pattern)
+    tmp_dir = tempfile.mkdtemp(dir=opts.dir)
+    path = os.path.join(tmp_dir, 'bench')
+    opener = BACKENDS[name]
+    results = {}
+    try:
+        kv = opener(path, opts)
+
+        def set_seq():
+            for key, value in zip(keys, values):
+                kv[key] = value
+
+        def set_rand():
+            for idx in order:
+                kv[keys[idx]] = values[idx]
+
+        def get_seq():
+            for key in keys:
+                kv[key]
+
+        def get_rand():
+            for idx in order:
+                kv[keys[idx]]
+
+        def get_missing():
+            for key in missing:
+                kv.get(key)
+
+        def get_batches():
+            for pos in xrange(0, count, opts.batch):
+                kv.get_many(keys[pos:pos+opts.batch])
+
+        def iterate():
+            for _ in kv.iteritems():
+                pass
+
+        def scan_prefixes():
+            for key in keys[::max(1, count / 100)]:
+                for _ in kv.scan(prefix=key[:6]):
+                    pass
+
+        timed(results, 'set_seq', count, set_seq)
+        timed(results, 'set_rand', count, set_rand)
+        timed(results, 'get_seq', count, get_seq)
+        timed(results, 'get_rand', count, get_rand)
+        timed(results, 'get_missing', count, get_missing)
+        timed(results, 'get_many', count, get_batches)
+        timed(results, 'iterate', count, iterate)
+        timed(results, 'scan_prefix', min(count, 100), scan_prefixes)
+        kv.close()
+        results['disk_size'] = disk_size(tmp_dir)
+        start = monotonic()
+        kv = opener(path, opts)
+        results['reopen_seconds'] = seconds(start)
+        kv.close()
+        kv = opener('%s_bulk' % path, opts)
+
+        def bulk_load():
+            for pos in xrange(0, count, opts.batch):
+                kv.set_many(zip(keys[pos:pos+opts.batch],
+                                values[pos:pos+opts.batch]))
+
+        timed(results, 'bulk_load', count, bulk_load)
+        kv.close()
+    finally:
+        shutil.rmtree(tmp_dir)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Returns the list of the operations slower than in baseline by more
+    than tolerance"""
+    slower = []
+    for backend, ops in results.iteritems():
+        for op, result in ops.iteritems():
+            old = baseline.get(backend, {}).get(op, None)
+            if isinstance(result, dict) and isinstance(old, dict) and \
+               old['seconds'] and \
+               result['seconds'] > old['seconds'] * (1 + tolerance):
+                slower.append({'backend': backend, 'op': op,
+                               'seconds': result['seconds'],
+                               'baseline': old['seconds']})
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backends', default='simple,hash,kyoto,hybrid,'
+                        'rotation', help="comma separated list of stores")
+    parser.add_argument('--count', type=int, default=20000,
+                        help="number of items")
+    parser.add_argument('--key-size', default='fixed:16',
+                        help="distribution of the sizes of the keys")
+    parser.add_argument('--value-size', default='exp:100',
+                        help="distribution of the sizes of the values")
+    parser.add_argument('--pattern', choices=('uniform', 'skewed'),
+                        default='uniform', help="random access pattern")
+    parser.add_argument('--batch', type=int, default=256,
+                        help="items of the batch operations")
+    parser.add_argument('--cache', type=int, default=4096,
+                        help="entries cached by the hybrid store")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--dir', default=None,
+                        help="directory of the temporary stores")
+    parser.add_argument('--output', default=None,
+                        help="file of the results, stdout by default")
+    parser.add_argument('--compare', default=None,
+                        help="results of a previous run, exits with 1 if "
+                        "an operation is slower")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="slowdown allowed by --compare")
+    opts = parser.parse_args()
+    backends = [name.strip() for name in opts.backends.split(',')]
+    for name in backends:
+        if name not in BACKENDS:
+            parser.error("unknown backend: %r" % name)
+    for spec in opts.key_size, opts.value_size:
+        try:
+            size_dist(spec)
+        except ValueError, ex:
+            parser.error(str(ex))
+    if KyotoKV is None and 'kyoto' in backends:
+        backends.remove('kyoto')
+    data = make_data(opts)
+    results = {}
+    for name in backends:
+        results[name] = run_backend(name, opts, data)
+    report = {
+        'config': {'count': opts.count, 'key_size': opts.key_size,
+                   'value_size': opts.value_size, 'pattern': opts.pattern,
+                   'batch': opts.batch, 'cache': opts.cache,
+                   'seed': opts.seed, 'backends': backends},
+        'results': results,
+    }
+    status = 0
+    if opts.compare is not None:
+        with open(opts.compare) as fbase:
+            slower = compare(results, json.load(fbase)['results'],
+                             opts.tolerance)
+        report['slower'] = slower
+        status = 1 if slower else 0
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if opts.output is None:
+        sys.stdout.write(text + '\n')
+    else:
+        with open(opts.output, 'w') as fout:
+            fout.write(text + '\n')
+    sys.exit(status)
+
+
+if __name__ == '__main__':
+    main()
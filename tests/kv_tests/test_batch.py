@@ -0,0 +1,112 @@
+#!/usr/bin/python -OOBtt
+"""This test uses get_many, set_many and delete_many on every file store,
+on a RotationKV and on a HybridKV, compares the results with a dictionary
+and checks that a batch of SimpleKV and HashKV is appended with a single
+write and that a failed write doesn't delete the keys.
+If any errors occur the test displays a "FAILED" message"""
+import os
+import random
+import sys
+import tempfile
+
+from pysec.kv import HybridKV
+from pysec.kv.hashkv import HashKV
+from pysec.kv.rotkv import RotationKV
+from pysec.kv.simple import SimpleKV
+
+
+class CountedSimpleKV(SimpleKV):
+    """SimpleKV that counts the appends, they fail if full is true"""
+
+    appends = 0
+    full = 0
+
+    def _append(self, record):
+        if self.full:
+            raise IOError("disk full")
+        self.appends += 1
+        return SimpleKV._append(self, record)
+
+
+class CountedHashKV(HashKV):
+    """HashKV that counts the appends"""
+
+    appends = 0
+
+    def _append(self, data):
+        self.appends += 1
+        return HashKV._append(self, data)
+
+
+def check(kv, rnd, name):
+    expected = {}
+    for _ in xrange(30):
+        items = [('key%d' % rnd.randint(0, 200), 'v' * rnd.randint(0, 30))
+                 for _ in xrange(rnd.randint(0, 20))]
+        kv.set_many(items)
+        expected.update(items)
+        keys = ['key%d' % rnd.randint(0, 250) for _ in xrange(15)]
+        found = dict((key, expected[key]) for key in keys if key in expected)
+        if kv.get_many(keys) != found:
+            sys.stdout.write("FAILED reading %s\n" % name)
+            return 0
+        keys = set('key%d' % rnd.randint(0, 250) for _ in xrange(5))
+        count = sum(1 for key in keys if expected.pop(key, None) is not None)
+        if kv.delete_many(keys) != count:
+            sys.stdout.write("FAILED deleting %s\n" % name)
+            return 0
+    if dict(kv.iteritems()) != expected:
+        sys.stdout.write("FAILED writing %s\n" % name)
+        return 0
+    return 1
+
+
+def main():
+    sys.stdout.write("BASIC BATCH KV TEST: ")
+    rnd = random.Random(21)
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        for cls in CountedSimpleKV, CountedHashKV:
+            kv = cls(os.path.join(tmp_dir, '%s.kv' % cls.__name__))
+            if not check(kv, rnd, cls.__name__):
+                return
+            appends = kv.appends
+            kv.set_many(('batch%d' % num, 'value') for num in xrange(100))
+            if kv.appends != appends + 1:
+                sys.stdout.write("FAILED appending a single batch\n")
+                return
+            if cls is CountedSimpleKV:
+                kv.full = 1
+                try:
+                    kv.delete_many(['batch1', 'batch2'])
+                except IOError:
+                    pass
+                kv.full = 0
+                if 'batch1' not in kv or len(kv.get_many(['batch2'])) != 1:
+                    sys.stdout.write("FAILED keeping the keys of a failed "
+                                     "delete\n")
+                    return
+            kv.close()
+        files = iter(xrange(1000))
+        rot = RotationKV(lambda: SimpleKV(os.path.join(tmp_dir, '%d.kv' %
+                                                        files.next())),
+                         2000, 100)
+        if not check(rot, rnd, 'RotationKV'):
+            return
+        rot.close()
+        for write_back in 0, 1:
+            path = os.path.join(tmp_dir, 'hybrid%d.kv' % write_back)
+            kv = HybridKV(dict, SimpleKV, hard_args=(path,), max_entries=20,
+                          write_back=write_back, batch_size=10)
+            if not check(kv, rnd, 'HybridKV'):
+                return
+            kv.close()
+    finally:
+        for name in os.listdir(tmp_dir):
+            os.unlink(os.path.join(tmp_dir, name))
+        os.rmdir(tmp_dir)
+    sys.stdout.write("PASSED\n")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/python -OOBtt
+"""This test checks the false positives of a BloomFilter, saves and loads it
+and uses it to skip the lookups of missing keys in HashKV and HybridKV.
+If any errors occur the test displays a "FAILED" message"""
+import os
+import sys
+import tempfile
+
+from pysec.kv import HybridKV
+from pysec.kv.bloom import BloomFilter
+from pysec.kv.hashkv import HashKV
+
+
+class CountedKV(HashKV):
+    """HashKV that counts the lookups in the index"""
+
+    lookups = 0
+
+    def _find(self, key, khash):
+        self.lookups += 1
+        return HashKV._find(self, key, khash)
+
+
+def main():
+    sys.stdout.write("BASIC BLOOM FILTER TEST: ")
+    bloom = BloomFilter(1000, 0.01)
+    bloom.update('key%d' % i for i in xrange(1000))
+    if any('key%d' % i not in bloom for i in xrange(1000)):
+        sys.stdout.write("FAILED with false negatives\n")
+        return
+    false_pos = sum(1 for i in xrange(10000) if 'miss%d' % i in bloom)
+    if false_pos > 300:
+        sys.stdout.write("FAILED with %d false positives\n" % false_pos)
+        return
+    tmp_dir = tempfile.mkdtemp()
+    path = os.path.join(tmp_dir, 'test.hkv')
+    try:
+        bloom.dump(os.path.join(tmp_dir, 'bloom'), 'stamp')
+        loaded = BloomFilter.load(os.path.join(tmp_dir, 'bloom'), 'stamp')
+        if loaded.bits[0:len(loaded.bits)] != bloom.bits[0:len(bloom.bits)] \
+           or not 900 < loaded.capacity < 1100:
+            sys.stdout.write("FAILED loading\n")
+            return
+        try:
+            BloomFilter.load(os.path.join(tmp_dir, 'bloom'), 'other')
+        except ValueError:
+            pass
+        else:
+            sys.stdout.write("FAILED checking the stamp\n")
+            return
+        os.unlink(os.path.join(tmp_dir, 'bloom'))
+        kv = CountedKV(path, bloom=1)
+        for i in xrange(500):
+            kv['key%d' % i] = 'value%d' % i
+        kv.close()
+        kv = CountedKV(path, bloom=1)
+        # the filter is built again when the keys exceed its capacity
+        kv.bloom = BloomFilter(100)
+        kv.set_many(('key%d' % i, 'value%d' % i) for i in xrange(500, 600))
+        if kv.bloom.capacity < len(kv):
+            sys.stdout.write("FAILED growing the filter\n")
+            return
+        kv.lookups = 0
+        misses = sum(1 for i in xrange(1000) if kv.get('miss%d' % i) is None)
+        if misses != 1000 or kv.lookups > 50 or kv['key7'] != 'value7':
+            sys.stdout.write("FAILED skipping %d lookups\n" % kv.lookups)
+            return
+        # a write after the filter was saved makes it stale
+        kv['new'] = 'value'
+        kv.sync()
+        for fdesc in (kv._idx_rd, kv._idx_wr, kv._dat_rd, kv._dat_wr):
+            fdesc.close()
+        # the crash releases the lock of the writer
+        kv.unlock_writer(kv._flock)
+        hybrid = HybridKV(dict, CountedKV, hard_args=(path,),
+                          hard_kwargs={'bloom': 1})
+        hybrid['soft'] = 'value'
+        if hybrid['new'] != 'value' or hybrid['soft'] != 'value' or \
+           'miss' in hybrid or hybrid.get('miss', 1) != 1:
+            sys.stdout.write("FAILED with HybridKV\n")
+            return
+        try:
+            hybrid['miss']
+        except KeyError:
+            pass
+        else:
+            sys.stdout.write("FAILED raising KeyError\n")
+            return
+        hybrid.hard.drop()
+        if os.listdir(tmp_dir):
+            sys.stdout.write("FAILED dropping %r\n" % os.listdir(tmp_dir))
+            return
+    finally:
+        for name in os.listdir(tmp_dir):
+            os.unlink(os.path.join(tmp_dir, name))
+        os.rmdir(tmp_dir)
+    sys.stdout.write("PASSED\n")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/python -OOBtt
+"""This test encodes and decodes varints, fields and compressed values,
+then stores them in SimpleKV and HashKV with a codec and reads them back
+after reopening and compacting the stores.
+If any errors occur the test displays a "FAILED" message"""
+import os
+import random
+import sys
+import tempfile
+
+from pysec.kv import codec
+from pysec.kv.hashkv import HashKV
+from pysec.kv.simple import SimpleKV
+
+
+def check_codecs(rnd):
+    for num in (0, 1, 127, 128, 300, 2 ** 32, 2 ** 64 + 5):
+        data = codec.pack_varint(num)
+        if codec.unpack_varint('x' + data, 1) != (num, len(data) + 1):
+            sys.stdout.write("FAILED varint %d\n" % num)
+            return 0
+    ints = codec.IntCodec()
+    for num in (0, -1, 1, -64, 64, -2 ** 40, 2 ** 40):
+        if ints.decode(buffer(ints.encode(num))) != num:
+            sys.stdout.write("FAILED int %d\n" % num)
+            return 0
+    if len(ints.encode(-1)) != 1:
+        sys.stdout.write("FAILED zigzag encoding\n")
+        return 0
+    fields = codec.FieldsCodec()
+    value = ('', 'a', 'x' * 200)
+    if fields.decode(fields.encode(value)) != value:
+        sys.stdout.write("FAILED fields\n")
+        return 0
+    zlib = codec.ZlibCodec(threshold=100)
+    short = 'short'
+    long_text = 'long ' * 1000
+    noise = ''.join(chr(rnd.randint(0, 255)) for _ in xrange(1000))
+    if zlib.encode(short) != codec.FLAG_RAW + short or \
+       len(zlib.encode(long_text)) >= len(long_text) or \
+       zlib.encode(noise)[:1] != codec.FLAG_RAW:
+        sys.stdout.write("FAILED compressing\n")
+        return 0
+    if any(zlib.decode(buffer(zlib.encode(data))) != data
+           for data in (short, long_text, noise)):
+        sys.stdout.write("FAILED decompressing\n")
+        return 0
+    try:
+        codec.ZlibCodec(threshold=100, max_size=100).decode(
+            zlib.encode(long_text))
+    except ValueError:
+        pass
+    else:
+        sys.stdout.write("FAILED limiting the decompressed size\n")
+        return 0
+    # a value that inflates a thousand times
+    bomb = zlib.encode('\0' * 10 ** 6)
+    try:
+        codec.ZlibCodec(max_size=10 ** 5).decode(bomb)
+    except ValueError:
+        pass
+    else:
+        sys.stdout.write("FAILED limiting a compression bomb\n")
+        return 0
+    for max_size in 0, -1:
+        try:
+            codec.ZlibCodec(max_size=max_size)
+        except ValueError:
+            pass
+        else:
+            sys.stdout.write("FAILED refusing max_size %d\n" % max_size)
+            return 0
+    return 1
+
+
+def check_store(cls, path, rnd):
+    value_codec = codec.ZlibCodec(codec.FieldsCodec(), threshold=64)
+    expected = {}
+    kv = cls(path, codec=value_codec)
+    for num in xrange(300):
+        key = 'key%d' % rnd.randint(0, 100)
+        expected[key] = kv[key] = ('%d' % num, 'field ' * rnd.randint(0, 50))
+    kv.close()
+    kv = cls(path, codec=value_codec)
+    if dict(kv.iteritems()) != expected or \
+       any(kv[key] != value for key, value in expected.iteritems()):
+        sys.stdout.write("FAILED storing with %s\n" % cls.__name__)
+        return 0
+    kv.compact()
+    if kv.get_many(expected) != expected:
+        sys.stdout.write("FAILED compacting %s\n" % cls.__name__)
+        return 0
+    if kv.size() >= sum(len(value[1]) for value in expected.itervalues()):
+        sys.stdout.write("FAILED shrinking %s\n" % cls.__name__)
+        return 0
+    kv.close()
+    return 1
+
+
+def main():
+    sys.stdout.write("BASIC CODEC KV TEST: ")
+    rnd = random.Random(31)
+    if not check_codecs(rnd):
+        return
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        for cls in SimpleKV, HashKV:
+            if not check_store(cls, os.path.join(tmp_dir, cls.__name__), rnd):
+                return
+    finally:
+        for name in os.listdir(tmp_dir):
+            os.unlink(os.path.join(tmp_dir, name))
+        os.rmdir(tmp_dir)
+    sys.stdout.write("PASSED\n")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/python -OOBtt
+"""This test writes, deletes and reads items of a HashKV growing its index,
+reopens it after an unclean close and compacts it, checking that only its
+own stale files are removed, then grows and compacts an index larger than
+the blocks written by a rebuild.
+If any errors occur the test displays a "FAILED" message"""
+import os
+import random
+import sys
+import tempfile
+
+from pysec.kv.hashkv import HashKV, MIN_CAPACITY, SLOT_LEN, WRITE_SIZE
+
+
+def check(kv, expected, msg):
+    if len(kv) != len(expected) or dict(kv.iteritems()) != expected or \
+       sorted(kv) != sorted(expected) or \
+       any(kv[key] != value for key, value in expected.iteritems()) or \
+       'missing' in kv or kv.get('missing', 1) != 1:
+        sys.stdout.write("FAILED %s\n" % msg)
+        return 0
+    return 1
+
+
+def main():
+    sys.stdout.write("BASIC HASH KV TEST: ")
+    rnd = random.Random(9)
+    tmp_dir = tempfile.mkdtemp()
+    path = os.path.join(tmp_dir, 'test.hkv')
+    try:
+        expected = {}
+        kv = HashKV(path)
+        for _ in xrange(3000):
+            key = 'key%d' % rnd.randint(0, 1000)
+            if key in expected and rnd.random() < 0.3:
+                if rnd.random() < 0.5:
+                    del kv[key]
+                    del expected[key]
+                elif kv.pop(key) != expected.pop(key):
+                    sys.stdout.write("FAILED pop\n")
+                    return
+            else:
+                kv[key] = expected[key] = 'v' * rnd.randint(0, 50)
+        if not check(kv, expected, "writing"):
+            return
+        if kv.capacity() <= MIN_CAPACITY:
+            sys.stdout.write("FAILED resizing the index\n")
+            return
+        # the file descriptors are closed without updating the header
+        kv.sync()
+        for fdesc in (kv._idx_rd, kv._idx_wr, kv._dat_rd, kv._dat_wr):
+            fdesc.close()
+        # the crash releases the lock of the writer
+        kv.unlock_writer(kv._flock)
+        kv = HashKV(path)
+        if not check(kv, expected, "reopening"):
+            return
+        size = kv.size()
+        kv.compact()
+        if not check(kv, expected, "compacting"):
+            return
+        if kv.size() >= size or sorted(os.listdir(tmp_dir)) != \
+           ['test.hkv', 'test.hkv.1', 'test.hkv.lock']:
+            sys.stdout.write("FAILED removing the dead records\n")
+            return
+        kv['new'] = expected['new'] = 'value'
+        kv['long' * 50] = expected['long' * 50] = 'value'
+        kv.close()
+        # a file of another store and a temporary index of this one
+        for name in ('test.hkv.5', 'test.hkv.tmp'):
+            with open(os.path.join(tmp_dir, name), 'w') as ftmp:
+                ftmp.write('data')
+        kv = HashKV(path)
+        if not check(kv, expected, "reopening a compacted file"):
+            return
+        if sorted(os.listdir(tmp_dir)) != \
+           ['test.hkv', 'test.hkv.1', 'test.hkv.5', 'test.hkv.lock']:
+            sys.stdout.write("FAILED removing the stale files\n")
+            return
+        kv.clear()
+        kv.close()
+        kv = HashKV(path)
+        if not check(kv, {}, "clearing"):
+            return
+        kv.drop()
+        block_slots = WRITE_SIZE / SLOT_LEN
+        kv = HashKV(path, capacity=block_slots * 2)
+        expected = dict(('key%d' % num, 'v%d' % num)
+                        for num in xrange(block_slots * 2))
+        kv.set_many(expected.iteritems())
+        kv.delete_many('key%d' % num for num in xrange(0, 1000, 3))
+        for num in xrange(0, 1000, 3):
+            del expected['key%d' % num]
+        if kv.capacity() <= block_slots * 2 or \
+           not check(kv, expected, "growing a large index"):
+            return
+        kv.compact()
+        if not check(kv, expected, "compacting a large index"):
+            return
+        kv.close()
+    finally:
+        for name in os.listdir(tmp_dir):
+            os.unlink(os.path.join(tmp_dir, name))
+        os.rmdir(tmp_dir)
+    sys.stdout.write("PASSED\n")
+
+
+if __name__ == '__main__':
+    main()
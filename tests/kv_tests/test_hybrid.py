@@ -0,0 +1,91 @@
+#!/usr/bin/python -OOBtt
+"""This test uses HybridKV as a bounded cache of a SimpleKV with every
+eviction policy, in write-through and write-back mode, and compares the
+reads with a dictionary.
+If any errors occur the test displays a "FAILED" message"""
+import os
+import random
+import sys
+import tempfile
+
+from pysec.kv import HybridKV
+from pysec.kv.cache import ARCPolicy, LFUPolicy, LRUPolicy
+from pysec.kv.simple import SimpleKV
+
+
+class CountedKV(SimpleKV):
+    """SimpleKV that counts the reads"""
+
+    reads = 0
+
+    def get(self, key, default=None):
+        self.reads += 1
+        return SimpleKV.get(self, key, default)
+
+
+def main():
+    sys.stdout.write("BASIC HYBRID KV TEST: ")
+    rnd = random.Random(13)
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        for num, policy in enumerate((LRUPolicy, LFUPolicy, ARCPolicy) * 2):
+            write_back = num >= 3
+            path = os.path.join(tmp_dir, '%d.kv' % num)
+            kv = HybridKV(dict, CountedKV, hard_args=(path,), policy=policy,
+                          max_entries=50, max_bytes=600,
+                          write_back=write_back, batch_size=10)
+            expected = {}
+            for _ in xrange(3000):
+                key = 'key%d' % int(rnd.expovariate(0.02))
+                action = rnd.random()
+                if action < 0.3:
+                    kv[key] = expected[key] = 'v' * rnd.randint(0, 20)
+                elif action < 0.35 and key in expected:
+                    del kv[key]
+                    del expected[key]
+                elif kv.get(key) != expected.get(key):
+                    sys.stdout.write("FAILED reading with %s\n" %
+                                     policy.__name__)
+                    return
+                if len(kv._sizes) > 50 or kv._bytes > 600:
+                    sys.stdout.write("FAILED evicting with %s\n" %
+                                     policy.__name__)
+                    return
+            stats = kv.stats
+            if not stats['hits'] or not stats['misses'] or \
+               not stats['evictions'] or not stats['negative_hits'] or \
+               bool(stats['flushes']) != write_back:
+                sys.stdout.write("FAILED counting %r\n" % stats)
+                return
+            kv.close()
+            hard = SimpleKV(path)
+            if dict(hard.iteritems()) != expected:
+                sys.stdout.write("FAILED writing with %s\n" %
+                                 policy.__name__)
+                return
+            hard.close()
+        kv = HybridKV(dict, CountedKV, hard_args=(path,), write_back=1)
+        kv['dirty'] = 'value'
+        if 'dirty' in kv.hard:
+            sys.stdout.write("FAILED delaying the write\n")
+            return
+        reads = kv.hard.reads
+        for _ in xrange(10):
+            kv.get('missing')
+        if kv.hard.reads != reads + 1:
+            sys.stdout.write("FAILED remembering the missing keys\n")
+            return
+        kv.refresh()
+        if kv.hard['dirty'] != 'value' or kv['dirty'] != 'value':
+            sys.stdout.write("FAILED refreshing\n")
+            return
+        kv.close()
+    finally:
+        for name in os.listdir(tmp_dir):
+            os.unlink(os.path.join(tmp_dir, name))
+        os.rmdir(tmp_dir)
+    sys.stdout.write("PASSED\n")
+
+
+if __name__ == '__main__':
+    main()
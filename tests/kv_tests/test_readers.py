@@ -0,0 +1,116 @@
+#!/usr/bin/python -OOBtt
+"""This test opens a SimpleKV for writing and read-only in other processes,
+checks that a second writer is refused, in this and in other processes,
+that the readers see a snapshot until they refresh, skip a record that is
+being written and survive a compaction.
+If any errors occur the test displays a "FAILED" message"""
+import os
+import sys
+import tempfile
+
+from pysec.kv import Locked, ReadOnly
+from pysec.kv.hashkv import HashKV
+from pysec.kv.simple import SimpleKV, REC_SET, make_record
+
+
+def in_child(fun):
+    """Runs fun in a child process, returns its result, 0 or 1"""
+    pid = os.fork()
+    if not pid:
+        try:
+            os._exit(1 if fun() else 0)
+        except BaseException:
+            os._exit(0)
+    return os.WEXITSTATUS(os.waitpid(pid, 0)[1])
+
+
+def check_locks(path):
+    def open_writer(cls):
+        try:
+            cls(path).close()
+        except Locked:
+            return 1
+        return 0
+    for cls in SimpleKV, HashKV:
+        kv = cls(path)
+        if not in_child(lambda: open_writer(cls)):
+            sys.stdout.write("FAILED locking %s\n" % cls.__name__)
+            return 0
+        # the refused writer of this process doesn't release the lock
+        if not open_writer(cls) or not in_child(lambda: open_writer(cls)):
+            sys.stdout.write("FAILED locking %s in the same process\n" %
+                             cls.__name__)
+            return 0
+        kv.drop()
+        kv = cls(path)
+        kv.drop()
+    return 1
+
+
+def check_readers(path):
+    writer = SimpleKV(path)
+    writer.set_many(('key%d' % num, 'old') for num in xrange(100))
+    reader = SimpleKV(path, readonly=1)
+    # readers in other processes don't wait for the writer
+    if not in_child(lambda: SimpleKV(path, readonly=1)['key5'] == 'old'):
+        sys.stdout.write("FAILED reading in another process\n")
+        return 0
+    try:
+        reader['new'] = 'value'
+    except ReadOnly:
+        pass
+    else:
+        sys.stdout.write("FAILED refusing a write\n")
+        return 0
+    writer['key1'] = 'new'
+    del writer['key2']
+    if reader['key1'] != 'old' or 'key2' not in reader:
+        sys.stdout.write("FAILED reading a snapshot\n")
+        return 0
+    # a record that the writer is appending
+    record = make_record(REC_SET, 'partial', 'value')
+    with open(path, 'ab') as fkv:
+        fkv.write(record[:10])
+    size = os.path.getsize(path)
+    reader.refresh()
+    if reader['key1'] != 'new' or 'key2' in reader or \
+       'partial' in reader or os.path.getsize(path) != size:
+        sys.stdout.write("FAILED refreshing\n")
+        return 0
+    with open(path, 'ab') as fkv:
+        fkv.write(record[10:])
+    reader.refresh()
+    if reader.get('partial') != 'value':
+        sys.stdout.write("FAILED reading a completed record\n")
+        return 0
+    writer.compact()
+    writer['key3'] = 'compacted'
+    if reader['key3'] != 'old' or len(reader) != 100:
+        sys.stdout.write("FAILED reading the log before compaction\n")
+        return 0
+    reader.refresh()
+    if reader['key3'] != 'compacted' or \
+       dict(reader.iteritems()) != dict(writer.iteritems()):
+        sys.stdout.write("FAILED reading the compacted log\n")
+        return 0
+    reader.close()
+    writer.drop()
+    return 1
+
+
+def main():
+    sys.stdout.write("BASIC READERS KV TEST: ")
+    tmp_dir = tempfile.mkdtemp()
+    path = os.path.join(tmp_dir, 'test.kv')
+    try:
+        if not check_locks(path) or not check_readers(path):
+            return
+    finally:
+        for name in os.listdir(tmp_dir):
+            os.unlink(os.path.join(tmp_dir, name))
+        os.rmdir(tmp_dir)
+    sys.stdout.write("PASSED\n")
+
+
+if __name__ == '__main__':
+    main()
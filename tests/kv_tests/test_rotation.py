@@ -0,0 +1,90 @@
+#!/usr/bin/python -OOBtt
+"""This test writes a RotationKV of SimpleKV files, checks that the files
+are rotated and dropped and that the reads return the newest values, then
+that the Bloom filters of the stores grow with their keys.
+If any errors occur the test displays a "FAILED" message"""
+import os
+import sys
+import tempfile
+
+from pysec.kv.rotkv import RotationKV
+from pysec.kv.simple import SimpleKV
+
+
+class Maker(object):
+    """Makes SimpleKV files in a directory"""
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+
+    def __call__(self):
+        self.count += 1
+        return SimpleKV(os.path.join(self.path, '%04d.kv' % self.count))
+
+
+class SmallFiltersKV(RotationKV):
+    """RotationKV whose Bloom filters start small"""
+
+    bloom_capacity = 16
+
+
+def main():
+    sys.stdout.write("BASIC ROTATION KV TEST: ")
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        maker = Maker(tmp_dir)
+        kv = RotationKV(maker, 1000, 3)
+        for i in xrange(300):
+            kv['key%d' % (i % 50)] = 'value%d' % i
+        files = sorted(name for name in os.listdir(tmp_dir)
+                       if name.endswith('.kv'))
+        if len(files) != 3 or files[-1] != '%04d.kv' % maker.count or \
+           maker.count < 4:
+            sys.stdout.write("FAILED rotating %r\n" % files)
+            return
+        if any(kv['key%d' % i] != 'value%d' % (250 + i) for i in xrange(50)):
+            sys.stdout.write("FAILED reading the newest values\n")
+            return
+        if len(kv) != 50 or sorted(kv.keys()) != sorted(dict(kv.items())):
+            sys.stdout.write("FAILED counting the keys\n")
+            return
+        del kv['key1']
+        if 'key1' in kv or kv.get('key1') is not None or \
+           kv.pop('missing', 1) != 1:
+            sys.stdout.write("FAILED deleting\n")
+            return
+        kv.close()
+        if any(name.endswith('.bloom') for name in os.listdir(tmp_dir)):
+            sys.stdout.write("FAILED saving filters of stores without one\n")
+            return
+        kvs = [SimpleKV(os.path.join(tmp_dir, name))
+               for name in sorted(os.listdir(tmp_dir))
+               if name.endswith('.kv')]
+        kv = RotationKV(maker, 1000, 3, *kvs)
+        if len(kv) != 49 or kv['key2'] != 'value252':
+            sys.stdout.write("FAILED reopening\n")
+            return
+        kv.drop()
+        if os.listdir(tmp_dir):
+            sys.stdout.write("FAILED dropping\n")
+            return
+        kv = SmallFiltersKV(maker, 2 ** 30, 3)
+        kv.set_many(('key%d' % i, 'value') for i in xrange(500))
+        for i in xrange(500, 1000):
+            kv['key%d' % i] = 'value'
+        bloom = kv._blooms[-1]
+        if bloom.capacity < 1000 or \
+           sum(1 for i in xrange(1000) if 'miss%d' % i in bloom) > 50:
+            sys.stdout.write("FAILED growing the filters\n")
+            return
+        kv.drop()
+    finally:
+        for name in os.listdir(tmp_dir):
+            os.unlink(os.path.join(tmp_dir, name))
+        os.rmdir(tmp_dir)
+    sys.stdout.write("PASSED\n")
+
+
+if __name__ == '__main__':
+    main()
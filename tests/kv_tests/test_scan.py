@@ -0,0 +1,91 @@
+#!/usr/bin/python -OOBtt
+"""This test scans ranges and prefixes of SimpleKV, HashKV, RotationKV and
+HybridKV, forwards and backwards and with a limit, and compares the items
+with the ones of a sorted dictionary.
+If any errors occur the test displays a "FAILED" message"""
+import os
+import random
+import sys
+import tempfile
+
+from pysec.kv import HybridKV
+from pysec.kv.hashkv import HashKV
+from pysec.kv.rotkv import RotationKV
+from pysec.kv.simple import SimpleKV
+
+
+def expected_scan(expected, start, stop, prefix, limit, reverse):
+    items = sorted((key, value) for key, value in expected.iteritems()
+                   if (start is None or key >= start) and
+                   (stop is None or key < stop) and
+                   (prefix is None or key.startswith(prefix)))
+    if reverse:
+        items.reverse()
+    return items if limit is None else items[:limit]
+
+
+def random_key(rnd):
+    return ''.join(rnd.choice('ab\xff') for _ in xrange(rnd.randint(0, 4)))
+
+
+def check(kv, rnd, name):
+    expected = {}
+    for _ in xrange(300):
+        key = random_key(rnd)
+        if key in expected and rnd.random() < 0.2:
+            del kv[key]
+            del expected[key]
+        else:
+            kv[key] = expected[key] = 'v' * rnd.randint(0, 10)
+        start = random_key(rnd) if rnd.random() < 0.5 else None
+        stop = random_key(rnd) if rnd.random() < 0.5 else None
+        prefix = random_key(rnd)[:2] if rnd.random() < 0.5 else None
+        limit = rnd.randint(0, 10) if rnd.random() < 0.5 else None
+        reverse = rnd.random() < 0.5
+        if list(kv.scan(start, stop, prefix, limit, reverse)) != \
+           expected_scan(expected, start, stop, prefix, limit, reverse):
+            sys.stdout.write("FAILED scanning %s with %r\n" %
+                             (name, (start, stop, prefix, limit, reverse)))
+            return 0
+    # a scan stopped early doesn't see the later changes
+    scan = kv.scan()
+    scan.next()
+    kv['\xff\xff\xff\xff\xff'] = 'last'
+    if list(scan)[-1][0] == '\xff\xff\xff\xff\xff':
+        sys.stdout.write("FAILED isolating the scan of %s\n" % name)
+        return 0
+    return 1
+
+
+def main():
+    sys.stdout.write("BASIC SCAN KV TEST: ")
+    rnd = random.Random(29)
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        for cls in SimpleKV, HashKV:
+            kv = cls(os.path.join(tmp_dir, '%s.kv' % cls.__name__))
+            if not check(kv, rnd, cls.__name__):
+                return
+            kv.close()
+        files = iter(xrange(1000))
+        rot = RotationKV(lambda: SimpleKV(os.path.join(tmp_dir, '%d.kv' %
+                                                        files.next())),
+                         500, 100)
+        if not check(rot, rnd, 'RotationKV'):
+            return
+        rot.close()
+        kv = HybridKV(dict, SimpleKV,
+                      hard_args=(os.path.join(tmp_dir, 'hybrid.kv'),),
+                      max_entries=20, write_back=1)
+        if not check(kv, rnd, 'HybridKV'):
+            return
+        kv.close()
+    finally:
+        for name in os.listdir(tmp_dir):
+            os.unlink(os.path.join(tmp_dir, name))
+        os.rmdir(tmp_dir)
+    sys.stdout.write("PASSED\n")
+
+
+if __name__ == '__main__':
+    main()
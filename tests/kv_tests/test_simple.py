@@ -0,0 +1,85 @@
+#!/usr/bin/python -OOBtt
+"""This test writes, deletes and reads items of a SimpleKV, reopens it after
+a torn write, compacts it and converts a file of the old format.
+If any errors occur the test displays a "FAILED" message"""
+import os
+import random
+import struct
+import sys
+import tempfile
+
+from pysec.kv import simple
+
+
+def check(kv, expected, msg):
+    if len(kv) != len(expected) or dict(kv.iteritems()) != expected or \
+       any(kv[key] != value for key, value in expected.iteritems()):
+        sys.stdout.write("FAILED %s\n" % msg)
+        return 0
+    return 1
+
+
+def main():
+    sys.stdout.write("BASIC SIMPLE KV TEST: ")
+    rnd = random.Random(3)
+    tmp_dir = tempfile.mkdtemp()
+    path = os.path.join(tmp_dir, 'test.kv')
+    try:
+        expected = {}
+        kv = simple.SimpleKV(path)
+        for _ in xrange(2000):
+            key = 'key%d' % rnd.randint(0, 300)
+            if key in expected and rnd.random() < 0.3:
+                del kv[key]
+                del expected[key]
+            else:
+                kv[key] = expected[key] = 'v' * rnd.randint(0, 50)
+        if not check(kv, expected, "writing"):
+            return
+        kv.close()
+        size = os.path.getsize(path)
+        # a torn record at the end of the log
+        with open(path, 'ab') as fkv:
+            fkv.write(simple.make_record(simple.REC_SET, 'torn',
+                                         'x' * 100)[:50])
+        kv = simple.SimpleKV(path)
+        if not check(kv, expected, "reopening") or \
+           os.path.getsize(path) != size or 'torn' in kv:
+            sys.stdout.write("FAILED truncating a torn record\n")
+            return
+        garbage = kv.garbage()
+        kv.compact()
+        if not check(kv, expected, "compacting"):
+            return
+        if kv.garbage() or os.path.getsize(path) != size - garbage or \
+           os.path.exists(path + '.tmp'):
+            sys.stdout.write("FAILED removing the dead records\n")
+            return
+        kv['new'] = expected['new'] = 'value'
+        kv.close()
+        kv = simple.SimpleKV(path)
+        if not check(kv, expected, "reopening a compacted file"):
+            return
+        kv.clear()
+        kv.close()
+        kv = simple.SimpleKV(path)
+        if not check(kv, {}, "clearing"):
+            return
+        kv.close()
+        with open(path, 'wb') as fkv:
+            for key, value in expected.iteritems():
+                for data in (key, value):
+                    fkv.write(struct.pack(simple.SIZE_FMT, len(data)) + data)
+        kv = simple.SimpleKV(path)
+        if not check(kv, expected, "converting"):
+            return
+        kv.close()
+    finally:
+        for name in os.listdir(tmp_dir):
+            os.unlink(os.path.join(tmp_dir, name))
+        os.rmdir(tmp_dir)
+    sys.stdout.write("PASSED\n")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+#!/usr/bin/python -OOBtt
+"""This test creates a text tab with two versions of a module, compiles it and
+checks that the compiled tab returns the same libraries of the text tab.
+If any errors occur the test displays a "FAILED" message"""
+import os
+import shutil
+import sys
+import tempfile
+
+from pysec import load
+
+
+MODULE = "VALUE = %d\n"
+
+
+def main():
+    sys.stdout.write("BASIC COMPILED TAB TEST: ")
+    tmpdir = tempfile.mkdtemp()
+    try:
+        lines = []
+        for minor in (1, 2):
+            path = os.path.join(tmpdir, 'ctab_mod_%d.py' % minor)
+            with open(path, 'w') as fmod:
+                fmod.write(MODULE % minor)
+            lines.append(load.make_line(path, 'ctab_mod', (1, minor, 0)))
+        txt_path = os.path.join(tmpdir, 'tab.txt')
+        with open(txt_path, 'w') as ftab:
+            ftab.write('\n'.join(lines))
+        ctab_path = os.path.join(tmpdir, 'tab.ctab')
+        load.compile_tab(txt_path, ctab_path)
+        ctab = load.load_ctab(ctab_path)
+        if ctab.get('ctab_mod') != load._parse_tab(txt_path)['ctab_mod']:
+            sys.stdout.write("FAILED comparing text and compiled tabs\n")
+            return
+        if ctab.get('not_there') is not None or 'ctab_mo' in ctab:
+            sys.stdout.write("FAILED looking up missing library\n")
+            return
+        mod = load.importlib('ctab_mod')
+        if mod.VALUE != 2:
+            sys.stdout.write("FAILED importing latest version\n")
+            return
+        ctab.close()
+    finally:
+        shutil.rmtree(tmpdir)
+    sys.stdout.write("PASSED\n")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/python -OOBtt
+"""This test loads a module in lazy mode, with and without background
+prefetch, and checks that it's loaded once and then used as a normal module.
+If any errors occur the test displays a "FAILED" message"""
+import os
+import shutil
+import sys
+import tempfile
+
+from pysec import load
+
+
+MODULE = "VALUE = %d\n"
+
+
+def make_lib(tmpdir, name, value):
+    path = os.path.join(tmpdir, '%s.py' % name)
+    with open(path, 'w') as fmod:
+        fmod.write(MODULE % value)
+    return load.make_line(path, name, (0, 0, 1))
+
+
+def main():
+    sys.stdout.write("BASIC LAZY LOAD TEST: ")
+    tmpdir = tempfile.mkdtemp()
+    try:
+        lines = [make_lib(tmpdir, 'lazy_mod', 1),
+                 make_lib(tmpdir, 'prefetch_mod', 2),
+                 make_lib(tmpdir, 'broken_mod', 3)]
+        # change module after the creation of the tab
+        with open(os.path.join(tmpdir, 'broken_mod.py'), 'a') as fmod:
+            fmod.write(MODULE % 4)
+        tab_path = os.path.join(tmpdir, 'tab.txt')
+        with open(tab_path, 'w') as ftab:
+            ftab.write('\n'.join(lines))
+        load.load_tab(tab_path)
+        mod = load.importlib('lazy_mod', lazy=1)
+        if not isinstance(mod, load._LazyModule):
+            sys.stdout.write("FAILED creating lazy module\n")
+            return
+        if mod.VALUE != 1 or isinstance(mod, load._LazyModule):
+            sys.stdout.write("FAILED resolving lazy module\n")
+            return
+        if load.importlib('lazy_mod') is not mod:
+            sys.stdout.write("FAILED caching lazy module\n")
+            return
+        mod = load.importlib('prefetch_mod', lazy=1, prefetch=1)
+        if mod.VALUE != 2:
+            sys.stdout.write("FAILED resolving prefetched module\n")
+            return
+        mod = load.importlib('broken_mod', lazy=1, prefetch=1)
+        try:
+            mod.VALUE
+        except ImportError:
+            pass
+        else:
+            sys.stdout.write("FAILED verifying prefetched module\n")
+            return
+    finally:
+        shutil.rmtree(tmpdir)
+    sys.stdout.write("PASSED\n")
+
+
+if __name__ == '__main__':
+    main()
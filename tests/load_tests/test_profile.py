@@ -0,0 +1,64 @@
+#!/usr/bin/python -OOBtt
+"""This test profiles the loading of a tab and of a library and checks that
+all the stages are recorded and emitted in the log.
+If any errors occur the test displays a "FAILED" message"""
+import os
+import shutil
+import sys
+import tempfile
+
+from pysec import load
+from pysec import log
+
+
+STAGES = set(['lookup', 'walk', 'hash_md5', 'hash_sha1', 'hash_sha256',
+              'hash_sha512', 'find', 'exec'])
+
+
+def main():
+    sys.stdout.write("BASIC LOAD PROFILE TEST: ")
+    log.start_log(log.register_action('LOAD_PROFILE_TEST'))
+    events = []
+    log.add_global_emit(lambda event, time, actions, errcode, fields, info,
+                        lib: events.append((actions[0], info)))
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, 'profiled_mod.py')
+        with open(path, 'w') as fmod:
+            fmod.write("VALUE = 1\n")
+        tab_path = os.path.join(tmpdir, 'tab.txt')
+        with open(tab_path, 'w') as ftab:
+            ftab.write(load.make_line(path, 'profiled_mod', (1, 0, 0)))
+        load.start_profile()
+        load.load_tab(tab_path)
+        load.importlib('profiled_mod')
+        load.stop_profile()
+        report = load.profile_report()
+        if len(report) != 2:
+            sys.stdout.write("FAILED with %d rows\n" % len(report))
+            return
+        rows = dict(((name, version), stages)
+                    for name, version, _, stages in report)
+        if rows.get((tab_path, None), {}).keys() != ['parse']:
+            sys.stdout.write("FAILED profiling tab\n")
+            return
+        if set(rows.get(('profiled_mod', (1, 0, 0)), {})) != STAGES:
+            sys.stdout.write("FAILED profiling library\n")
+            return
+        if [total for _, _, total, _ in report] != \
+           sorted([total for _, _, total, _ in report], reverse=True):
+            sys.stdout.write("FAILED sorting report\n")
+            return
+        del events[:]
+        load.profile_report(emit=1)
+        if set(info.get('total') for act, info in events
+               if info) != set(total for _, _, total, _ in report):
+            sys.stdout.write("FAILED emitting report\n")
+            return
+    finally:
+        shutil.rmtree(tmpdir)
+    sys.stdout.write("PASSED\n")
+
+
+if __name__ == '__main__':
+    main()
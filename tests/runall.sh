@@ -22,3 +22,16 @@ echo
 python -B ./log_test.py
 echo
 ./io_tests/test_runall.sh
+echo
+./load_tests/test_runall.sh
+echo
+./binary_tests/test_runall.sh
+
+echo
+./entropy_tests/test_runall.sh
+
+echo
+./alg_tests/test_runall.sh
+
+echo
+./kv_tests/test_runall.sh
\ No newline at end of file
@@ -1,16 +1,25 @@
 #!/usr/bin/python2.7 -OOBtt
 __doc__ = """Search malicious string in PE files.
 
-Usage: pescan.py [--db=<DB>] [--log=<LOG>] <PATH>...
+Usage: pescan.py [--db=<DB>] [--log=<LOG>] [--jobs=<N>] <PATH>...
 
 Options:
     --db=<DB>     database file with malicous strings [default: ./sign-db.txt]
     --log=<LOG>   log type: human (default), pipe
+    --jobs=<N>    number of processes scanning the files [default: 1]
+
+The database is compiled in <DB>.cdb and it's compiled again only when <DB>
+changes.
 
 """
 from docopt import docopt
 
 import glob
+import hashlib
+# the modules used by the pool are imported before pysec.init clears sys.path
+import multiprocessing.connection
+import multiprocessing.forking
+from multiprocessing.pool import Pool
 import os
 import struct
 import sys
@@ -28,6 +37,8 @@ MAX_LINE = 4096
 
 # register actions
 ACT_LOADDB = log.register_action('LOAD_DB')
+ACT_PARSEDB = log.register_action('PARSE_DB')
+ACT_COMPILEDB = log.register_action('COMPILE_DB')
 ACT_SCANFILE = log.register_action('SCAN_FILE')
 ACT_CALCOFFSET = log.register_action('CALCULATE_OFFSET')
 ACT_SEARCHSIGNS = log.register_action('SEARCH_SIGNATURES')
@@ -37,23 +48,55 @@ ACT_SEARCHSIGNS = log.register_action('SEARCH_SIGNATURES')
 ERR_WRONGFMT = log.register_error('WRONG_FILE_FORMAT')
 ERR_NOTFOUND = log.register_error('SIGNATURE_NOT_FOUND')
 ERR_LINETOOBIG = log.register_error('LINE_TOO_LONG')
+ERR_WRITECDB = log.register_error('CANNOT_WRITE_COMPILED_DB')
 
 
 DOS_HEADER = '<HHHHHHHHHHHHHH8sHH20sI'
-FILE_HEADER_SIZE = struct.calcsize('<HHIIIHH')
-OPT_HEADER = '<HBBIIIIIIIIIHHHHHHIIIIHHIIIIII'
-              
+FILE_HEADER = '<HHIIIHH'
+FILE_HEADER_SIZE = struct.calcsize(FILE_HEADER)
+SECTION_HEADER = '<8sIIIIIIHHI'
+SECTION_HEADER_SIZE = struct.calcsize(SECTION_HEADER)
+# offset of AddressOfEntryPoint in the optional header (PE32 and PE32+)
+OPT_ENTRY_POINT = 16
+MAX_SECTIONS = 96
+
+SCN_CNT_CODE = 0x00000020
+SCN_MEM_EXECUTE = 0x20000000
+
 
-def get_offset(data):
-    if len(data) < 64:
+def parse_pe(data):
+    """Returns the tuple (entry_point, sections) of the PE in data, None if
+    data is not a PE. entry_point is the file offset of the entry point (None
+    if it isn't in the file) and sections is a list of tuples
+    (name, file_offset, size, characteristics)"""
+    if len(data) < 64 or data[:2] != 'MZ':
         return None
-    dos_hdr = data[:64]
-    nt_hdr_offset = struct.unpack(DOS_HEADER, dos_hdr)[18]
-    offset = nt_hdr_offset + 4 + FILE_HEADER_SIZE
-    if len(data) < offset + 96:
+    nt_hdr_offset = struct.unpack(DOS_HEADER, data[:64])[18]
+    offset = nt_hdr_offset + 4
+    if data[nt_hdr_offset:offset] != 'PE\x00\x00' or \
+       len(data) < offset + FILE_HEADER_SIZE:
         return None
-    code_offset = struct.unpack(OPT_HEADER, data[offset:offset+96])[6]
-    return None if code_offset < offset + 96 else code_offset
+    _, nsections, _, _, _, opt_size, _ = \
+        struct.unpack(FILE_HEADER, data[offset:offset+FILE_HEADER_SIZE])
+    offset += FILE_HEADER_SIZE
+    if opt_size < OPT_ENTRY_POINT + 4 or nsections > MAX_SECTIONS or \
+       len(data) < offset + opt_size + nsections * SECTION_HEADER_SIZE:
+        return None
+    ep_rva = struct.unpack('<I', data[offset+OPT_ENTRY_POINT:
+                                      offset+OPT_ENTRY_POINT+4])[0]
+    offset += opt_size
+    table = data[offset:offset+nsections*SECTION_HEADER_SIZE]
+    entry_point = None
+    sections = []
+    for n in xrange(0, nsections):
+        name, vsize, rva, raw_size, raw_offset, _, _, _, _, chars = \
+            struct.unpack_from(SECTION_HEADER, table, n * SECTION_HEADER_SIZE)
+        size = min(vsize, raw_size) if vsize else raw_size
+        size = max(0, min(size, len(data) - raw_offset))
+        sections.append((name.rstrip('\x00'), raw_offset, size, chars))
+        if ep_rva and rva <= ep_rva < rva + size:
+            entry_point = raw_offset + ep_rva - rva
+    return entry_point, sections
 
 
 ST_NAME = 1
@@ -72,8 +115,11 @@ def sign2bmask(sign):
     return ''.join(mask)
 
 
-@log.wrap(ACT_LOADDB, ('db_path',))
+@log.wrap(ACT_PARSEDB, ('db_path',))
 def load_db(db_path):
+    """Returns the tuple (ep_db, db) of the signatures that must be tested
+    only at the entry point and of the other ones"""
+    ep_db = {}
     db = {}
     with fd.File.open(db_path, fd.FO_READEX) as fp:
         state = ST_NAME
@@ -81,7 +127,7 @@ def load_db(db_path):
         signature = None
         for start, stop in fp.xlines():
             if stop - start >= MAX_LINE:
-                log.error(ERR_LINETOOBIG, start=start, end=end)
+                log.error(ERR_LINETOOBIG, start=start, end=stop)
                 continue
             line = fp[start:stop].strip()
             if not line or line[:1] == ';':
@@ -93,11 +139,47 @@ def load_db(db_path):
                 signature = sign2bmask(line.partition('=')[2].strip())
                 state = ST_EPONLY
             elif state == ST_EPONLY:
-                db[signature] = name
+                ep_only = line.partition('=')[2].strip().lower() == 'true'
+                (ep_db if ep_only else db)[signature] = name
                 state = ST_NAME
             else:
                 raise Exception
-    return db
+    return ep_db, db
+
+
+def cdb_paths(db_path):
+    """Returns the paths of the compiled databases of db_path, the first one
+    for the entry point signatures"""
+    return '%s.ep.cdb' % db_path, '%s.cdb' % db_path
+
+
+def db_stamp(db_path):
+    """Returns the stamp of the database in db_path that is stored in its
+    compiled databases"""
+    with fd.File.open(db_path, fd.FO_READEX) as fp:
+        return hashlib.sha1(fp[0:len(fp)]).digest()
+
+
+@log.wrap(ACT_LOADDB, ('db_path',))
+def load_cdb(db_path, stamp):
+    """Returns the compiled databases (ep_db, db) of db_path and whether
+    their files match stamp, they are compiled again if the database was
+    changed"""
+    paths = cdb_paths(db_path)
+    try:
+        return tuple(binary.PatternSet.load(path, stamp)
+                     for path in paths), 1
+    except (ValueError, OSError, IOError):
+        pass
+    dbs = tuple(binary.PatternSet(db) for db in load_db(db_path))
+    with log.ctx(ACT_COMPILEDB, {'cdb_path': paths[1]}):
+        try:
+            for db, path in zip(dbs, paths):
+                db.dump(path, stamp)
+        except (OSError, IOError) as ex:
+            log.error(ERR_WRITECDB, error=str(ex))
+            return dbs, 0
+    return dbs, 1
 
 
 def emit_human(event, time, actions, errcode, fields, info, lib):
@@ -142,7 +224,79 @@ def emit_pipe(event, time, actions, errcode, fields, info, lib):
     sys.stdout.flush()
 
 
+def iter_paths(paths):
+    """Yields the absolute paths of the regular files matching *paths*"""
+    for path in paths:
+        path = os.path.abspath(path)
+        for path in glob.iglob(path):
+            if os.path.isfile(path):
+                yield path
+
+
+# signature database of the scanning processes, the workers of --jobs are
+# forked before pysec.init and they mmap the compiled database of _DB_PATH,
+# it must match _DB_STAMP
+_DB = None
+_DB_PATH = None
+_DB_STAMP = None
+
+
+def _init_worker(stamp):
+    """Hardens a scanning process as pysec.init does"""
+    global _DB_STAMP
+    _DB_STAMP = stamp
+    sys.path = []
+    pysec.set_builtins()
+
+
+def scan_file(path):
+    """Scans the file in *path* with the signature databases and returns the
+    tuple (path, size, offset, found): offset is the entry point (None if the
+    file is not a PE) and found is a sorted list of (position, name) of the
+    signatures. The entry point signatures are tested only at the entry
+    point, the other ones only in the executable sections"""
+    global _DB
+    if _DB is None:
+        _DB = tuple(binary.PatternSet.load(cdb_path, _DB_STAMP)
+                    for cdb_path in cdb_paths(_DB_PATH))
+    ep_db, db = _DB
+    with fd.File.open(path, fd.FO_READEX) as fp:
+        pe = parse_pe(fp)
+        if pe is None:
+            return path, len(fp), None, ()
+        entry_point, sections = pe
+        found = []
+        if entry_point is not None and len(ep_db):
+            found.extend((entry_point, ep_db.names[pid])
+                         for pid in ep_db.match_at(fp, entry_point))
+        if len(db):
+            for _, start, size, chars in sections:
+                if chars & (SCN_CNT_CODE | SCN_MEM_EXECUTE):
+                    found.extend((pos, db.names[pid])
+                                 for pos, pid in db.search(fp, start,
+                                                           start + size))
+        found.sort()
+        return path, len(fp), entry_point or 0, found
+
+
+def report(path, size, offset, found):
+    """Logs the result of scan_file, the events of a file are never mixed
+    with the ones of other files"""
+    with log.ctx(ACT_SCANFILE, {'path': path}):
+        with log.ctx(ACT_CALCOFFSET):
+            if offset is None:
+                log.error(ERR_WRONGFMT, size=size)
+                return
+            log.ok(offset=offset)
+        with log.ctx(ACT_SEARCHSIGNS):
+            for n, (pos, name) in enumerate(found):
+                log.success(n=n, pos=pos, name=name)
+            if not found:
+                log.error(ERR_NOTFOUND)
+
+
 def _pescan():
+    global _DB, _DB_PATH, _DB_STAMP
     opts = docopt(__doc__)
     emitter = opts['--log']
     if emitter is None or emitter == 'human':
@@ -153,34 +307,38 @@ def _pescan():
         emitter = log.emit_simple
     else:
         raise ValueError("Unknown log type")
-    #
-    pysec.init("PEscan", emitter=emitter)
-    #
-    db_path = os.path.abspath(opts['--db'])
-    paths = opts['<PATH>']
-    #
-    db = load_db(db_path)
-    for path in paths:
-        path = os.path.abspath(path)
-        for path in glob.iglob(path):
-            if not os.path.isfile(path):
-                continue
-            with log.ctx(ACT_SCANFILE, {'path': path}), \
-                 fd.File.open(path, fd.FO_READEX) as fp:
-                with log.ctx(ACT_CALCOFFSET):
-                    offset = get_offset(fp)
-                    if offset is None:
-                        log.error(ERR_WRONGFMT, size=len(fp))
-                        continue
-                    log.ok(offset=offset)
-                with log.ctx(ACT_SEARCHSIGNS):
-                    n = -1
-                    for n, (pos, pattern, name) in enumerate(binary.byte_msearch(fp, db, offset)):
-                        log.success(n=n, pos=pos, name=name)
-                    if n == -1:
-                        log.error(ERR_NOTFOUND)
+    jobs = int(opts['--jobs'])
+    if jobs < 1:
+        raise ValueError("Wrong number of jobs: %d" % jobs)
+    _DB_PATH = db_path = os.path.abspath(opts['--db'])
+    _DB_STAMP = stamp = db_stamp(db_path)
+    paths = iter_paths(opts['<PATH>'])
+    # the workers can't be started after pysec.init, multiprocessing opens
+    # os.devnull with the builtin open
+    pool = Pool(jobs, _init_worker, (stamp,)) if jobs > 1 else None
+    try:
+        #
+        pysec.init("PEscan", emitter=emitter)
+        #
+        _DB, stored = load_cdb(db_path, stamp)
+        # the workers can't use compiled databases that couldn't be updated
+        if pool is None or not stored:
+            for path in paths:
+                report(*scan_file(path))
+        else:
+            for result in pool.imap_unordered(scan_file, paths, 16):
+                report(*result)
+    except:
+        if pool is not None:
+            pool.terminate()
+        raise
+    else:
+        if pool is not None:
+            pool.close()
+    finally:
+        if pool is not None:
+            pool.join()
 
 
 if __name__ == '__main__':
     _pescan()
-